@@ -1,13 +1,23 @@
+import asyncio
+
 from aiogram import Bot, Dispatcher
 
+from bot.metrics import STATE_ENTRIES
+from bot.openai_service import LLM_BREAKER, LLM_GATE
+from bot.ops import LoopLagMonitor, OpsServer, PollingWatch
 from bot.routers.groups import setup_group_router
 from bot.routers.private import router as private_router
 from bot.routers.reactions import router as reactions_router
-from bot.routers.shared import setup_shared, start_idle_monitor
+from bot.routers.shared import CFG, RATE, setup_shared, start_idle_monitor, start_phrase_pool_refill
+from bot.services.send_queue import OUTBOX
+from bot.services.state_backend import create_state_backend, state_flush_loop
+from bot.services.state_store import attach_backend
+from bot.tracing import TraceMiddleware
 
 
 def build_app(bot: Bot) -> Dispatcher:
     dp = Dispatcher()
+    dp.update.outer_middleware(TraceMiddleware(CFG.trace_sample_rate))
     setup_shared(bot)
     setup_group_router(dp, bot)
     dp.include_router(private_router)
@@ -15,7 +25,57 @@ def build_app(bot: Bot) -> Dispatcher:
     return dp
 
 
-def start_background_tasks(bot: Bot):
-    return start_idle_monitor(bot)
+def build_ops_server(bot: Bot) -> OpsServer:
+    """Wire the readiness checks and the debug snapshot for this process.
+
+    In polling mode ``updates`` watches ``getUpdates`` through a session middleware; in
+    webhook mode the ops routes share the webhook's listener, so answering at all shows
+    the ingress is up.
+    """
+    checks = {
+        # half-open counts as ready, so traffic can come back and probe the API
+        "llm": lambda: LLM_BREAKER.state != "open",
+        "send_queue": lambda: OUTBOX.depth() < CFG.ready_max_send_queue,
+    }
+    if CFG.update_mode == "polling":
+        watch = PollingWatch()
+        bot.session.middleware(watch)
+        checks["updates"] = lambda: watch.alive(CFG.ready_update_stale_sec)
+    return OpsServer(
+        LoopLagMonitor(),
+        checks,
+        max_loop_lag_sec=CFG.health_max_loop_lag_sec,
+        debug_state=_state_sizes if CFG.ops_debug else None,
+    )
+
+
+def _state_sizes() -> dict:
+    sizes = {s.labels["store"]: int(s.value) for metric in STATE_ENTRIES.collect() for s in metric.samples}
+    return {
+        "state_entries": sizes,
+        "llm_in_flight": LLM_GATE.active,
+        "llm_queued": LLM_GATE.queued,
+        "llm_breaker": LLM_BREAKER.state,
+        "send_queue": OUTBOX.depth(),
+    }
+
+
+async def open_state_backend():
+    """Open the configured backend and restore all persistent stores with one bulk read.
+
+    A shared (Redis) backend is also attached to the rate limiter, so limits hold across instances.
+    """
+    backend = create_state_backend(CFG.state_backend, CFG.state_db_path, CFG.redis_url)
+    await backend.open()
+    attach_backend(backend, await backend.load_all())
+    RATE.backend = backend
+    return backend
+
+
+def start_background_tasks(bot: Bot, state_backend=None):
+    tasks = [OUTBOX.start(), start_idle_monitor(bot, state_backend), start_phrase_pool_refill()]
+    if state_backend is not None:
+        tasks.append(asyncio.create_task(state_flush_loop(state_backend, CFG.state_flush_interval_sec)))
+    return tasks
 
 
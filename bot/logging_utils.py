@@ -1,24 +1,158 @@
 import json
 import logging
-from datetime import UTC, datetime
+import logging.handlers
+import queue
+import time
+from contextvars import ContextVar
+from typing import IO
+
+from bot.metrics import LOG_RECORDS_DROPPED
+
+try:  # optional fast encoder
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Correlation ID of the update being handled; set by bot.tracing and stamped on every record.
+correlation_id: ContextVar[str | None] = ContextVar("correlation_id", default=None)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def _dumps(payload: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = correlation_id.get()
+        return True
+
+
+class RepeatedErrorFilter(logging.Filter):
+    """Rate-limits repeats of the same warning/error (same logger and message template).
+
+    Each template passes ``burst`` times per ``window_sec``; after that only every
+    ``sample_every``-th repeat gets through. The first record let through in a new window
+    carries the number of suppressed repeats as ``suppressed``.
+    """
+
+    def __init__(self, burst: int = 5, window_sec: float = 60.0, sample_every: int = 50):
+        super().__init__()
+        self.burst = burst
+        self.window_sec = window_sec
+        self.sample_every = max(1, sample_every)
+        self._seen: dict[tuple[str, str], list[float | int]] = {}  # key -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, str(record.msg))  # msg may be any object, including unhashable ones
+        state = self._seen.get(key)
+        if state is None or now - state[0] >= self.window_sec:
+            if state is not None and state[2]:
+                record.suppressed = state[2]
+            if len(self._seen) > 1000:
+                self._seen.clear()
+            self._seen[key] = [now, 1, 0]
+            return True
+        state[1] += 1
+        if state[1] <= self.burst or (state[1] - self.burst) % self.sample_every == 0:
+            return True
+        state[2] += 1
+        LOG_RECORDS_DROPPED.labels(reason="rate_limited").inc()
+        return False
 
 
 class JsonFormatter(logging.Formatter):
+    _ts_second: int = -1
+    _ts_prefix: str = ""
+
+    def _timestamp(self, created: float) -> str:
+        # strftime once per second; records are stamped when created, not when written
+        second = int(created)
+        if second != self._ts_second:
+            self._ts_prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._ts_second = second
+        return f"{self._ts_prefix}.{int((created - second) * 1_000_000):06d}+00:00"
+
     def format(self, record: logging.LogRecord) -> str:
         payload = {
-            "ts": datetime.now(UTC).isoformat(),
+            "ts": self._timestamp(record.created),
             "level": record.levelname,
             "msg": record.getMessage(),
             "logger": record.name,
         }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            payload["trace_id"] = trace_id
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            payload["suppressed"] = suppressed
         if hasattr(record, "extra") and isinstance(record.extra, dict):
             payload.update(record.extra)
-        return json.dumps(payload, ensure_ascii=False)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return _dumps(payload)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a queue without blocking; beyond ``maxsize`` queued records new ones are dropped and counted."""
+
+    def __init__(self, q: queue.SimpleQueue, maxsize: int):
+        super().__init__(q)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # freeze the message but leave JSON encoding and traceback formatting to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+            return
+        self.queue.put_nowait(record)
 
-def configure_json_logging(level: int = logging.INFO) -> None:
-    handler = logging.StreamHandler()
-    handler.setFormatter(JsonFormatter())
+
+def configure_json_logging(
+    level: int = logging.INFO,
+    queued: bool = False,
+    queue_size: int = 10_000,
+    error_burst: int = 5,
+    error_window_sec: float = 60.0,
+    error_sample_every: int = 50,
+    stream: IO[str] | None = None,
+) -> None:
+    """Log JSON lines to ``stream`` (stderr by default).
+
+    With ``queued`` the event loop only filters and enqueues records; formatting and I/O
+    happen on a listener thread (stop it with :func:`shutdown_logging`). Repeated
+    warnings/errors are rate-limited in both modes.
+    """
+    global _listener
+    shutdown_logging()
+    # the JSON lines never show thread or process, so don't collect them per record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    if queued:
+        q: queue.SimpleQueue = queue.SimpleQueue()
+        handler: logging.Handler = DroppingQueueHandler(q, queue_size)
+        _listener = logging.handlers.QueueListener(q, output)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(RepeatedErrorFilter(error_burst, error_window_sec, error_sample_every))
+    handler.addFilter(CorrelationFilter())
     root = logging.getLogger()
     root.setLevel(level)
     # remove existing handlers to avoid duplicate logs
@@ -27,7 +161,13 @@ def configure_json_logging(level: int = logging.INFO) -> None:
     root.addHandler(handler)
 
 
-def log_with_context(level: int, message: str, **ctx) -> None:
-    logging.log(level, message, extra={"extra": ctx})
+def shutdown_logging() -> None:
+    """Flush and stop the queue listener, if one is running."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
+def log_with_context(level: int, message: str, **ctx) -> None:
+    logging.log(level, message, extra={"extra": ctx})
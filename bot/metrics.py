@@ -1,15 +1,43 @@
-from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client import Counter, Gauge, Histogram
 
 REQUESTS = Counter("bot_requests_total", "Total incoming requests", ["type"])  # text, sticker, gif, reaction
 RESPONSES = Counter("bot_responses_total", "Total responses sent", ["type"])  # text, sticker
-ERRORS = Counter("bot_errors_total", "Total errors", ["kind"])  # openai, telegram, unexpected
+ERRORS = Counter("bot_errors_total", "Total errors", ["kind"])  # openai, ratelimit, overloaded, circuit_open, telegram, unexpected
 RATE_LIMITED = Counter("bot_rate_limited_total", "Total rate-limited events")
-LLM_LATENCY = Histogram("bot_llm_latency_seconds", "LLM response latency seconds")
+LLM_LATENCY = Histogram("bot_llm_latency_seconds", "Whole LLM request latency including slot waits, retries and backoff", ["call_site"])
+LLM_ATTEMPT_LATENCY = Histogram("bot_llm_attempt_seconds", "Latency of a single LLM API attempt", ["call_site"])
+LLM_CALLS = Counter("bot_llm_calls_total", "LLM requests by final outcome", ["call_site", "outcome"])  # ok, error, overloaded, cancelled
+LLM_RETRIES = Counter("bot_llm_retries_total", "LLM attempts retried after an error", ["call_site"])
+LLM_ERRORS = Counter("bot_llm_errors_total", "Failed LLM attempts by exception class", ["call_site", "error"])
+LLM_TOKENS_TOTAL = Counter("bot_llm_tokens_total", "Tokens reported by the API", ["call_site", "kind"])  # input, output
+LLM_IN_FLIGHT = Gauge("bot_llm_in_flight", "LLM calls holding an execution slot")
+LLM_QUEUE_DEPTH = Gauge("bot_llm_queue_depth", "LLM calls waiting for an execution slot")
+LLM_QUEUE_WAIT = Histogram("bot_llm_queue_wait_seconds", "Time an LLM call waited for an execution slot", ["request_class"])  # private, group, reaction, background
+LLM_CLASS_LATENCY = Histogram("bot_llm_request_seconds", "LLM call latency including the wait for a slot", ["request_class"])
+LLM_REJECTED = Counter("bot_llm_rejected_total", "LLM calls rejected by admission control", ["reason"])  # queue_full, deadline, timeout, circuit_open
+LLM_HEDGES = Counter("bot_llm_hedges_total", "LLM requests that got a hedged second attempt", ["call_site"])
+LLM_HEDGE_WINS = Counter("bot_llm_hedge_wins_total", "Hedged LLM requests answered by the hedge", ["call_site"])
+LLM_HEDGE_DELAY = Gauge("bot_llm_hedge_delay_seconds", "Current wait before an LLM request is hedged", ["model"])
+LLM_BREAKER_STATE = Gauge("bot_llm_breaker_state", "LLM circuit breaker state: 0 closed, 1 half-open, 2 open")
+LLM_BREAKER_TRANSITIONS = Counter("bot_llm_breaker_transitions_total", "LLM circuit breaker state changes", ["to"])  # open, half_open, closed
+_TOKEN_BUCKETS = (25, 50, 100, 200, 400, 800, 1600, 3200, 6400)
+LLM_TOKENS_ESTIMATED = Histogram("bot_llm_input_tokens_estimated", "Locally estimated input tokens per LLM request", ["budget"], buckets=_TOKEN_BUCKETS)
+LLM_TOKENS = Histogram("bot_llm_request_tokens", "Tokens per LLM request as reported by the API", ["budget", "kind"], buckets=_TOKEN_BUCKETS)  # input, output
+STAGE_LATENCY = Histogram("bot_stage_seconds", "Duration of one stage of a traced update (sampled)", ["stage"])  # rate_limit, typing, state, prompt, llm, llm_queue, llm_backoff, send, sticker, total
+LOG_RECORDS_DROPPED = Counter("bot_log_records_dropped_total", "Log records not written", ["reason"])  # queue_full, rate_limited
 ACTIVE_CHATS = Gauge("bot_active_chats", "Number of chats seen in the last window")
-
-
-def start_metrics_server(port: int = 9000):
-    start_http_server(port)
-
-
-
+REMINDER_FANOUT_SECONDS = Histogram("bot_reminder_fanout_seconds", "Time to deliver one batch of reminders", ["kind"])  # idle, weekly
+REMINDER_SEND_FAILURES = Counter("bot_reminder_send_failures_total", "Reminder sends that failed", ["kind"])
+SEND_QUEUE_DEPTH = Gauge("bot_send_queue_depth", "Outbound Telegram sends waiting in the queue")
+SEND_QUEUE_WAIT = Histogram("bot_send_queue_wait_seconds", "Time an outbound send waited in the queue", ["priority"])  # reply, sticker, reminder
+SEND_RETRY_AFTER = Counter("bot_send_retry_after_total", "Telegram RetryAfter (429) responses on outbound sends")
+STATE_ENTRIES = Gauge("bot_state_entries", "Entries held in bounded in-memory state stores", ["store"])
+RESPONSE_CACHE_HITS = Counter("bot_response_cache_hits_total", "LLM response cache hits")
+RESPONSE_CACHE_MISSES = Counter("bot_response_cache_misses_total", "LLM response cache misses")
+RESPONSE_CACHE_EVICTIONS = Counter("bot_response_cache_evictions_total", "LLM response cache evictions", ["reason"])  # ttl, lru
+COALESCE_BATCH_SIZE = Histogram("bot_coalesce_batch_size", "Prompts merged into one LLM request", buckets=(1, 2, 3, 4, 5, 8, 13))
+TRIAGE = Counter("bot_triage_total", "Group messages checked for being addressed to the bot", ["result"])  # accepted, rejected
+WEBHOOK_UPDATES = Counter("bot_webhook_updates_total", "Updates received over the webhook", ["result"])  # accepted, unauthorized, invalid
+LEADER = Gauge("bot_leader", "1 while this instance holds the lease for a singleton job", ["lease"])  # idle_monitor
+WEBHOOK_IN_FLIGHT = Gauge("bot_webhook_in_flight", "Webhook updates acknowledged and still being processed")
+EVENT_LOOP_LAG = Gauge("bot_event_loop_lag_seconds", "How late the event loop last woke up the lag monitor")
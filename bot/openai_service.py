@@ -1,64 +1,498 @@
+import asyncio
+import copy
+import inspect
+import json
 import logging
 import time
-from collections.abc import Sequence
+from collections.abc import AsyncIterator, Sequence
+from dataclasses import dataclass
+from typing import Any
 
-from openai import OpenAI, OpenAIError, RateLimitError
+from openai import AsyncOpenAI, BadRequestError, OpenAIError, RateLimitError
 
+from bot.metrics import (
+    LLM_ATTEMPT_LATENCY,
+    LLM_CALLS,
+    LLM_ERRORS,
+    LLM_HEDGE_WINS,
+    LLM_HEDGES,
+    LLM_LATENCY,
+    LLM_RETRIES,
+    LLM_TOKENS,
+    LLM_TOKENS_ESTIMATED,
+    LLM_TOKENS_TOTAL,
+)
+from bot.services.admission import AdmissionGate, Overloaded
+from bot.services.circuit_breaker import CircuitBreaker, counts_as_failure
+from bot.services.hedging import HedgePolicy
+from bot.services.token_budget import TokenBudget, TokenEstimator, estimate_tokens, trim_to_tokens
+from bot.tracing import add_stage, annotate, span
 from config import load_config
 
 CFG = load_config()
 
+# Every LLM call in the process takes a slot here; see AdmissionGate.
+LLM_GATE = AdmissionGate(
+    limit=CFG.llm_max_concurrency,
+    max_queue=CFG.llm_max_queue,
+    deadline_sec=CFG.llm_queue_deadline_sec,
+    weights={
+        "private": CFG.llm_weight_private,
+        "group": CFG.llm_weight_group,
+        "reaction": CFG.llm_weight_reaction,
+        "background": CFG.llm_weight_background,
+    },
+)
+
+# Shared by every call site: while the API is failing, attempts are refused without a network call.
+LLM_BREAKER = CircuitBreaker(
+    window_sec=CFG.breaker_window_sec,
+    min_calls=CFG.breaker_min_calls,
+    failure_ratio=CFG.breaker_failure_ratio,
+    slow_call_sec=CFG.breaker_slow_call_sec,
+    slow_ratio=CFG.breaker_slow_ratio,
+    open_sec=CFG.breaker_open_sec,
+    half_open_probes=CFG.breaker_half_open_probes,
+)
+
+# Hedge timing and budget, shared so latency stats cover every call site.
+LLM_HEDGE = HedgePolicy(
+    quantile=CFG.hedge_quantile,
+    min_delay_sec=CFG.hedge_min_delay_sec,
+    initial_delay_sec=CFG.hedge_initial_delay_sec,
+    max_ratio=CFG.hedge_max_ratio,
+)
+# Only someone waiting on the answer is worth a second request.
+HEDGED_CLASSES = frozenset({"private", "group", "reaction"})
+
+# Input/output caps by kind of answer; pass the key as ``budget=`` to the ask methods.
+TOKEN_BUDGETS: dict[str, TokenBudget] = {
+    "private": TokenBudget(CFG.max_input_tokens, CFG.max_output_tokens_private),
+    "group": TokenBudget(CFG.max_input_tokens, CFG.max_output_tokens_group),
+    "poll": TokenBudget(CFG.max_input_tokens, CFG.max_output_tokens_poll),
+    "reminder": TokenBudget(CFG.max_input_tokens, CFG.max_output_tokens_reminder),
+    "phrases": TokenBudget(CFG.max_input_tokens, CFG.max_output_tokens_phrases),
+}
+
+# One AsyncOpenAI client (and therefore one keep-alive HTTP pool) per process.
+_shared_client: AsyncOpenAI | None = None
+
+
+def get_shared_client() -> AsyncOpenAI:
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = AsyncOpenAI(api_key=CFG.openai_api_key)
+    return _shared_client
+
+
+async def close_shared_client() -> None:
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.close()
+        _shared_client = None
+
+
+def split_messages(messages: Sequence[dict]) -> tuple[str | None, str]:
+    system_prompt = None
+    user_texts: list[str] = []
+    for msg in messages:
+        role = msg.get("role")
+        content = msg.get("content", "")
+        if role == "system":
+            system_prompt = content
+        elif role == "user":
+            user_texts.append(str(content))
+    user_input = "\n\n".join(user_texts) if user_texts else ""
+    return system_prompt, user_input
+
+
+def _log_attempt_error(e: Exception, attempt: int, max_retries: int) -> None:
+    if isinstance(e, RateLimitError):
+        kind = "rate limit"
+    elif isinstance(e, OpenAIError):
+        kind = "SDK error"
+    else:
+        kind = "unexpected error"
+    logging.warning("OpenAI %s on attempt %d/%d: %s", kind, attempt, max_retries, str(e)[:200])
+
+
+class _CallMetrics:
+    """Instrumentation of one LLM request: attempts, retries, errors, tokens and the overall outcome."""
+
+    __slots__ = ("call_site", "started", "outcome")
+
+    def __init__(self, call_site: str):
+        self.call_site = call_site
+        self.started = time.monotonic()
+        self.outcome = "error"  # ok, error, overloaded, cancelled
+
+    def attempt_done(self, start: float) -> float:
+        elapsed = time.monotonic() - start
+        LLM_ATTEMPT_LATENCY.labels(call_site=self.call_site).observe(elapsed)
+        return elapsed
+
+    def failed(self, e: Exception, attempt: int, max_retries: int) -> None:
+        LLM_ERRORS.labels(call_site=self.call_site, error=type(e).__name__).inc()
+        _log_attempt_error(e, attempt, max_retries)
+
+    def retry(self) -> None:
+        LLM_RETRIES.labels(call_site=self.call_site).inc()
+
+    def record_usage(self, budget: str | None, usage: Any) -> None:
+        if usage is None:
+            return
+        for kind in ("input", "output"):
+            value = getattr(usage, f"{kind}_tokens", None)
+            if isinstance(value, int):
+                LLM_TOKENS.labels(budget=budget or "none", kind=kind).observe(value)
+                LLM_TOKENS_TOTAL.labels(call_site=self.call_site, kind=kind).inc(value)
+
+    def finish(self) -> None:
+        LLM_LATENCY.labels(call_site=self.call_site).observe(time.monotonic() - self.started)
+        LLM_CALLS.labels(call_site=self.call_site, outcome=self.outcome).inc()
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    instruction: str
+    max_len: int
+
+    @property
+    def prompt(self) -> str:
+        """The instruction with its length limit, as sent to the model."""
+        return f"{self.instruction} (до {self.max_len} символов)"
+
+
+def fields_json_schema(fields: dict[str, FieldSpec], name: str = "fields") -> dict:
+    return {
+        "type": "json_schema",
+        "name": name,
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {k: {"type": "string", "description": spec.prompt} for k, spec in fields.items()},
+            "required": list(fields),
+            "additionalProperties": False,
+        },
+    }
+
+
+def parse_fields(raw: str, fields: dict[str, FieldSpec]) -> dict[str, str]:
+    """Validate a structured-output JSON object; raises ``ValueError`` on anything unusable."""
+    data = json.loads(raw or "")
+    if not isinstance(data, dict):
+        raise ValueError("structured output is not an object")
+    out: dict[str, str] = {}
+    for name, spec in fields.items():
+        value = data.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"field {name!r} missing or empty")
+        out[name] = value.strip()[: spec.max_len]
+    return out
+
 
 class OpenAIService:
-    def __init__(self, client: OpenAI | None = None):
-        self.client = client or OpenAI(api_key=CFG.openai_api_key)
+    def __init__(self, client: Any | None = None, gate: AdmissionGate | None = None,
+                 estimator: TokenEstimator | None = None, budgets: dict[str, TokenBudget] | None = None,
+                 breaker: CircuitBreaker | None = None, models: Sequence[str] | None = None,
+                 hedge: HedgePolicy | None = None):
+        # ``client`` may be a sync or async OpenAI-compatible client; by default the
+        # process-wide AsyncOpenAI is used (resolved lazily so imports stay cheap).
+        self._client = client
+        self.gate = gate or LLM_GATE
+        self.breaker = breaker or LLM_BREAKER
+        self.models = list(models or (CFG.openai_model, *CFG.openai_fallback_models))
+        self.hedge = hedge or (LLM_HEDGE if CFG.enable_hedging else None)
+        self.estimator = estimator or estimate_tokens
+        self.budgets = TOKEN_BUDGETS if budgets is None else budgets
 
-    def ask(self, messages: Sequence[dict], model: str | None = None, *, timeout_sec: float = 30.0,
-            max_retries: int = 3, backoff_base: float = 0.6) -> str:
-        system_prompt = None
-        user_texts: list[str] = []
-        for msg in messages:
-            role = msg.get("role")
-            content = msg.get("content", "")
-            if role == "system":
-                system_prompt = content
-            elif role == "user":
-                user_texts.append(str(content))
-        user_input = "\n\n".join(user_texts) if user_texts else ""
-
-        use_model = (model or CFG.openai_model)
+    @property
+    def client(self) -> Any:
+        return self._client if self._client is not None else get_shared_client()
 
+    def _apply_budget(self, system_prompt: str | None, user_input: str, budget: str | None) -> tuple[str, dict[str, Any]]:
+        """Trim ``user_input`` to the budget's input cap; returns it with the extra ``create()`` arguments."""
+        extra: dict[str, Any] = {}
+        spec = self.budgets.get(budget) if budget else None
+        if spec is not None:
+            if self.estimator(user_input) > spec.max_input_tokens:
+                logging.info("llm_prompt_trimmed budget=%s", budget)
+                user_input = trim_to_tokens(user_input, spec.max_input_tokens, self.estimator)
+            extra["max_output_tokens"] = spec.max_output_tokens
+        estimated = self.estimator(system_prompt or "") + self.estimator(user_input)
+        LLM_TOKENS_ESTIMATED.labels(budget=budget or "none").observe(estimated)
+        return user_input, extra
+
+    def _settle(self, probe: bool, failed: bool | None, seconds: float) -> None:
+        if failed is None:
+            self.breaker.abandon(probe)
+        else:
+            self.breaker.record(failed, seconds, probe)
+
+    async def ask_async(self, messages: Sequence[dict], model: str | None = None, *, timeout_sec: float = 30.0,
+                        max_retries: int = 3, backoff_base: float = 0.6, text_format: dict | None = None,
+                        queue_deadline_sec: float | None = None, chat_id: int | None = None,
+                        request_class: str = "background", budget: str | None = None, call_site: str = "other") -> str:
+        """Single Responses API call with retries; each attempt waits for a slot in :attr:`gate`.
+
+        Slots are shared fairly between chats (``chat_id``), weighted by ``request_class``.
+        ``budget`` names an entry of :attr:`budgets` that caps the input and ``max_output_tokens``;
+        ``call_site`` labels the request's metrics (latency per attempt and overall, retries, errors, tokens).
+        Retries walk down the model chain (``model``, then :attr:`models` after the first). Requests of
+        a user-facing class are hedged per :attr:`hedge`: when an attempt is slower than its model's
+        usual tail, the next model in the chain is asked too and the first answer wins.
+        Raises :class:`Overloaded` without retrying if no slot frees up within ``queue_deadline_sec``,
+        and its subclass :class:`CircuitOpen` while :attr:`breaker` refuses calls.
+        """
+        system_prompt, user_input = split_messages(messages)
+        chain = self._chain(model)
+        user_input, extra = self._apply_budget(system_prompt, user_input, budget)
+        if text_format:
+            extra["text"] = {"format": text_format}
+        request = {"instructions": system_prompt, "input": user_input, "timeout": timeout_sec, **extra}
+        hedged = self.hedge is not None and request_class in HEDGED_CLASSES
+        if hedged:
+            self.hedge.earn()
+
+        call = _CallMetrics(call_site)
         last_exc: Exception | None = None
-        for attempt in range(1, max_retries + 1):
-            start = time.monotonic()
-            try:
-                resp = self.client.responses.create(
-                    model=use_model,
-                    instructions=system_prompt,
-                    input=user_input,
-                    timeout=timeout_sec,
-                )
-                return resp.output_text
-            except RateLimitError as e:
-                last_exc = e
-                logging.warning("OpenAI rate limit on attempt %d/%d: %s", attempt, max_retries, str(e)[:200])
-            except OpenAIError as e:
-                last_exc = e
-                logging.warning("OpenAI SDK error on attempt %d/%d: %s", attempt, max_retries, str(e)[:200])
-            except Exception as e:
-                last_exc = e
-                logging.warning("OpenAI unexpected error on attempt %d/%d: %s", attempt, max_retries, str(e)[:200])
-            finally:
-                elapsed = time.monotonic() - start
-                if elapsed > timeout_sec:
-                    logging.info("OpenAI call exceeded timeout: %.2fs", elapsed)
+        try:
+            for attempt in range(1, max_retries + 1):
+                use_model = chain[min(attempt - 1, len(chain) - 1)]
+                try:
+                    slot = {"queue_deadline_sec": queue_deadline_sec, "chat_id": chat_id, "request_class": request_class}
+                    if hedged:
+                        hedge_model = chain[min(attempt, len(chain) - 1)]
+                        resp = await self._first_answer(call, use_model, hedge_model, request, slot)
+                    else:
+                        resp = await self._attempt(call, use_model, request, slot)
+                    call.record_usage(budget, getattr(resp, "usage", None))
+                    call.outcome = "ok"
+                    return resp.output_text
+                except Overloaded:
+                    call.outcome = "overloaded"
+                    raise
+                except Exception as e:
+                    last_exc = e
+                    call.failed(e, attempt, max_retries)
 
-            if attempt < max_retries:
-                sleep_s = backoff_base * (2 ** (attempt - 1))
-                time.sleep(sleep_s)
+                if attempt < max_retries:
+                    call.retry()
+                    sleep_s = backoff_base * (2 ** (attempt - 1))
+                    with span("llm_backoff"):
+                        await asyncio.sleep(sleep_s)
+        except (asyncio.CancelledError, GeneratorExit):
+            call.outcome = "cancelled"
+            raise
+        finally:
+            call.finish()
 
         if last_exc:
             raise last_exc
         return ""
 
+    def _chain(self, model: str | None) -> list[str]:
+        first = model or self.models[0]
+        return [first, *(m for m in self.models[1:] if m != first)]
+
+    async def _attempt(self, call: _CallMetrics, model: str, request: dict[str, Any], slot: dict[str, Any]) -> Any:
+        """One API call holding a gate slot; feeds the breaker and, on success, the hedge latency stats."""
+        start: float | None = None
+        probe = False
+        failed: bool | None = None  # the breaker's verdict; None if the API was not reached
+        queued_at = time.monotonic()
+        try:
+            probe = self.breaker.acquire()
+            async with self.gate.slot(slot["queue_deadline_sec"], flow=slot["chat_id"], request_class=slot["request_class"]):
+                start = time.monotonic()
+                add_stage("llm_queue", start - queued_at)
+                resp = self.client.responses.create(model=model, **request)
+                if inspect.isawaitable(resp):
+                    resp = await resp
+                failed = False
+            return resp
+        except Exception as e:
+            if start is not None:
+                failed = counts_as_failure(e)
+            raise
+        finally:
+            elapsed = 0.0
+            if start is not None:
+                elapsed = call.attempt_done(start)
+                if elapsed > request["timeout"]:
+                    logging.info("OpenAI call exceeded timeout: %.2fs", elapsed)
+                if failed is False and self.hedge is not None:
+                    self.hedge.observe(model, elapsed)
+            self._settle(probe, failed, elapsed)
+
+    async def _first_answer(self, call: _CallMetrics, model: str, hedge_model: str,
+                            request: dict[str, Any], slot: dict[str, Any]) -> Any:
+        """Run :meth:`_attempt`, hedged with ``hedge_model`` once it outlasts the hedge delay.
+
+        The first successful response wins and the other attempt is cancelled; if both fail,
+        the primary's error is raised. No hedge is sent while the breaker is not closed, while
+        LLM calls are queueing, or when the hedge budget is spent.
+        """
+        primary = asyncio.create_task(self._attempt(call, model, request, slot))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge.delay(model))
+            if done or not self._may_hedge():
+                return await primary
+            LLM_HEDGES.labels(call_site=call.call_site).inc()
+            annotate(hedged=True)
+            hedge = asyncio.create_task(self._attempt(call, hedge_model, request, slot))
+            pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            LLM_HEDGE_WINS.labels(call_site=call.call_site).inc()
+                        return task.result()
+            return primary.result()  # both failed
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    def _may_hedge(self) -> bool:
+        if self.breaker.state != "closed" or self.gate.queued > 0 or self.gate.active >= self.gate.limit:
+            return False
+        return self.hedge.spend()
+
+    async def stream_async(self, messages: Sequence[dict], model: str | None = None, *, timeout_sec: float = 30.0,
+                           max_retries: int = 3, backoff_base: float = 0.6, queue_deadline_sec: float | None = None,
+                           chat_id: int | None = None, request_class: str = "background",
+                           budget: str | None = None, call_site: str = "other") -> AsyncIterator[str]:
+        """Yield output text deltas from a streamed Responses API call.
+
+        Retries only happen before the first delta and walk down the model chain like :meth:`ask_async`
+        (streams are not hedged); once text has been yielded a failure is re-raised as is.
+        The gate slot is held until the stream ends. Requires an async client.
+        """
+        system_prompt, user_input = split_messages(messages)
+        chain = self._chain(model)
+        user_input, extra = self._apply_budget(system_prompt, user_input, budget)
+
+        call = _CallMetrics(call_site)
+        last_exc: Exception | None = None
+        try:
+            for attempt in range(1, max_retries + 1):
+                use_model = chain[min(attempt - 1, len(chain) - 1)]
+                yielded = False
+                start: float | None = None
+                first_delta_at: float | None = None
+                probe = False
+                failed: bool | None = None  # the breaker's verdict; None if the API was not reached
+                queued_at = time.monotonic()
+                try:
+                    probe = self.breaker.acquire()
+                    async with self.gate.slot(queue_deadline_sec, flow=chat_id, request_class=request_class):
+                        start = time.monotonic()
+                        add_stage("llm_queue", start - queued_at)
+                        stream = await self.client.responses.create(
+                            model=use_model,
+                            instructions=system_prompt,
+                            input=user_input,
+                            timeout=timeout_sec,
+                            stream=True,
+                            **extra,
+                        )
+                        async for event in stream:
+                            kind = getattr(event, "type", None)
+                            if kind == "response.output_text.delta" and event.delta:
+                                if first_delta_at is None:
+                                    first_delta_at = time.monotonic()
+                                yielded = True
+                                yield event.delta
+                            elif kind == "response.completed":
+                                call.record_usage(budget, getattr(getattr(event, "response", None), "usage", None))
+                        failed = False
+                    call.outcome = "ok"
+                    return
+                except Exception as e:
+                    if isinstance(e, Overloaded):
+                        call.outcome = "overloaded"
+                        raise
+                    if start is not None:
+                        failed = counts_as_failure(e)
+                    call.failed(e, attempt, max_retries)
+                    if yielded:
+                        raise
+                    last_exc = e
+                finally:
+                    # a stream is slow when its first delta is, not when the answer is long
+                    ttft = 0.0
+                    if start is not None:
+                        call.attempt_done(start)
+                        ttft = (first_delta_at or time.monotonic()) - start
+                    self._settle(probe, failed, ttft)
+
+                if attempt < max_retries:
+                    call.retry()
+                    with span("llm_backoff"):
+                        await asyncio.sleep(backoff_base * (2 ** (attempt - 1)))
+        except (asyncio.CancelledError, GeneratorExit):
+            call.outcome = "cancelled"
+            raise
+        finally:
+            call.finish()
+
+        if last_exc:
+            raise last_exc
+
+    async def ask_fields_async(self, system_prompt: str, fields: dict[str, FieldSpec], model: str | None = None, *,
+                               timeout_sec: float = 30.0, max_retries: int = 3, chat_id: int | None = None,
+                               request_class: str = "background", budget: str | None = None,
+                               call_site: str = "other") -> dict[str, str]:
+        """Generate several short texts in one structured-output request.
+
+        The model must return a JSON object with every field as a non-empty string; values over
+        ``max_len`` are cut. If the response does not validate, or the model rejects the request
+        (400, e.g. no ``json_schema`` support), each field is requested separately (concurrently)
+        with its own instruction. Other API errors are raised: with the API failing, more calls
+        would not help.
+        """
+        listing = "\n".join(f"- {name}: {spec.prompt}" for name, spec in fields.items())
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Верни JSON-объект со строковыми полями:\n{listing}"},
+        ]
+        try:
+            raw = await self.ask_async(messages, model, timeout_sec=timeout_sec, max_retries=max_retries, text_format=fields_json_schema(fields),
+                                       chat_id=chat_id, request_class=request_class, budget=budget, call_site=call_site)
+            return parse_fields(raw, fields)
+        except (ValueError, BadRequestError) as e:
+            logging.warning("structured_output_failed, falling back to per-field calls: %s", str(e)[:200])
+
+        async def _one(spec: FieldSpec) -> str:
+            text = await self.ask_async([
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": spec.prompt},
+            ], model, timeout_sec=timeout_sec, max_retries=max_retries, chat_id=chat_id, request_class=request_class, budget=budget,
+               call_site=f"{call_site}_field")
+            return (text or "").strip()[: spec.max_len]
+
+        values = await asyncio.gather(*(_one(spec) for spec in fields.values()))
+        return dict(zip(fields, values, strict=True))
+
+    def ask(self, messages: Sequence[dict], model: str | None = None, *, timeout_sec: float = 30.0,
+            max_retries: int = 3, backoff_base: float = 0.6) -> str:
+        """Blocking wrapper around :meth:`ask_async` for scripts and tests.
+
+        Without an injected client it opens its own AsyncOpenAI and closes it before the
+        temporary event loop ends; the shared client stays bound to the bot's loop.
+        """
+        async def _run() -> str:
+            if self._client is not None:
+                return await self.ask_async(messages, model, timeout_sec=timeout_sec, max_retries=max_retries, backoff_base=backoff_base)
+            own = copy.copy(self)
+            own._client = AsyncOpenAI(api_key=CFG.openai_api_key)
+            try:
+                return await own.ask_async(messages, model, timeout_sec=timeout_sec, max_retries=max_retries, backoff_base=backoff_base)
+            finally:
+                await own._client.close()
 
+        return asyncio.run(_run())
@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from bot.metrics import EVENT_LOOP_LAG
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task that sleeps ``interval_sec``.
+
+    The worst lag of the last ``window`` ticks is kept, so a stall is still visible to a
+    probe that arrives a few seconds later.
+    """
+
+    def __init__(self, interval_sec: float = 0.5, window: int = 10):
+        self.interval_sec = interval_sec
+        self._recent: deque[float] = deque(maxlen=window)
+        self._last_tick = time.monotonic()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._last_tick = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            now = time.monotonic()
+            lag = max(0.0, now - self._last_tick - self.interval_sec)
+            self._last_tick = now
+            self._recent.append(lag)
+            EVENT_LOOP_LAG.set(lag)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def current_lag(self) -> float:
+        # a tick that is overdue right now counts as well as the measured ones
+        return max(max(self._recent, default=0.0), time.monotonic() - self._last_tick - self.interval_sec)
+
+
+class PollingWatch(BaseRequestMiddleware):
+    """Bot session middleware that remembers when ``getUpdates`` last succeeded."""
+
+    def __init__(self):
+        self.last_ok: float | None = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        response = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            self.last_ok = time.monotonic()
+        return response
+
+    def alive(self, stale_sec: float) -> bool:
+        return self.last_ok is not None and time.monotonic() - self.last_ok < stale_sec
+
+
+class OpsServer:
+    """Liveness, readiness, metrics and debug endpoints served from the bot's event loop.
+
+    ``/healthz`` fails when the loop falls behind by more than ``max_loop_lag_sec`` (a
+    fully wedged loop does not answer at all, which the prober sees as a timeout).
+    ``/readyz`` runs every check in ``ready_checks`` and fails if any of them does.
+    ``/debug/state`` is only routed when ``debug_state`` is given.
+    """
+
+    def __init__(
+        self,
+        lag: LoopLagMonitor,
+        ready_checks: dict[str, Callable[[], bool]],
+        max_loop_lag_sec: float = 2.0,
+        debug_state: Callable[[], dict[str, Any]] | None = None,
+    ):
+        self.lag = lag
+        self.ready_checks = ready_checks
+        self.max_loop_lag_sec = max_loop_lag_sec
+        self.debug_state = debug_state
+
+    def attach(self, app: web.Application) -> web.Application:
+        """Add the ops routes to ``app`` and tie the lag monitor to its lifetime."""
+        app.router.add_get("/healthz", self.healthz)
+        app.router.add_get("/readyz", self.readyz)
+        app.router.add_get("/metrics", self.metrics)
+        if self.debug_state is not None:
+            app.router.add_get("/debug/state", self.state)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def start(self, port: int) -> web.AppRunner:
+        """Serve the ops endpoints alone on ``port``; call ``cleanup()`` on the returned runner to stop."""
+        runner = web.AppRunner(self.attach(web.Application()), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+        return runner
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self.lag.start()
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        await self.lag.stop()
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        lag = self.lag.current_lag()
+        ok = self.lag.running and lag <= self.max_loop_lag_sec
+        return web.json_response({"ok": ok, "loop_lag_ms": round(lag * 1000, 1)}, status=200 if ok else 503)
+
+    async def readyz(self, request: web.Request) -> web.Response:
+        checks = {name: bool(check()) for name, check in self.ready_checks.items()}
+        ok = all(checks.values())
+        return web.json_response({"ok": ok, "checks": checks}, status=200 if ok else 503)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+    async def state(self, request: web.Request) -> web.Response:
+        return web.json_response(self.debug_state())
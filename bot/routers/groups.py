@@ -1,4 +1,3 @@
-import asyncio
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
@@ -6,13 +5,23 @@ from aiogram import Bot, F, Router
 from aiogram.enums import ChatType, ContentType
 from aiogram.types import Message
 
-from bot.openai_service import OpenAIService
+from bot.openai_service import FieldSpec, OpenAIService
 from bot.prompts import SYSTEM_PROMPT
 from bot.routers import shared as shared_ctx
-from bot.routers.shared import handle_llm_request_shared
+from bot.routers.shared import submit_llm_request
+from bot.services.send_queue import OUTBOX
+from bot.services.state_store import ExpiringDict
+from bot.services.triage import AddressedToBot, resolve_bot_address
 
 _OAI = OpenAIService()
-_last_poll_on_date: dict[int, str] = {}
+# Shmel poll texts, generated in one structured-output request
+_SHMEL_POLL_FIELDS = {
+    "intro": FieldSpec("Сгенерируй короткое токсичное приглашение в бар ‘Шмель’ для чата; упомяни, что дальше будет голосовалка. Без префиксов.", 500),
+    "question": FieldSpec("Сгенерируй ОДНУ короткую язвительную строку-вопрос для голосовалки: идут ли в бар ‘Шмель’. Без кавычек и префиксов.", 120),
+    "tail_yes": FieldSpec("Сгенерируй КОРОТКИЙ токсичный хвост-обоснование для варианта 'иду'. Без кавычек.", 30),
+    "tail_no": FieldSpec("Сгенерируй КОРОТКИЙ токсичный хвост-обоснование для варианта 'не иду'. Без кавычек.", 30),
+}
+_last_poll_on_date = ExpiringDict("last_poll_on_date", ttl_sec=2 * 86400, max_entries=shared_ctx.CFG.state_max_chats, persistent=True)
 
 
 router = Router()
@@ -22,123 +31,104 @@ def setup_group_router(dp, bot: Bot):
     dp.include_router(router)
 
 
-@router.message(F.text & (F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP})))
-async def group_trigger(m: Message, bot: Bot):
+@router.message((F.text | F.caption) & (F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP})), AddressedToBot())
+async def group_trigger(m: Message, bot: Bot, bot_address: str | None = None):
     if m.from_user and m.from_user.is_bot:
         return
-    text = m.text or ""
-    if m.entities:
-        for e in m.entities:
-            if e.type == "mention":
-                mention = text[e.offset : e.offset + e.length]
-                me = await bot.get_me()
-                if mention.lower().lstrip("@") == me.username.lower():
-                    if m.reply_to_message:
-                        quoted = (m.reply_to_message.text or m.reply_to_message.caption or "").strip()
-                        if quoted:
-                            await handle_llm_request_shared(m, quoted, reply_to_id=m.reply_to_message.message_id)
-                            return
-                    is_forward = any([
-                        getattr(m, "forward_date", None),
-                        getattr(m, "forward_from", None),
-                        getattr(m, "forward_from_chat", None),
-                        getattr(m, "forward_sender_name", None),
-                        getattr(m, "forward_origin", None),
-                    ])
-                    if is_forward:
-                        forwarded_text = (m.text or m.caption or "").replace(mention, "").strip()
-                        if forwarded_text:
-                            await handle_llm_request_shared(m, forwarded_text, reply_to_id=m.message_id)
-                            return
-                    q = text.replace(mention, "").strip() or (m.reply_to_message.text if m.reply_to_message else "") or (m.caption or "")
-                    tl = (q or "").lower()
-                    if "шмел" in tl:
-                        today_key = datetime.now(ZoneInfo("Asia/Almaty")).date().isoformat()
-                        last_key = _last_poll_on_date.get(m.chat.id)
-                        if last_key == today_key:
-                            try:
-                                msg_texts = [
-                                    {"role": "system", "content": SYSTEM_PROMPT},
-                                    {"role": "user", "content": "Сгенерируй короткий токсичный ответ: сегодня уже голосовали по бару, хватит."},
-                                ]
-                                already = await asyncio.to_thread(_OAI.ask, msg_texts, shared_ctx.CFG.openai_model)
-                            except Exception:
-                                already = "Сегодня уже голосовали. Успокойся."
-                            await bot.send_message(chat_id=m.chat.id, text=already, reply_to_message_id=m.message_id)
-                            return
-                        try:
-                            intro_msgs = [
-                                {"role": "system", "content": SYSTEM_PROMPT},
-                                {"role": "user", "content": "Сгенерируй короткое токсичное приглашение в бар ‘Шмель’ для чата; упомяни, что дальше будет голосовалка. Без префиксов."},
-                            ]
-                            poll_msgs = [
-                                {"role": "system", "content": SYSTEM_PROMPT},
-                                {"role": "user", "content": "Сгенерируй ОДНУ короткую язвительную строку-вопрос для голосовалки: идут ли в бар ‘Шмель’. Без кавычек и префиксов. До 120 символов."},
-                            ]
-                            opt_yes_tail_msgs = [
-                                {"role": "system", "content": SYSTEM_PROMPT},
-                                {"role": "user", "content": "Сгенерируй КОРОТКИЙ токсичный хвост-обоснование для варианта 'иду' (до 30 символов). Без кавычек."},
-                            ]
-                            opt_no_tail_msgs = [
-                                {"role": "system", "content": SYSTEM_PROMPT},
-                                {"role": "user", "content": "Сгенерируй КОРОТКИЙ токсичный хвост-обоснование для варианта 'не иду' (до 30 символов). Без кавычек."},
-                            ]
-                            intro = await asyncio.to_thread(_OAI.ask, intro_msgs, shared_ctx.CFG.openai_model)
-                            question = await asyncio.to_thread(_OAI.ask, poll_msgs, shared_ctx.CFG.openai_model)
-                            tail_yes = await asyncio.to_thread(_OAI.ask, opt_yes_tail_msgs, shared_ctx.CFG.openai_model)
-                            tail_no = await asyncio.to_thread(_OAI.ask, opt_no_tail_msgs, shared_ctx.CFG.openai_model)
-                            if not intro or not intro.strip():
-                                raise ValueError("empty intro")
-                            if not question or not question.strip():
-                                raise ValueError("empty question")
-                            tail_yes = (tail_yes or "").strip()
-                            tail_no = (tail_no or "").strip()
-                        except Exception:
-                            intro = "Голосуем."
-                            question = "В бар ‘Шмель’ идёшь?"
-                            tail_yes = "иду"
-                            tail_no = "не иду"
-
-                        if not question:
-                            question = "В бар ‘Шмель’ идёшь?"
-                        if len(question) > 300:
-                            question = question[:300]
-                        tail_yes = (tail_yes or "").strip().strip('"').strip("'")
-                        tail_no = (tail_no or "").strip().strip('"').strip("'")
-                        opt_yes = f"иду — {tail_yes}" if tail_yes else "иду"
-                        opt_no = f"не иду — {tail_no}" if tail_no else "не иду"
-                        if len(opt_yes) > 50:
-                            opt_yes = opt_yes[:50]
-                        if len(opt_no) > 50:
-                            opt_no = opt_no[:50]
-
-                        try:
-                            msg_intro = await bot.send_message(chat_id=m.chat.id, text=intro, reply_to_message_id=m.message_id)
-                            shared_ctx._bot_messages_by_chat.setdefault(m.chat.id, set()).add(msg_intro.message_id)
-                        except Exception:
-                            pass
-
-                        try:
-                            poll = await bot.send_poll(
-                                chat_id=m.chat.id,
-                                question=question,
-                                options=[opt_yes, opt_no],
-                                is_anonymous=False,
-                                allows_multiple_answers=False,
-                            )
-                            shared_ctx._bot_messages_by_chat.setdefault(m.chat.id, set()).add(poll.message_id)
-                            _last_poll_on_date[m.chat.id] = today_key
-                        except Exception:
-                            try:
-                                msg_fallback = await bot.send_message(chat_id=m.chat.id, text=f"{question}\n\nВарианты: {opt_yes} / {opt_no}")
-                                shared_ctx._bot_messages_by_chat.setdefault(m.chat.id, set()).add(msg_fallback.message_id)
-                                _last_poll_on_date[m.chat.id] = today_key
-                            except Exception:
-                                pass
-                        return
-                    await handle_llm_request_shared(m, q, reply_to_id=m.message_id)
-                    return
-    
+    mention = bot_address or await resolve_bot_address(m, bot)
+    if mention is None:
+        return
+    text = m.text or m.caption or ""
+    # a reply to the bot's own answer is a follow-up: the handler pulls that answer from the context buffer
+    if m.reply_to_message and not await shared_ctx._bot_messages_by_chat.acontains(m.chat.id, m.reply_to_message.message_id):
+        quoted = (m.reply_to_message.text or m.reply_to_message.caption or "").strip()
+        if quoted:
+            await submit_llm_request(m, quoted, reply_to_id=m.reply_to_message.message_id)
+            return
+    is_forward = any([
+        getattr(m, "forward_date", None),
+        getattr(m, "forward_from", None),
+        getattr(m, "forward_from_chat", None),
+        getattr(m, "forward_sender_name", None),
+        getattr(m, "forward_origin", None),
+    ])
+    if is_forward:
+        forwarded_text = (m.text or m.caption or "").replace(mention, "").strip()
+        if forwarded_text:
+            await submit_llm_request(m, forwarded_text, reply_to_id=m.message_id)
+            return
+    q = text.replace(mention, "").strip() or (m.reply_to_message.text if m.reply_to_message else "") or (m.caption or "")
+    tl = (q or "").lower()
+    if "шмел" in tl:
+        today_key = datetime.now(ZoneInfo("Asia/Almaty")).date().isoformat()
+        # claimed up front so concurrent triggers (on any instance) start a single poll
+        if not await _last_poll_on_date.aclaim(m.chat.id, today_key):
+            already = shared_ctx.PHRASES.get("already_voted")
+            await OUTBOX.submit(bot.send_message, chat_id=m.chat.id, text=already, reply_to_message_id=m.message_id)
+            return
+        try:
+            fields = await _OAI.ask_fields_async(
+                SYSTEM_PROMPT,
+                _SHMEL_POLL_FIELDS,
+                shared_ctx.CFG.openai_model,
+                chat_id=m.chat.id,
+                request_class="group",
+                budget="poll",
+                call_site="poll",
+            )
+            intro = fields["intro"]
+            question = fields["question"]
+            tail_yes = fields["tail_yes"]
+            tail_no = fields["tail_no"]
+            if not intro or not intro.strip():
+                raise ValueError("empty intro")
+            if not question or not question.strip():
+                raise ValueError("empty question")
+            tail_yes = (tail_yes or "").strip()
+            tail_no = (tail_no or "").strip()
+        except Exception:
+            intro = "Голосуем."
+            question = "В бар ‘Шмель’ идёшь?"
+            tail_yes = "иду"
+            tail_no = "не иду"
+
+        if not question:
+            question = "В бар ‘Шмель’ идёшь?"
+        if len(question) > 300:
+            question = question[:300]
+        tail_yes = (tail_yes or "").strip().strip('"').strip("'")
+        tail_no = (tail_no or "").strip().strip('"').strip("'")
+        opt_yes = f"иду — {tail_yes}" if tail_yes else "иду"
+        opt_no = f"не иду — {tail_no}" if tail_no else "не иду"
+        if len(opt_yes) > 50:
+            opt_yes = opt_yes[:50]
+        if len(opt_no) > 50:
+            opt_no = opt_no[:50]
+
+        try:
+            msg_intro = await OUTBOX.submit(bot.send_message, chat_id=m.chat.id, text=intro, reply_to_message_id=m.message_id)
+            await shared_ctx._bot_messages_by_chat.aadd(m.chat.id, msg_intro.message_id)
+        except Exception:
+            pass
+
+        try:
+            poll = await OUTBOX.submit(
+                bot.send_poll,
+                chat_id=m.chat.id,
+                question=question,
+                options=[opt_yes, opt_no],
+                is_anonymous=False,
+                allows_multiple_answers=False,
+            )
+            await shared_ctx._bot_messages_by_chat.aadd(m.chat.id, poll.message_id)
+        except Exception:
+            try:
+                msg_fallback = await OUTBOX.submit(bot.send_message, chat_id=m.chat.id, text=f"{question}\n\nВарианты: {opt_yes} / {opt_no}")
+                await shared_ctx._bot_messages_by_chat.aadd(m.chat.id, msg_fallback.message_id)
+            except Exception:
+                await _last_poll_on_date.apop(m.chat.id)
+        return
+    await submit_llm_request(m, q, reply_to_id=m.message_id)
 
 
 @router.message((F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP})) & ((F.content_type == ContentType.STICKER) | (F.content_type == ContentType.ANIMATION)))
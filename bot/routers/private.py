@@ -3,16 +3,16 @@ from aiogram.enums import ChatType
 from aiogram.types import Message
 
 from bot.routers import shared as shared_ctx
-from bot.routers.shared import handle_llm_request_shared
+from bot.routers.shared import submit_llm_request
 
 router = Router()
 
 
-@router.message(F.text)
+@router.message(F.text & (F.chat.type == ChatType.PRIVATE))
 async def private_trigger(m: Message):
     text = (m.text or "").strip()
     if text and not text.startswith("/"):
-        await handle_llm_request_shared(m, text, reply_to_id=m.message_id)
+        await submit_llm_request(m, text, reply_to_id=m.message_id)
     else:
         return
 
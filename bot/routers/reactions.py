@@ -17,8 +17,7 @@ async def on_reaction(event: MessageReactionUpdated):
     chat = event.chat
     if chat is None:
         return
-    bot_msg_ids = shared_ctx._bot_messages_by_chat.get(chat.id, set())
-    if event.message_id not in bot_msg_ids:
+    if not await shared_ctx._bot_messages_by_chat.acontains(chat.id, event.message_id):
         return
     mention = f"@{reactor.username}" if reactor.username else (reactor.full_name or "")
 
@@ -47,6 +46,6 @@ async def on_reaction(event: MessageReactionUpdated):
     proxy.message_id = event.message_id
     proxy.from_user = reactor
 
-    await handle_llm_request_shared(proxy, user_text, reply_to_id=event.message_id)
+    await handle_llm_request_shared(proxy, user_text, reply_to_id=event.message_id, request_class="reaction")
 
 
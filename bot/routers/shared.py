@@ -1,29 +1,49 @@
 import asyncio
 import logging
-from datetime import UTC, datetime, timedelta
+import math
+import time
 
 from aiogram import Bot
 from aiogram import exceptions as tg_exc
+from aiogram.enums import ChatType
 from aiogram.types import Message
 from aiogram.utils.chat_action import ChatActionSender
 from openai import OpenAIError, RateLimitError
 
 from bot.logging_utils import log_with_context
-from bot.metrics import ACTIVE_CHATS, ERRORS, LLM_LATENCY, RATE_LIMITED, RESPONSES
+from bot.metrics import ACTIVE_CHATS, ERRORS, RATE_LIMITED, RESPONSES
 from bot.openai_service import OpenAIService
 from bot.prompts import SYSTEM_PROMPT
+from bot.services.admission import Overloaded
+from bot.services.circuit_breaker import CircuitOpen
+from bot.services.coalescer import Coalescer
+from bot.services.context_buffer import ContextBuffer, Turn, pack_context
 from bot.services.idle_monitor import idle_monitor_loop
+from bot.services.idle_scheduler import IdleScheduler
+from bot.services.leader import run_as_leader
+from bot.services.phrase_pool import PhrasePool, phrase_pool_refill_loop
 from bot.services.rate_limit import RateLimiter
+from bot.services.response_cache import ResponseCache, make_cache_key
+from bot.services.send_queue import OUTBOX
+from bot.services.state_store import BotMessageStore, ExpiringDict
 from bot.services.stickers import StickerService
+from bot.services.streaming import StreamRenderer
+from bot.services.token_budget import trim_to_tokens
 from bot.text_utils import format_in_style
+from bot.tracing import add_stage, annotate, span
 from config import load_config
 
 CFG = load_config()
 _bot: Bot | None = None
-_reply_counter_by_chat: dict[int, int] = {}
-_last_greet_at_by_user: dict[int, datetime] = {}
-_last_activity_by_chat: dict[int, datetime] = {}
-_bot_messages_by_chat: dict[int, set[int]] = {}
+_reply_counter_by_chat = ExpiringDict("reply_counter", ttl_sec=7 * 86400, max_entries=CFG.state_max_chats, persistent=True)
+_last_greet_at_by_user = ExpiringDict("last_greet", ttl_sec=CFG.greet_suppress_hours * 3600, max_entries=CFG.state_max_users, persistent=True)
+_last_activity_by_chat = ExpiringDict("last_activity", ttl_sec=30 * 86400, max_entries=CFG.state_max_chats, persistent=True)
+_bot_messages_by_chat = BotMessageStore(
+    per_chat=CFG.bot_messages_per_chat,
+    ttl_sec=CFG.bot_messages_ttl_hours * 3600,
+    max_chats=CFG.state_max_chats,
+    persistent=True,
+)
 
 OAI = OpenAIService()
 RATE = RateLimiter(
@@ -32,6 +52,25 @@ RATE = RateLimiter(
     per_chat_window_sec=CFG.per_chat_window_sec,
     per_chat_max=CFG.per_chat_max_requests,
 )
+PHRASES = PhrasePool(
+    path=CFG.phrase_pool_path or None,
+    max_per_category=CFG.phrase_pool_max_per_category,
+    quiet_sec=CFG.phrase_pool_quiet_sec,
+)
+CACHE = ResponseCache(
+    ttl_sec=CFG.response_cache_ttl_sec,
+    max_entries=CFG.response_cache_max_entries,
+    max_bytes=CFG.response_cache_max_bytes,
+    variants=CFG.response_cache_variants,
+)
+IDLE = IdleScheduler(threshold_sec=CFG.idle_threshold_hours * 3600)
+CONTEXT = ContextBuffer(
+    max_turns=CFG.context_max_turns,
+    max_bytes=CFG.context_max_bytes,
+    ttl_sec=CFG.context_ttl_sec,
+    max_chats=CFG.state_max_chats,
+)
+COALESCER: Coalescer[tuple[Message, str, int | None]] = Coalescer(window_sec=CFG.coalesce_window_sec, max_batch=CFG.coalesce_max_batch)
 STICKERS: StickerService | None = None
 
 
@@ -39,6 +78,7 @@ def setup_shared(bot: Bot) -> None:
     global _bot, STICKERS
     _bot = bot
     STICKERS = StickerService(bot, list(CFG.sticker_set_candidates))
+    PHRASES.load()
 
 
 def pick_style_and_length() -> tuple[str, str]:
@@ -47,7 +87,14 @@ def pick_style_and_length() -> tuple[str, str]:
     return style, length
 
 
-def build_user_prompt(user_text: str, style: str, length: str, mention: str | None = None, greeting_ok: bool = True) -> str:
+def build_user_prompt(
+    user_text: str,
+    style: str,
+    length: str,
+    mention: str | None = None,
+    greeting_ok: bool = True,
+    context: list[str] | None = None,
+) -> str:
     parts: list[str] = []
     if mention:
         parts.append(f"Адресуйся к {mention} в тексте, если уместно.")
@@ -59,123 +106,259 @@ def build_user_prompt(user_text: str, style: str, length: str, mention: str | No
     parts.append(
         "В конце добавь одну короткую строку с конкретными ключевыми словами/техниками, которые стоит поискать (начинай со слов ‘Сам(а) ищи дальше: …’)."
     )
+    if context:
+        parts.append("Контекст переписки (от старого к новому):\n" + "\n".join(context))
     parts.append(f"Текст пользователя: {user_text}")
     return " \n".join(parts)
 
 
-async def handle_llm_request_shared(m: Message, user_text: str, reply_to_id: int | None = None):
-    if _bot is None or STICKERS is None:
+def _uid(m: Message) -> int:
+    return m.from_user.id if m.from_user else 0
+
+
+def _author(m: Message) -> str:
+    user = m.from_user
+    if user is None:
+        return "кто-то"
+    if getattr(user, "username", None):
+        return f"@{user.username}"
+    return getattr(user, "full_name", None) or str(user.id)
+
+
+def merge_prompts(batch: list[tuple[Message, str, int | None]]) -> str:
+    """One prompt for a burst: plain lines from a single author, ``author: text`` lines otherwise."""
+    if len(batch) == 1:
+        return batch[0][1]
+    authors = {_uid(m) for m, _, _ in batch}
+    if len(authors) == 1:
+        return "\n".join(text for _, text, _ in batch)
+    return "\n".join(f"{_author(m)}: {text}" for m, text, _ in batch)
+
+
+async def submit_llm_request(m: Message, user_text: str, reply_to_id: int | None = None):
+    """Debounce per chat: prompts arriving within ``coalesce_window_sec`` get one LLM call and one reply."""
+
+    async def _flush(batch: list[tuple[Message, str, int | None]]) -> None:
+        # every author in the burst is charged once; prompts of authors over their limit are dropped
+        verdicts: dict[int, tuple[bool, float]] = {}
+        with span("rate_limit"):
+            for bm, _, _ in batch:
+                uid = _uid(bm)
+                if uid not in verdicts:
+                    verdicts[uid] = await RATE.acquire(uid, bm.chat.id)
+                    if not verdicts[uid][0]:
+                        RATE_LIMITED.inc()
+        kept = [item for item in batch if verdicts[_uid(item[0])][0]]
+        if not kept:
+            last_m, _, last_reply_to = batch[-1]
+            await _reply_rate_limited(last_m, last_reply_to, verdicts[_uid(last_m)][1])
+            return
+        last_m, _, last_reply_to = kept[-1]
+        await handle_llm_request_shared(
+            last_m, merge_prompts(kept), reply_to_id=last_reply_to, rate_checked=True, batch=[(bm, text) for bm, text, _ in kept]
+        )
+
+    await COALESCER.submit(m.chat.id, (m, user_text, reply_to_id), _flush)
+
+
+def replied_turn(m: Message) -> Turn | None:
+    """The earlier bot answer ``m`` replies to: from the context buffer, else the quoted text."""
+    reply = getattr(m, "reply_to_message", None)
+    if reply is None:
+        return None
+    turn = CONTEXT.find(m.chat.id, reply.message_id)
+    if turn is not None:
+        return turn
+    quoted = (reply.text or reply.caption or "").strip()
+    if quoted and reply.from_user and reply.from_user.is_bot:
+        return Turn("bot", "", quoted, (reply.message_id,), 0.0)
+    return None
+
+
+def request_class_for(m: Message) -> str:
+    return "private" if getattr(m.chat, "type", None) == ChatType.PRIVATE else "group"
+
+
+async def _reply_rate_limited(m: Message, reply_to_id: int | None, wait_sec: float) -> None:
+    if _bot is None:
         return
+    gate_text = PHRASES.get("gate")
+    if wait_sec > 0:
+        gate_text = f"{gate_text} Приходи через {math.ceil(wait_sec)} с."
+    try:
+        sent = await OUTBOX.submit(_bot.send_message, chat_id=m.chat.id, text=gate_text, reply_to_message_id=(reply_to_id or m.message_id))
+        await _bot_messages_by_chat.aadd(m.chat.id, sent.message_id)
+    except Exception:
+        pass
 
-    uid = m.from_user.id if m.from_user else 0
-    if not RATE.allow(uid, m.chat.id):
-        RATE_LIMITED.inc()
-        try:
-            gen_messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": "Сгенерируй короткую токсичную фразу, что очередь и нужно подождать несколько секунд."},
-            ]
-            gate_text = await asyncio.to_thread(OAI.ask, gen_messages, CFG.openai_model)
-        except Exception:
-            gate_text = "Очередь. Подожди."
-        try:
-            sent = await _bot.send_message(chat_id=m.chat.id, text=gate_text, reply_to_message_id=(reply_to_id or m.message_id))
-            _bot_messages_by_chat.setdefault(m.chat.id, set()).add(sent.message_id)
-        except Exception:
-            pass
+
+async def handle_llm_request_shared(
+    m: Message, user_text: str, reply_to_id: int | None = None, request_class: str | None = None, rate_checked: bool = False,
+    batch: list[tuple[Message, str]] | None = None,
+):
+    """Answer ``user_text`` for ``m``; ``rate_checked`` skips the rate limiter when the caller already charged it.
+
+    ``batch`` holds the ``(message, text)`` prompts a coalesced ``user_text`` was merged from, so the
+    conversation context keeps each author's own turns.
+    """
+    if _bot is None or STICKERS is None:
         return
+    request_class = request_class or request_class_for(m)
+    annotate(chat_id=m.chat.id, request_class=request_class)
+
+    uid = _uid(m)
+    batch = batch or [(m, user_text)]
+    authors = list(dict.fromkeys(_uid(bm) for bm, _ in batch))
+    if not rate_checked:
+        with span("rate_limit"):
+            allowed, wait_sec = await RATE.acquire(uid, m.chat.id)
+        if not allowed:
+            RATE_LIMITED.inc()
+            await _reply_rate_limited(m, reply_to_id, wait_sec)
+            return
+
+    PHRASES.mark_busy()
+    target_reply_id = reply_to_id or m.message_id
+    renderer: StreamRenderer | None = None
+    streamed = False
+    answered = False
 
+    typing_started = time.perf_counter()
     async with ChatActionSender.typing(bot=_bot, chat_id=m.chat.id):
-        now = datetime.now(UTC)
-        last = _last_greet_at_by_user.get(uid)
-        greeting_ok = True
-        if last and now - last < timedelta(hours=CFG.greet_suppress_hours):
-            greeting_ok = False
-        else:
-            _last_greet_at_by_user[uid] = now
+        add_stage("typing", time.perf_counter() - typing_started)
+        with span("state"):
+            now_ts = time.time()
+            last = await _last_greet_at_by_user.aget(uid)
+            greeting_ok = True
+            if last is not None and now_ts - last < CFG.greet_suppress_hours * 3600:
+                greeting_ok = False
+            else:
+                await _last_greet_at_by_user.aset(uid, now_ts)
 
         style, length = pick_style_and_length()
         try:
-            prompt_for_user = build_user_prompt(user_text, style, length, greeting_ok=greeting_ok)
-            if len(prompt_for_user) > CFG.max_user_prompt_chars:
-                prompt_for_user = prompt_for_user[:CFG.max_user_prompt_chars]
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt_for_user},
-            ]
-            import time
-            _t0 = time.monotonic()
-            answer = await asyncio.to_thread(OAI.ask, messages, CFG.openai_model)
+            with span("prompt"):
+                question = trim_to_tokens(user_text, CFG.question_max_tokens)
+                budget = "private" if request_class == "private" else "group"
+                llm_kwargs = {"chat_id": m.chat.id, "request_class": request_class, "budget": budget, "call_site": request_class}
+                context = pack_context(CONTEXT.turns(m.chat.id, user_ids=authors), question, CFG.context_token_budget, pinned=replied_turn(m))
+                prompt_for_user = build_user_prompt(question, style, length, greeting_ok=greeting_ok, context=[t.render() for t in context])
+                messages = [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt_for_user},
+                ]
+                # answers that depend on earlier turns are never shared; otherwise the same question in the same
+                # style and budget gets the same answer whoever asks
+                cacheable = CFG.enable_response_cache and not context
+                cache_key = make_cache_key(CFG.openai_model, question, style, length, budget) if cacheable else None
+                cached = CACHE.get(cache_key) if cache_key else None
+            annotate(cached=cached is not None)
+            # with streaming this includes posting and editing the reply as text arrives
+            with span("llm"):
+                if cached is not None:
+                    answer = cached
+                elif CFG.enable_streaming:
+                    renderer = StreamRenderer(
+                        _bot,
+                        chat_id=m.chat.id,
+                        reply_to_message_id=target_reply_id,
+                        chunk_size=CFG.telegram_chunk_size,
+                        edit_interval_sec=CFG.stream_edit_interval_sec,
+                    )
+                    async for delta in OAI.stream_async(messages, CFG.openai_model, **llm_kwargs):
+                        await renderer.feed(delta)
+                    try:
+                        await renderer.finish()
+                    except tg_exc.TelegramBadRequest:
+                        # the whole answer arrived; only the last edit failed and the user already sees the text
+                        logging.warning("stream_finalize_failed chat_id=%s", m.chat.id)
+                    answer = renderer.text
+                    streamed = bool(renderer.message_ids)
+                else:
+                    answer = await OAI.ask_async(messages, CFG.openai_model, **llm_kwargs)
             if not answer or not str(answer).strip():
-                try:
-                    gen_messages = [
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": "Сгенерируй короткий токсичный ответ, что модель не вернула текста и пусть пользователь повторит запрос."},
-                    ]
-                    answer = await asyncio.to_thread(OAI.ask, gen_messages, CFG.openai_model)
-                except Exception:
-                    answer = format_in_style("Модель промолчала. Повтори запрос.", style="toxic")
-            LLM_LATENCY.observe(time.monotonic() - _t0)
+                answer = format_in_style(PHRASES.get("empty"), style="toxic")
+            else:
+                answered = True
+                if cache_key and cached is None:
+                    CACHE.put(cache_key, answer)
+        except CircuitOpen:
+            # the API is down: answer locally instead of queueing behind doomed calls
+            ERRORS.labels(kind="circuit_open").inc()
+            log_with_context(logging.WARNING, "llm_circuit_open", chat_id=m.chat.id)
+            answer = format_in_style(PHRASES.get("openai_error"), style=style)
+        except Overloaded as e:
+            ERRORS.labels(kind="overloaded").inc()
+            log_with_context(logging.WARNING, "llm_overloaded", chat_id=m.chat.id, reason=e.reason)
+            answer = format_in_style(PHRASES.get("gate"), style=style)
         except RateLimitError:
             ERRORS.labels(kind="ratelimit").inc()
             log_with_context(logging.WARNING, "llm_ratelimit", chat_id=m.chat.id)
-            try:
-                gen_messages = [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": "Сгенерируй короткий токсичный ответ, что лимиты исчерпаны и нужно подождать."},
-                ]
-                answer = await asyncio.to_thread(OAI.ask, gen_messages, CFG.openai_model)
-            except Exception:
-                answer = format_in_style("Лимит. Подожди немного.", style=style)
+            answer = format_in_style(PHRASES.get("ratelimit"), style=style)
         except OpenAIError as e:
             ERRORS.labels(kind="openai").inc()
             log_with_context(logging.ERROR, "llm_openai_error", chat_id=m.chat.id, error=str(e)[:200])
-            try:
-                gen_messages = [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": "Сгенерируй короткий токсичный ответ, что у модели техническая ошибка и позже повторить."},
-                ]
-                answer = await asyncio.to_thread(OAI.ask, gen_messages, CFG.openai_model)
-            except Exception:
-                answer = format_in_style("Модель недоступна. Повтори позже.", style=style)
+            answer = format_in_style(PHRASES.get("openai_error"), style=style)
         except Exception:
             ERRORS.labels(kind="unexpected").inc()
             logging.exception("llm_unexpected_error")
-            try:
-                gen_messages = [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": "Сгенерируй короткий токсичный ответ, что случился неожиданный сбой и нужно повторить позже."},
-                ]
-                answer = await asyncio.to_thread(OAI.ask, gen_messages, CFG.openai_model)
-            except Exception:
-                answer = format_in_style("Я хер его знает что произошло. Повтори позже.", style=style)
-
-    target_reply_id = reply_to_id or m.message_id
+            answer = format_in_style(PHRASES.get("unexpected"), style=style)
 
-    if len(answer) > CFG.telegram_chunk_size:
-        answer = answer[:CFG.telegram_chunk_size]
-    try:
-        msg = await _bot.send_message(chat_id=m.chat.id, text=answer, reply_to_message_id=target_reply_id)
-    except tg_exc.TelegramRetryAfter as e:
-        await asyncio.sleep(getattr(e, "retry_after", 1) or 1)
-        msg = await _bot.send_message(chat_id=m.chat.id, text=answer, reply_to_message_id=target_reply_id)
-    except tg_exc.TelegramBadRequest:
-        msg = None
-    _bot_messages_by_chat.setdefault(m.chat.id, set()).add(msg.message_id)
+    if renderer is not None and renderer.message_ids and not streamed:
+        # the stream broke after text was posted: end that message with the error phrase instead of a new reply
+        try:
+            await renderer.fail(answer)
+            streamed = True
+        except tg_exc.TelegramBadRequest:
+            logging.warning("stream_finalize_failed chat_id=%s", m.chat.id)
+    answer_ids: list[int] = []
+    if renderer is not None:
+        answer_ids = renderer.message_ids
+        await _bot_messages_by_chat.aupdate(m.chat.id, renderer.message_ids)
+    if not streamed:
+        if len(answer) > CFG.telegram_chunk_size:
+            answer = answer[:CFG.telegram_chunk_size]
+        try:
+            with span("send"):
+                msg = await OUTBOX.submit(_bot.send_message, chat_id=m.chat.id, text=answer, reply_to_message_id=target_reply_id)
+        except tg_exc.TelegramBadRequest:
+            msg = None
+        if msg is not None:
+            answer_ids = [msg.message_id]
+            await _bot_messages_by_chat.aadd(m.chat.id, msg.message_id)
+    if answered:
+        for author in authors:
+            own = [(bm, text) for bm, text in batch if _uid(bm) == author]
+            CONTEXT.add(m.chat.id, "user", "\n".join(text for _, text in own), [bm.message_id for bm, _ in own],
+                        author=_author(own[0][0]), user_ids=(author,))
+        CONTEXT.add(m.chat.id, "bot", answer, answer_ids, user_ids=authors)
     RESPONSES.labels(type="text").inc()
 
     if CFG.enable_stickers:
-        await STICKERS.maybe_send(
-            chat_id=m.chat.id,
-            reply_to_message_id=target_reply_id,
-            every_nth=CFG.sticker_every_nth_reply,
-            counter_by_chat=_reply_counter_by_chat,
-        )
-    _last_activity_by_chat[m.chat.id] = datetime.now(UTC)
+        with span("sticker"):
+            await STICKERS.maybe_send(
+                chat_id=m.chat.id,
+                reply_to_message_id=target_reply_id,
+                every_nth=CFG.sticker_every_nth_reply,
+                counter_by_chat=_reply_counter_by_chat,
+            )
+    activity_ts = time.time()
+    with span("state"):
+        await _last_activity_by_chat.aset(m.chat.id, activity_ts)
+    IDLE.touch(m.chat.id, activity_ts)
     ACTIVE_CHATS.set(len(_last_activity_by_chat))
 
 
-def start_idle_monitor(bot: Bot) -> asyncio.Task:
-    return asyncio.create_task(idle_monitor_loop(bot, _last_activity_by_chat))
+def start_idle_monitor(bot: Bot, state_backend=None) -> asyncio.Task:
+    # with a shared backend only the instance holding the lease sends reminders
+    return asyncio.create_task(
+        run_as_leader(state_backend, "idle_monitor", lambda: idle_monitor_loop(bot, _last_activity_by_chat, PHRASES, IDLE, OAI), CFG.leader_lease_sec)
+    )
+
+
+def start_phrase_pool_refill() -> asyncio.Task:
+    return asyncio.create_task(
+        phrase_pool_refill_loop(PHRASES, OAI, CFG.openai_model, CFG.phrase_pool_batch_size, CFG.phrase_pool_refill_interval_sec)
+    )
 
 
@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Hashable
+
+from bot.metrics import LLM_CLASS_LATENCY, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_REJECTED
+
+# Request classes and their default scheduling weights
+DEFAULT_WEIGHTS: dict[str, float] = {"private": 4.0, "group": 2.0, "reaction": 1.0, "background": 0.5}
+
+
+class Overloaded(Exception):
+    """The request could not get an execution slot within its queue deadline."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM admission rejected: {reason}")
+        self.reason = reason
+
+
+class _Flow:
+    __slots__ = ("waiters", "weight", "deficit")
+
+    def __init__(self, weight: float):
+        self.waiters: deque[asyncio.Future] = deque()
+        self.weight = weight
+        self.deficit = 0.0
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded wait queue shared fairly between flows.
+
+    At most ``limit`` requests hold a slot. Waiters are queued per flow (a chat, or
+    one flow per background class) and freed slots are handed out by deficit
+    round-robin, each flow earning its class weight per round, so one busy chat
+    cannot starve the others. A request is rejected up front when its expected wait
+    already exceeds its deadline, and otherwise once the deadline passes while it is
+    still queued. When all ``max_queue`` places are taken, the newest waiter of the
+    longest flow makes room, unless that flow is the caller's own.
+    """
+
+    def __init__(self, limit: int, max_queue: int, deadline_sec: float, weights: dict[str, float] | None = None):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.deadline_sec = deadline_sec
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self._active = 0
+        self._queued = 0
+        self._flows: OrderedDict[Hashable, _Flow] = OrderedDict()  # round-robin order
+        self._hold_ewma: float | None = None
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def expected_wait(self, flow: Hashable, request_class: str) -> float:
+        if self._hold_ewma is None:
+            return 0.0
+        total = self._hold_ewma * (self._queued + 1) / self.limit
+        own = self._flows.get(flow)
+        weight = self.weights.get(request_class, 1.0)
+        share = weight / (weight + sum(f.weight for key, f in self._flows.items() if key != flow))
+        fair = self._hold_ewma * ((len(own.waiters) if own else 0) + 1) / (self.limit * share)
+        return min(total, fair)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, deadline_sec: float | None = None, *, flow: Hashable | None = None,
+                   request_class: str = "background") -> AsyncIterator[None]:
+        started = time.monotonic()
+        await self.acquire(deadline_sec, flow=flow, request_class=request_class)
+        held_from = time.monotonic()
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            self._observe_hold(now - held_from)
+            LLM_CLASS_LATENCY.labels(request_class=request_class).observe(now - started)
+            self.release()
+
+    async def acquire(self, deadline_sec: float | None = None, *, flow: Hashable | None = None,
+                      request_class: str = "background") -> None:
+        deadline = self.deadline_sec if deadline_sec is None else deadline_sec
+        flow = request_class if flow is None else flow
+        wait_metric = LLM_QUEUE_WAIT.labels(request_class=request_class)
+        if self._active < self.limit and not self._queued:
+            self._active += 1
+            LLM_IN_FLIGHT.set(self._active)
+            wait_metric.observe(0.0)
+            return
+        if self._queued >= self.max_queue and not self._make_room(flow):
+            self._reject("queue_full")
+        if self.expected_wait(flow, request_class) > deadline:
+            self._reject("deadline")
+        fut = asyncio.get_running_loop().create_future()
+        state = self._flows.get(flow)
+        if state is None:
+            state = self._flows[flow] = _Flow(self.weights.get(request_class, 1.0))
+        state.waiters.append(fut)
+        self._queued += 1
+        LLM_QUEUE_DEPTH.set(self._queued)
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(fut, deadline)
+        except BaseException as e:
+            if self._discard(flow, fut):
+                LLM_QUEUE_DEPTH.set(self._queued)
+            elif fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release()  # the slot was handed over just as we gave up
+            if isinstance(e, TimeoutError):
+                self._reject("timeout")
+            raise
+        wait_metric.observe(time.monotonic() - queued_at)
+
+    def release(self) -> None:
+        fut = self._next_waiter()
+        if fut is not None:
+            fut.set_result(None)  # hand the slot straight to the next waiter
+            return
+        self._active -= 1
+        LLM_IN_FLIGHT.set(self._active)
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        while self._flows:
+            key, state = next(iter(self._flows.items()))
+            if state.deficit < 1.0:
+                state.deficit += state.weight
+                if state.deficit < 1.0:
+                    self._flows.move_to_end(key)
+                    continue
+            fut = state.waiters.popleft()
+            state.deficit -= 1.0
+            self._queued -= 1
+            LLM_QUEUE_DEPTH.set(self._queued)
+            if not state.waiters:
+                del self._flows[key]
+            elif state.deficit < 1.0:
+                self._flows.move_to_end(key)
+            if not fut.done():
+                return fut
+        return None
+
+    def _discard(self, flow: Hashable, fut: asyncio.Future) -> bool:
+        state = self._flows.get(flow)
+        if state is None or fut not in state.waiters:
+            return False
+        state.waiters.remove(fut)
+        self._queued -= 1
+        if not state.waiters:
+            del self._flows[flow]
+        return True
+
+    def _make_room(self, flow: Hashable) -> bool:
+        if not self._flows:
+            return False
+        key, longest = max(self._flows.items(), key=lambda kv: len(kv[1].waiters))
+        own = self._flows.get(flow)
+        if key == flow or len(longest.waiters) <= (len(own.waiters) if own else 0) + 1:
+            return False
+        victim = longest.waiters.pop()
+        self._queued -= 1
+        if not longest.waiters:
+            del self._flows[key]
+        LLM_REJECTED.labels(reason="queue_full").inc()
+        if not victim.done():
+            victim.set_exception(Overloaded("queue_full"))
+        return True
+
+    def _observe_hold(self, seconds: float) -> None:
+        self._hold_ewma = seconds if self._hold_ewma is None else 0.8 * self._hold_ewma + 0.2 * seconds
+
+    def _reject(self, reason: str) -> None:
+        LLM_REJECTED.labels(reason=reason).inc()
+        raise Overloaded(reason)
@@ -0,0 +1,136 @@
+import logging
+import time
+from collections import deque
+
+from openai import APIStatusError, RateLimitError
+
+from bot.metrics import LLM_BREAKER_STATE, LLM_BREAKER_TRANSITIONS, LLM_REJECTED
+from bot.services.admission import Overloaded
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Overloaded):
+    """The LLM API is considered down; the call was refused without touching it."""
+
+    def __init__(self):
+        super().__init__("circuit_open")
+
+
+def counts_as_failure(e: BaseException) -> bool:
+    """Whether an attempt's exception says something about the API's health.
+
+    Client errors (bad request, auth, not found, ...) are the caller's problem; rate
+    limits, 5xx, timeouts and connection errors are not.
+    """
+    if isinstance(e, RateLimitError):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code >= 500
+    return True
+
+
+class CircuitBreaker:
+    """Stops calling the LLM API while it is failing or too slow.
+
+    Every attempt is recorded in a ``window_sec`` sliding window. Once it holds at least
+    ``min_calls`` attempts and either ``failure_ratio`` of them failed or ``slow_ratio``
+    took ``slow_call_sec`` or longer, the breaker opens and :meth:`acquire` raises
+    :class:`CircuitOpen` for ``open_sec``. It then half-opens: up to ``half_open_probes``
+    attempts run at a time, and that many successes in a row close it again while any
+    failure (or slow probe) re-opens it.
+    """
+
+    def __init__(self, window_sec: float = 30.0, min_calls: int = 10, failure_ratio: float = 0.5,
+                 slow_call_sec: float = 15.0, slow_ratio: float = 0.5, open_sec: float = 30.0, half_open_probes: int = 2):
+        self.window_sec = window_sec
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_sec = slow_call_sec
+        self.slow_ratio = slow_ratio
+        self.open_sec = open_sec
+        self.half_open_probes = half_open_probes
+        self._calls: deque[tuple[float, bool, bool]] = deque()  # (at, failed, slow)
+        self.reset()
+
+    def reset(self) -> None:
+        """Close the breaker and forget all recorded attempts."""
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        LLM_BREAKER_STATE.set(0)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_sec:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def acquire(self) -> bool:
+        """Admit one attempt or raise :class:`CircuitOpen`; returns whether it is a half-open probe.
+
+        Pass the returned flag to :meth:`record` or, if the attempt never reached the API
+        or was cancelled, to :meth:`abandon`.
+        """
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+            self._probes_in_flight += 1
+            return True
+        LLM_REJECTED.labels(reason="circuit_open").inc()
+        raise CircuitOpen()
+
+    def abandon(self, probe: bool) -> None:
+        if probe:
+            self._probes_in_flight -= 1
+
+    def record(self, failed: bool, seconds: float, probe: bool = False) -> None:
+        slow = seconds >= self.slow_call_sec
+        if probe:
+            self._probes_in_flight -= 1
+            if self._state != HALF_OPEN:
+                return
+            if failed or slow:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._transition(CLOSED)
+            return
+        if self._state != CLOSED:
+            return  # a late result from before the breaker opened
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        self._failures += failed
+        self._slow += slow
+        self._prune(now)
+        n = len(self._calls)
+        if n >= self.min_calls and (self._failures >= self.failure_ratio * n or self._slow >= self.slow_ratio * n):
+            self._transition(OPEN)
+
+    def _prune(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_sec:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _transition(self, state: str) -> None:
+        if state == OPEN:
+            logging.warning(
+                "llm_breaker_open failures=%d slow=%d calls=%d from=%s", self._failures, self._slow, len(self._calls), self._state
+            )
+            self._opened_at = time.monotonic()
+        else:
+            logging.info("llm_breaker_%s", state)
+        self._state = state
+        self._calls.clear()
+        self._failures = self._slow = 0
+        self._probe_successes = 0
+        LLM_BREAKER_STATE.set(_STATE_VALUES[state])
+        LLM_BREAKER_TRANSITIONS.labels(to=state).inc()
@@ -0,0 +1,55 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+from bot.metrics import COALESCE_BATCH_SIZE
+
+T = TypeVar("T")
+
+
+class _Batch(Generic[T]):
+    __slots__ = ("items", "arrived")
+
+    def __init__(self, item: T):
+        self.items = [item]
+        self.arrived = asyncio.Event()
+
+
+class Coalescer(Generic[T]):
+    """Per-key debounce that merges bursts into one call.
+
+    The first item for a key opens a batch and its caller waits; every further item
+    for the same key joins the batch and restarts the ``window_sec`` timer. The batch is
+    handed to ``flush`` once the key has been quiet for a whole window, or as soon as
+    it holds ``max_batch`` items. Callers whose item joined an open batch return at once.
+    """
+
+    def __init__(self, window_sec: float, max_batch: int):
+        self.window_sec = window_sec
+        self.max_batch = max_batch
+        self._open: dict[Hashable, _Batch[T]] = {}
+
+    def pending(self, key: Hashable) -> int:
+        batch = self._open.get(key)
+        return len(batch.items) if batch else 0
+
+    async def submit(self, key: Hashable, item: T, flush: Callable[[list[T]], Awaitable[None]]) -> None:
+        batch = self._open.get(key)
+        if batch is not None:
+            batch.items.append(item)
+            batch.arrived.set()
+            return
+        batch = _Batch(item)
+        if self.window_sec > 0 and self.max_batch > 1:
+            self._open[key] = batch
+            try:
+                while len(batch.items) < self.max_batch:
+                    batch.arrived.clear()
+                    try:
+                        await asyncio.wait_for(batch.arrived.wait(), self.window_sec)
+                    except TimeoutError:
+                        break
+            finally:
+                del self._open[key]
+        COALESCE_BATCH_SIZE.observe(len(batch.items))
+        await flush(batch.items)
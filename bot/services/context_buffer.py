@@ -0,0 +1,137 @@
+import re
+import time
+from collections import OrderedDict, deque
+from collections.abc import Hashable, Iterable
+
+from bot.metrics import STATE_ENTRIES
+from bot.services.token_budget import estimate_tokens
+
+_WORD = re.compile(r"\w{4,}")
+
+
+def _stems(text: str) -> set[str]:
+    return {w[:5] for w in _WORD.findall(text.lower())}
+
+
+class Turn:
+    __slots__ = ("role", "author", "user_ids", "text", "message_ids", "at", "size")
+
+    def __init__(self, role: str, author: str, text: str, message_ids: tuple[int, ...], at: float, user_ids: Iterable[int] = ()):
+        self.role = role  # "user" or "bot"
+        self.author = author
+        self.user_ids = frozenset(user_ids)  # who wrote the turn, or whom the bot was answering
+        self.text = text
+        self.message_ids = message_ids
+        self.at = at
+        self.size = len(text.encode("utf-8"))
+
+    def render(self) -> str:
+        who = "Ты" if self.role == "bot" else self.author
+        return f"{who}: {self.text}"
+
+
+class ContextBuffer:
+    """Recent user turns and bot answers per chat, for follow-up questions.
+
+    Each chat keeps at most ``max_turns`` turns totalling at most ``max_bytes`` of text,
+    oldest dropped first; turns expire ``ttl_sec`` after they were added and chats are
+    evicted LRU beyond ``max_chats``. Turns remember the users they belong to (an answer to
+    a coalesced burst belongs to every author in it), so a group member's follow-up is not
+    mixed with other people's threads. The buffer is local to the instance.
+    """
+
+    def __init__(self, max_turns: int, max_bytes: int, ttl_sec: float, max_chats: int):
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.max_chats = max_chats
+        self._chats: OrderedDict[Hashable, deque[Turn]] = OrderedDict()
+        self._gauge = STATE_ENTRIES.labels(store="context_chats")
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def add(self, chat_id: Hashable, role: str, text: str, message_ids=(), author: str = "", user_ids: Iterable[int] = ()) -> None:
+        text = text.strip()
+        if not text or self.max_turns < 1:
+            return
+        if len(text.encode("utf-8")) > self.max_bytes:
+            text = text.encode("utf-8")[:self.max_bytes].decode("utf-8", "ignore")
+        turns = self._chats.pop(chat_id, None) or deque()
+        now = time.time()
+        if turns and now <= turns[-1].at:
+            now = turns[-1].at + 1e-6  # keep timestamps strictly increasing within a chat
+        turns.append(Turn(role, author, text, tuple(mid for mid in message_ids if mid), now, user_ids))
+        total = sum(t.size for t in turns)
+        while len(turns) > self.max_turns or total > self.max_bytes:
+            total -= turns.popleft().size
+        self._chats[chat_id] = turns
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+        self._gauge.set(len(self._chats))
+
+    def turns(self, chat_id: Hashable, user_ids: Iterable[int] = ()) -> list[Turn]:
+        """Live turns of the chat; with ``user_ids``, only those belonging to any of these users."""
+        turns = self._chats.get(chat_id)
+        if not turns:
+            return []
+        cutoff = time.time() - self.ttl_sec
+        while turns and turns[0].at <= cutoff:
+            turns.popleft()
+        if not turns:
+            del self._chats[chat_id]
+            self._gauge.set(len(self._chats))
+            return []
+        wanted = frozenset(user_ids)
+        if not wanted:
+            return list(turns)
+        return [t for t in turns if t.user_ids & wanted]
+
+    def find(self, chat_id: Hashable, message_id: int | None) -> Turn | None:
+        if not message_id:
+            return None
+        for turn in self.turns(chat_id):
+            if message_id in turn.message_ids:
+                return turn
+        return None
+
+    def clear(self) -> None:
+        self._chats.clear()
+        self._gauge.set(0)
+
+
+def pack_context(turns: list[Turn], query: str, budget_tokens: int, pinned: Turn | None = None) -> list[Turn]:
+    """Pick the turns worth sending with ``query`` within ``budget_tokens``, in chronological order.
+
+    ``pinned`` (the message being replied to) goes first, clipped if it alone exceeds the
+    budget; the rest are ranked by word
+    overlap with the query plus a recency bonus, and added greedily while they fit.
+    """
+    if budget_tokens <= 0:
+        return []
+    chosen: list[Turn] = []
+    left = budget_tokens
+    if pinned is not None:
+        if estimate_tokens(pinned.render()) > left:
+            # the answer being replied to matters most: keep its beginning rather than drop it
+            room = max(0, left * 4 - len(pinned.render().encode("utf-8")) + pinned.size)
+            text = pinned.text.encode("utf-8")[:room].decode("utf-8", "ignore")
+            pinned = Turn(pinned.role, pinned.author, text, pinned.message_ids, pinned.at, pinned.user_ids) if text else None
+        if pinned is not None:
+            chosen.append(pinned)
+            left -= estimate_tokens(pinned.render())
+    words = _stems(query)
+    candidates = [t for t in turns if pinned is None or t.at != pinned.at]
+    n = len(candidates)
+    scored = sorted(
+        range(n),
+        key=lambda i: len(words & _stems(candidates[i].text)) + 2.0 / (n - i),
+        reverse=True,
+    )
+    for i in scored:
+        cost = estimate_tokens(candidates[i].render())
+        if cost <= left:
+            chosen.append(candidates[i])
+            left -= cost
+    chosen.sort(key=lambda t: t.at)
+    return chosen
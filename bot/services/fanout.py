@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+
+from bot.metrics import REMINDER_FANOUT_SECONDS, REMINDER_SEND_FAILURES
+
+
+class Pacer:
+    """Spaces out callers so that at most ``rate_per_sec`` proceed per second."""
+
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def fan_out(chat_ids: Iterable[int], send: Callable[[int], Awaitable[None]], *, kind: str, concurrency: int, rate_per_sec: float) -> tuple[int, int]:
+    """Run ``send(chat_id)`` for every chat with bounded concurrency and a global send rate.
+
+    Returns ``(sent, failed)``; failures are logged and counted, never raised.
+    """
+    chat_ids = list(chat_ids)
+    if not chat_ids:
+        return 0, 0
+    sem = asyncio.Semaphore(max(1, concurrency))
+    pacer = Pacer(rate_per_sec)
+    failed = 0
+
+    async def _one(chat_id: int) -> None:
+        nonlocal failed
+        async with sem:
+            await pacer.wait()
+            try:
+                await send(chat_id)
+            except Exception:
+                failed += 1
+                REMINDER_SEND_FAILURES.labels(kind=kind).inc()
+                logging.exception("%s_reminder_failed chat_id=%s", kind, chat_id)
+
+    started = time.monotonic()
+    await asyncio.gather(*(_one(cid) for cid in chat_ids))
+    REMINDER_FANOUT_SECONDS.labels(kind=kind).observe(time.monotonic() - started)
+    return len(chat_ids) - failed, failed
@@ -0,0 +1,54 @@
+from collections import deque
+
+from bot.metrics import LLM_HEDGE_DELAY
+
+
+class HedgePolicy:
+    """Decides when a slow LLM request gets a second, hedged copy.
+
+    The hedge delay is the ``quantile`` of the model's last ``window`` successful attempt
+    latencies (``initial_delay_sec`` until ``min_samples`` are known), never below
+    ``min_delay_sec``. Hedges are paid for with tokens: every eligible request earns
+    ``max_ratio`` of one, a hedge spends a whole one, so at most about ``max_ratio`` of
+    requests are sent twice however slow the API gets.
+    """
+
+    def __init__(self, quantile: float = 0.9, min_delay_sec: float = 1.0, initial_delay_sec: float = 6.0,
+                 max_ratio: float = 0.1, window: int = 200, min_samples: int = 20, burst: float = 3.0):
+        self.quantile = quantile
+        self.min_delay_sec = min_delay_sec
+        self.initial_delay_sec = initial_delay_sec
+        self.max_ratio = max_ratio
+        self.window = window
+        self.min_samples = min_samples
+        self.burst = burst
+        self._latencies: dict[str, deque[float]] = {}
+        self._tokens = 1.0
+
+    def observe(self, model: str, seconds: float) -> None:
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = self._latencies[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def delay(self, model: str) -> float:
+        samples = self._latencies.get(model)
+        if samples is None or len(samples) < self.min_samples:
+            value = self.initial_delay_sec
+        else:
+            ordered = sorted(samples)
+            value = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+        value = max(self.min_delay_sec, value)
+        LLM_HEDGE_DELAY.labels(model=model).set(value)
+        return value
+
+    def earn(self) -> None:
+        """Credit one eligible request towards the hedge budget."""
+        self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+    def spend(self) -> bool:
+        """Take one hedge from the budget; False when it is used up."""
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
@@ -1,74 +1,113 @@
 import asyncio
 import logging
-from datetime import UTC, datetime, timedelta
+import time
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from aiogram import Bot
 
-from bot.openai_service import OpenAIService
+from bot.services.fanout import fan_out
+from bot.services.idle_scheduler import IdleScheduler
+from bot.services.phrase_pool import PhrasePool
+from bot.services.send_queue import OUTBOX, Priority
+from bot.services.state_store import ExpiringDict
 from bot.text_utils import format_in_style
 from config import load_config
 
 CFG = load_config()
 
-_last_weekly_alert_on_date: dict[int, str] = {}
+_last_weekly_alert_on_date = ExpiringDict("last_weekly_alert", ttl_sec=8 * 86400, max_entries=CFG.state_max_chats, persistent=True)
 
 
-async def idle_monitor_loop(bot: Bot, last_activity_by_chat: dict[int, datetime]) -> None:
-    IDLE_THRESHOLD = timedelta(hours=CFG.idle_threshold_hours)
+def next_weekly_window(now_almaty: datetime, done_key: str | None = None) -> datetime:
+    """Start of the next Friday 09:00–09:10 Asia/Almaty window (the current one if still open and not done)."""
+    start = now_almaty.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=(4 - now_almaty.weekday()) % 7)
+    if now_almaty >= start + timedelta(minutes=10) or start.date().isoformat() == done_key:
+        start += timedelta(days=7)
+    return start
+
+
+async def weekly_variants(phrases: PhrasePool, oai) -> list[str]:
+    """Fresh weekly reminder texts for this window: one LLM call for the whole fan-out, pool phrases as fallback."""
+    try:
+        variants = await phrases.generate("weekly", oai, CFG.openai_model, CFG.reminder_variants)
+    except Exception:
+        logging.warning("weekly_variants_failed")
+        variants = []
+    return variants or [phrases.get("weekly") for _ in range(CFG.reminder_variants)]
+
+
+async def send_weekly_reminders(bot: Bot, chat_ids: list[int], variants: list[str], today_key: str) -> tuple[int, int]:
+    async def _send(chat_id: int) -> None:
+        await OUTBOX.submit(bot.send_message, priority=Priority.REMINDER, chat_id=chat_id, text=variants[chat_id % len(variants)])
+        await _last_weekly_alert_on_date.aset(chat_id, today_key)
+
+    return await fan_out(chat_ids, _send, kind="weekly", concurrency=CFG.reminder_fanout_concurrency, rate_per_sec=CFG.telegram_global_rate_per_sec)
+
+
+async def send_idle_reminders(bot: Bot, chat_ids: list[int], phrases: PhrasePool) -> tuple[int, int]:
+    async def _send(chat_id: int) -> None:
+        await OUTBOX.submit(bot.send_message, priority=Priority.REMINDER, chat_id=chat_id, text=format_in_style(phrases.get("idle"), style="toxic"))
+
+    return await fan_out(chat_ids, _send, kind="idle", concurrency=CFG.reminder_fanout_concurrency, rate_per_sec=CFG.telegram_global_rate_per_sec)
+
+
+async def sync_scheduler(scheduler: IdleScheduler, last_activity_by_chat: ExpiringDict) -> None:
+    for chat_id, last in await last_activity_by_chat.aitems():
+        scheduler.touch(chat_id, last)
+
+
+async def idle_monitor_loop(bot: Bot, last_activity_by_chat: ExpiringDict, phrases: PhrasePool, scheduler: IdleScheduler, oai) -> None:
     CHECK_INTERVAL_SEC = CFG.idle_check_interval_sec
-    oai = OpenAIService()
+    await sync_scheduler(scheduler, last_activity_by_chat)
+    next_sync_at = time.monotonic() + CHECK_INTERVAL_SEC
+    weekly_done_key: str | None = None
+    weekly_retry_at = 0.0
     while True:
         try:
             if not CFG.enable_idle_monitor:
                 await asyncio.sleep(CHECK_INTERVAL_SEC)
                 continue
-            now = datetime.now(UTC)
+            if last_activity_by_chat.shared and time.monotonic() >= next_sync_at:
+                # other instances record activity only in the shared store
+                await sync_scheduler(scheduler, last_activity_by_chat)
+                next_sync_at = time.monotonic() + CHECK_INTERVAL_SEC
             now_almaty = datetime.now(ZoneInfo("Asia/Almaty"))
-            is_weekly_window = (now_almaty.weekday() == 4 and now_almaty.hour == 9 and now_almaty.minute < 10)
-            today_key = now_almaty.date().isoformat()
-            for chat_id, last in list(last_activity_by_chat.items()):
+            weekly_at = next_weekly_window(now_almaty, weekly_done_key)
+            if weekly_at <= now_almaty and time.monotonic() >= weekly_retry_at:
                 # Weekly Friday 09:00 Asia/Almaty reminder (once per Friday)
-                if is_weekly_window and _last_weekly_alert_on_date.get(chat_id) != today_key:
-                    weekly_messages = [
-                        {"role": "system", "content": (
-                            "Ты — LexaAgressionAI. Отвечай максимально токсично, по делу, без префиксов. Язык: русский."
-                        )},
-                        {"role": "user", "content": (
-                            "Сгенерируй жёсткое токсичное напоминание в пятницу утром: закрыть задачи и списать время."
-                        )},
-                    ]
-                    try:
-                        weekly_core = await asyncio.to_thread(oai.ask, weekly_messages, CFG.openai_model)
-                    except Exception:
-                        weekly_core = "Закрываем задачи и списываем время. Быстро."
-                    try:
-                        await bot.send_message(chat_id=chat_id, text=weekly_core)
-                        _last_weekly_alert_on_date[chat_id] = today_key
-                    except Exception:
-                        logging.exception("weekly_reminder_failed chat_id=%s", chat_id)
-
-                if now - last > IDLE_THRESHOLD:
-                    messages = [
-                        {"role": "system", "content": (
-                            "Ты — LexaAgressionAI. Отвечай токсично и по делу, без префиксов. Язык: русский."
-                        )},
-                        {"role": "user", "content": (
-                            "Сгенерируй очень краткое токсичное напоминание, что в чате давно тишина и пора работать."
-                        )},
-                    ]
-                    try:
-                        core = await asyncio.to_thread(oai.ask, messages, CFG.openai_model)
-                    except Exception:
-                        core = "Активность нулевая. Пора шевелиться."
-                    text = format_in_style(core, style="toxic")
-                    try:
-                        await bot.send_message(chat_id=chat_id, text=text)
-                        last_activity_by_chat[chat_id] = now
-                    except Exception:
-                        logging.exception("idle_reminder_failed chat_id=%s", chat_id)
-        except Exception:
-            logging.exception("idle_monitor_error")
-        await asyncio.sleep(CHECK_INTERVAL_SEC)
+                today_key = now_almaty.date().isoformat()
+                pending = [cid for cid, _ in await last_activity_by_chat.aitems() if await _last_weekly_alert_on_date.aget(cid) != today_key]
+                failed = 0
+                if pending:
+                    _, failed = await send_weekly_reminders(bot, pending, await weekly_variants(phrases, oai), today_key)
+                if failed:
+                    # chats whose send failed are still pending: retry them next check while the window is open
+                    weekly_retry_at = time.monotonic() + CHECK_INTERVAL_SEC
+                else:
+                    weekly_done_key = today_key
+                continue
 
+            now = time.time()
+            due: list[int] = []
+            for chat_id in scheduler.pop_due(now):
+                last = await last_activity_by_chat.aget(chat_id)
+                if last is not None and now - last < scheduler.threshold_sec:
+                    scheduler.touch(chat_id, last)  # active on another instance meanwhile
+                    continue
+                # re-arm up front so a failing chat is retried after another idle period, not in a hot loop
+                await last_activity_by_chat.aset(chat_id, now)
+                scheduler.touch(chat_id, now)
+                due.append(chat_id)
+            await send_idle_reminders(bot, due, phrases)
 
+            next_idle = scheduler.next_deadline()
+            timeout = max((weekly_at - now_almaty).total_seconds(), weekly_retry_at - time.monotonic())
+            if next_idle is not None:
+                timeout = min(timeout, next_idle - time.time())
+            if last_activity_by_chat.shared:
+                timeout = min(timeout, next_sync_at - time.monotonic())
+            await scheduler.wait(timeout)
+        except Exception:
+            logging.exception("idle_monitor_error")
+            await asyncio.sleep(CHECK_INTERVAL_SEC)
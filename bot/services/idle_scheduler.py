@@ -0,0 +1,61 @@
+import asyncio
+import heapq
+import time
+
+
+class IdleScheduler:
+    """Min-heap of per-chat idle deadlines.
+
+    ``touch`` reschedules a chat in O(log n); superseded heap entries are skipped
+    lazily and the heap is compacted when stale entries dominate. ``wait`` sleeps
+    until the next deadline, or earlier if a touch moved the earliest deadline forward.
+    """
+
+    def __init__(self, threshold_sec: float):
+        self.threshold_sec = threshold_sec
+        self._heap: list[tuple[float, int]] = []
+        self._deadlines: dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def touch(self, chat_id: int, last_activity: float | None = None) -> None:
+        deadline = (time.time() if last_activity is None else last_activity) + self.threshold_sec
+        if self._deadlines.get(chat_id) == deadline:
+            return
+        earliest = self.next_deadline()
+        self._deadlines[chat_id] = deadline
+        heapq.heappush(self._heap, (deadline, chat_id))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, c) for c, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        if earliest is None or deadline < earliest:
+            self._wakeup.set()
+
+    def remove(self, chat_id: int) -> None:
+        self._deadlines.pop(chat_id, None)
+
+    def next_deadline(self) -> float | None:
+        while self._heap:
+            deadline, chat_id = self._heap[0]
+            if self._deadlines.get(chat_id) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float) -> list[int]:
+        due: list[int] = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, chat_id = heapq.heappop(self._heap)
+            del self._deadlines[chat_id]
+            due.append(chat_id)
+        return due
+
+    async def wait(self, timeout: float) -> None:
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+        self._wakeup.clear()
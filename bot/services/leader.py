@@ -0,0 +1,55 @@
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import uuid
+from collections.abc import Awaitable, Callable
+
+from bot.metrics import LEADER
+
+
+async def run_as_leader(backend, name: str, job: Callable[[], Awaitable[None]], lease_sec: float) -> None:
+    """Run ``job()`` only while this instance holds the ``name`` lease.
+
+    Local backends serve a single instance, so the job simply runs. On a shared backend
+    the lease is taken or renewed every ``lease_sec / 3``; when it cannot be renewed the
+    job is cancelled until the lease is won back, so at most one instance runs it.
+    """
+    if not getattr(backend, "shared", False):
+        LEADER.labels(lease=name).set(1)
+        await job()
+        return
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    gauge = LEADER.labels(lease=name)
+    task: asyncio.Task | None = None
+    try:
+        while True:
+            try:
+                held = await backend.acquire_lease(name, owner, lease_sec)
+            except Exception:
+                logging.warning("lease_renew_failed name=%s", name)
+                held = False
+            if task is not None and task.done():
+                if not task.cancelled() and task.exception() is not None:
+                    logging.error("leader_job_failed name=%s", name, exc_info=task.exception())
+                task = None
+            if held and task is None:
+                logging.info("lease_acquired name=%s owner=%s", name, owner)
+                task = asyncio.create_task(job())
+            elif not held and task is not None:
+                logging.warning("lease_lost name=%s owner=%s", name, owner)
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+                task = None
+            gauge.set(1 if task is not None else 0)
+            await asyncio.sleep(lease_sec / 3)
+    finally:
+        gauge.set(0)
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+        with contextlib.suppress(Exception):
+            await backend.release_lease(name, owner)
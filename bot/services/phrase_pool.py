@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections.abc import Sequence
+
+from bot.prompts import SYSTEM_PROMPT
+
+# What each degraded call site needs the phrase to say.
+PHRASE_PROMPTS: dict[str, str] = {
+    "gate": "короткую токсичную фразу, что очередь и нужно подождать несколько секунд",
+    "empty": "короткий токсичный ответ, что модель не вернула текста и пусть пользователь повторит запрос",
+    "ratelimit": "короткий токсичный ответ, что лимиты исчерпаны и нужно подождать",
+    "openai_error": "короткий токсичный ответ, что у модели техническая ошибка и позже повторить",
+    "unexpected": "короткий токсичный ответ, что случился неожиданный сбой и нужно повторить позже",
+    "already_voted": "короткий токсичный ответ: сегодня уже голосовали по бару, хватит",
+    "idle": "очень краткое токсичное напоминание, что в чате давно тишина и пора работать",
+    "weekly": "жёсткое токсичное напоминание в пятницу утром: закрыть задачи и списать время",
+}
+
+# Categories sent as reminders rather than as fallback replies; they get their own output cap.
+REMINDER_CATEGORIES = frozenset({"idle", "weekly"})
+
+# Used until the pool has been filled (and whenever a category is empty).
+DEFAULT_PHRASES: dict[str, tuple[str, ...]] = {
+    "gate": ("Очередь. Подожди.",),
+    "empty": ("Модель промолчала. Повтори запрос.",),
+    "ratelimit": ("Лимит. Подожди немного.",),
+    "openai_error": ("Модель недоступна. Повтори позже.",),
+    "unexpected": ("Я хер его знает что произошло. Повтори позже.",),
+    "already_voted": ("Сегодня уже голосовали. Успокойся.",),
+    "idle": ("Активность нулевая. Пора шевелиться.",),
+    "weekly": ("Закрываем задачи и списываем время. Быстро.",),
+}
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def parse_phrases(raw: str, max_len: int = 300) -> list[str]:
+    phrases: list[str] = []
+    for line in (raw or "").splitlines():
+        line = _BULLET_RE.sub("", line).strip().strip('"').strip("'").strip()
+        if 2 <= len(line) <= max_len:
+            phrases.append(line)
+    return phrases
+
+
+class PhrasePool:
+    """Pre-generated fallback phrases per call-site category.
+
+    Lookups are a ``random.choice`` over an in-memory list, so degraded paths never
+    touch the network. Refills happen in batches from a background job while the bot
+    is quiet, and the pool is persisted as JSON for warm restarts.
+    """
+
+    def __init__(self, path: str | None = None, max_per_category: int = 50, quiet_sec: float = 60.0):
+        self.path = path
+        self.max_per_category = max_per_category
+        self.quiet_sec = quiet_sec
+        self._phrases: dict[str, list[str]] = {c: [] for c in PHRASE_PROMPTS}
+        self._last_busy_at = 0.0
+
+    def get(self, category: str) -> str:
+        phrases = self._phrases.get(category)
+        if phrases:
+            return random.choice(phrases)
+        return random.choice(DEFAULT_PHRASES.get(category, DEFAULT_PHRASES["unexpected"]))
+
+    def add(self, category: str, phrases: Sequence[str]) -> None:
+        bucket = self._phrases.setdefault(category, [])
+        bucket.extend(phrases)
+        if len(bucket) > self.max_per_category:
+            del bucket[: len(bucket) - self.max_per_category]
+
+    def size(self, category: str) -> int:
+        return len(self._phrases.get(category, ()))
+
+    def mark_busy(self) -> None:
+        self._last_busy_at = time.monotonic()
+
+    def is_quiet(self) -> bool:
+        return time.monotonic() - self._last_busy_at >= self.quiet_sec
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            for category, phrases in data.items():
+                if category in PHRASE_PROMPTS and isinstance(phrases, list):
+                    self.add(category, [str(p) for p in phrases])
+            logging.info("phrase_pool_loaded path=%s", self.path)
+        except Exception:
+            logging.exception("phrase_pool_load_failed path=%s", self.path)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._phrases, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    async def generate(self, category: str, oai, model: str | None, batch_size: int) -> list[str]:
+        """One LLM call for ``batch_size`` fresh phrases; they are also added to the pool."""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": (
+                f"Сгенерируй {batch_size} разных вариантов: {PHRASE_PROMPTS[category]}. "
+                "Каждый вариант с новой строки, без нумерации, кавычек и префиксов."
+            )},
+        ]
+        if category in REMINDER_CATEGORIES:
+            budget, call_site = "reminder", "reminder"
+        else:
+            budget, call_site = "phrases", "phrase_pool"
+        phrases = parse_phrases(await oai.ask_async(messages, model, budget=budget, call_site=call_site))[:batch_size]
+        self.add(category, phrases)
+        return phrases
+
+    async def refill(self, oai, model: str | None, batch_size: int) -> int:
+        """Top up the emptiest categories with one LLM call per batch; stops as soon as traffic resumes."""
+        added = 0
+        for category in sorted(PHRASE_PROMPTS, key=self.size):
+            if self.size(category) >= self.max_per_category or not self.is_quiet():
+                continue
+            try:
+                added += len(await self.generate(category, oai, model, batch_size))
+            except Exception:
+                logging.warning("phrase_pool_refill_failed category=%s", category)
+                break
+        return added
+
+
+async def phrase_pool_refill_loop(pool: PhrasePool, oai, model: str | None, batch_size: int, interval_sec: float) -> None:
+    while True:
+        try:
+            if pool.is_quiet():
+                added = await pool.refill(oai, model, batch_size)
+                if added:
+                    await asyncio.to_thread(pool.save)
+        except Exception:
+            logging.exception("phrase_pool_refill_error")
+        await asyncio.sleep(interval_sec)
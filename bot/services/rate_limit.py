@@ -1,33 +1,96 @@
+import logging
 import time
+from itertools import islice
+
+
+class TokenBuckets:
+    """Token buckets keyed by id, one ``(tokens, updated_at)`` tuple per key.
+
+    The dict is kept in last-touched order, so keys whose bucket has fully refilled
+    (i.e. idle for a whole window) sit at the front and are evicted a few at a time
+    on each update.
+    """
+
+    def __init__(self, capacity: int, window_sec: float):
+        self.capacity = float(capacity)
+        self.window_sec = float(window_sec)
+        self.rate = self.capacity / self.window_sec if self.window_sec > 0 else float("inf")
+        self._state: dict[int, tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def tokens(self, key: int, now: float) -> float:
+        state = self._state.get(key)
+        if state is None:
+            return self.capacity
+        tokens, updated_at = state
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def take(self, key: int, now: float) -> None:
+        tokens = self.tokens(key, now) - 1.0
+        self._state.pop(key, None)
+        self._state[key] = (tokens, now)
+        self._evict_idle(now)
+
+    def retry_after(self, key: int, now: float) -> float:
+        deficit = 1.0 - self.tokens(key, now)
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def _evict_idle(self, now: float, budget: int = 2) -> None:
+        for key in list(islice(self._state, budget)):
+            tokens, updated_at = self._state[key]
+            if tokens + (now - updated_at) * self.rate < self.capacity:
+                break
+            del self._state[key]
 
 
 class RateLimiter:
+    """Per-user and per-chat token buckets.
+
+    With a shared state backend attached, :meth:`acquire` checks and takes both
+    buckets in one atomic server-side step, so the limits hold across instances;
+    if the backend is unreachable it falls back to the local buckets.
+    """
+
     def __init__(self, per_user_window_sec: int, per_user_max: int, per_chat_window_sec: int, per_chat_max: int):
         self.per_user_window_sec = per_user_window_sec
         self.per_user_max = per_user_max
         self.per_chat_window_sec = per_chat_window_sec
         self.per_chat_max = per_chat_max
-        self._user_times: dict[int, list[float]] = {}
-        self._chat_times: dict[int, list[float]] = {}
+        self.backend = None
+        self._users = TokenBuckets(per_user_max, per_user_window_sec)
+        self._chats = TokenBuckets(per_chat_max, per_chat_window_sec)
 
     def allow(self, user_id: int, chat_id: int) -> bool:
         now = time.monotonic()
-        # user
-        utimes = self._user_times.setdefault(user_id, [])
-        cutoff_u = now - self.per_user_window_sec
-        self._user_times[user_id] = [t for t in utimes if t >= cutoff_u]
-        if len(self._user_times[user_id]) >= self.per_user_max:
+        if self._users.tokens(user_id, now) < 1.0:
             return False
-
-        # chat
-        ctimes = self._chat_times.setdefault(chat_id, [])
-        cutoff_c = now - self.per_chat_window_sec
-        self._chat_times[chat_id] = [t for t in ctimes if t >= cutoff_c]
-        if len(self._chat_times[chat_id]) >= self.per_chat_max:
+        if self._chats.tokens(chat_id, now) < 1.0:
             return False
-
-        self._user_times[user_id].append(now)
-        self._chat_times[chat_id].append(now)
+        self._users.take(user_id, now)
+        self._chats.take(chat_id, now)
         return True
 
+    async def acquire(self, user_id: int, chat_id: int) -> tuple[bool, float]:
+        """Take a request slot; returns ``(allowed, retry_after_sec)``."""
+        if getattr(self.backend, "shared", False):
+            try:
+                wait = await self.backend.take_tokens(
+                    [(f"user:{user_id}", self.per_user_max, self.per_user_window_sec), (f"chat:{chat_id}", self.per_chat_max, self.per_chat_window_sec)],
+                    time.time(),
+                )
+                return wait <= 0, wait
+            except Exception:
+                logging.warning("shared_rate_limit_failed")
+        if self.allow(user_id, chat_id):
+            return True, 0.0
+        return False, self.retry_after(user_id, chat_id)
+
+    def retry_after(self, user_id: int, chat_id: int) -> float:
+        """Seconds until ``allow(user_id, chat_id)`` would succeed again."""
+        now = time.monotonic()
+        return max(self._users.retry_after(user_id, now), self._chats.retry_after(chat_id, now))
 
+    def tracked_keys(self) -> int:
+        return len(self._users) + len(self._chats)
@@ -0,0 +1,80 @@
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from bot.metrics import RESPONSE_CACHE_EVICTIONS, RESPONSE_CACHE_HITS, RESPONSE_CACHE_MISSES
+
+
+def make_cache_key(model: str, prompt: str, *scope: str) -> str:
+    """Key for ``prompt`` (case and whitespace normalized); ``scope`` parts such as style or budget must match exactly."""
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256("\x00".join((model, *scope, normalized)).encode()).hexdigest()
+
+
+@dataclass
+class _Entry:
+    variants: list[str] = field(default_factory=list)
+    expires_at: float = 0.0
+    size: int = 0
+
+
+class ResponseCache:
+    """LRU+TTL cache of LLM answers keyed by model and normalized prompt.
+
+    With ``variants > 1`` each key keeps the last N distinct answers and only counts
+    as a hit once N have been collected; hits then return a random one of them.
+    """
+
+    def __init__(self, ttl_sec: float, max_entries: int, max_bytes: int, variants: int = 1):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.variants = max(1, variants)
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._drop(key, reason="ttl")
+            entry = None
+        if entry is None or len(entry.variants) < self.variants:
+            RESPONSE_CACHE_MISSES.inc()
+            return None
+        self._entries.move_to_end(key)
+        RESPONSE_CACHE_HITS.inc()
+        return random.choice(entry.variants)
+
+    def put(self, key: str, answer: str) -> None:
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        if answer not in entry.variants:
+            entry.variants.append(answer)
+            entry.size += size
+            self._bytes += size
+            while len(entry.variants) > self.variants:
+                dropped = len(entry.variants.pop(0).encode("utf-8"))
+                entry.size -= dropped
+                self._bytes -= dropped
+        entry.expires_at = time.monotonic() + self.ttl_sec
+        self._entries.move_to_end(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)), reason="lru")
+
+    def _drop(self, key: str, reason: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        RESPONSE_CACHE_EVICTIONS.labels(reason=reason).inc()
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+from aiogram import exceptions as tg_exc
+
+from bot.metrics import SEND_QUEUE_DEPTH, SEND_QUEUE_WAIT, SEND_RETRY_AFTER
+from bot.services.rate_limit import TokenBuckets
+from config import load_config
+
+CFG = load_config()
+
+
+class Priority(IntEnum):
+    REPLY = 0
+    STICKER = 1
+    REMINDER = 2
+
+
+@dataclass
+class _Job:
+    call: Callable[..., Awaitable[Any]]
+    kwargs: dict[str, Any]
+    chat_id: int
+    priority: Priority
+    future: asyncio.Future
+    group_limited: bool = True
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class SendQueue:
+    """Single outbound queue for every Telegram send.
+
+    Jobs are served by priority (replies, then stickers, then reminders) under a global
+    token bucket and a per-group bucket (groups have negative chat IDs). ``RetryAfter``
+    pauses the affected chat and re-queues the job instead of retrying inline. Until
+    :meth:`start` is called, :meth:`submit` calls straight through.
+    """
+
+    def __init__(self, global_rate_per_sec: float, group_rate_per_min: int, max_in_flight: int = 16, max_retries: int = 3):
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self._global = TokenBuckets(max(1, int(global_rate_per_sec)), max(1, int(global_rate_per_sec)) / global_rate_per_sec)
+        self._groups = TokenBuckets(group_rate_per_min, 60)
+        self._paused_until: dict[int, float] = {}
+        self._ready: list[tuple[int, int, _Job]] = []
+        self._delayed: list[tuple[float, int, _Job]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots: asyncio.Semaphore | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    def depth(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def submit(self, call: Callable[..., Awaitable[Any]], *, priority: Priority = Priority.REPLY,
+                     group_limited: bool = True, **kwargs) -> Any:
+        """Send ``call(**kwargs)`` through the queue; ``kwargs`` must include ``chat_id``.
+
+        ``group_limited=False`` skips the per-group bucket (for edits, which do not post
+        new messages); the global bucket and ``RetryAfter`` pauses still apply.
+        """
+        if self._task is None:
+            try:
+                return await call(**kwargs)
+            except tg_exc.TelegramRetryAfter as e:
+                await asyncio.sleep(getattr(e, "retry_after", 1) or 1)
+                return await call(**kwargs)
+        job = _Job(
+            call=call,
+            kwargs=kwargs,
+            chat_id=kwargs["chat_id"],
+            priority=priority,
+            future=asyncio.get_running_loop().create_future(),
+            group_limited=group_limited,
+        )
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        SEND_QUEUE_DEPTH.set(self.depth())
+        self._wakeup.set()
+        return await job.future
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("send_queue_error")
+
+    async def _step(self) -> None:
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, seq, job = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (job.priority, seq, job))
+        if not self._ready:
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+            return
+        wait = self._global.retry_after(0, now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+            return
+        _, seq, job = heapq.heappop(self._ready)
+        if job.future.done():  # caller went away
+            SEND_QUEUE_DEPTH.set(self.depth())
+            return
+        wait = self._paused_until.get(job.chat_id, 0.0) - now
+        if wait <= 0:
+            self._paused_until.pop(job.chat_id, None)
+            if job.chat_id < 0 and job.group_limited:
+                wait = self._groups.retry_after(job.chat_id, now)
+        if wait > 0:
+            heapq.heappush(self._delayed, (now + wait, seq, job))
+            return
+        if job.chat_id < 0 and job.group_limited:
+            self._groups.take(job.chat_id, now)
+        self._global.take(0, now)
+        SEND_QUEUE_DEPTH.set(self.depth())
+        SEND_QUEUE_WAIT.labels(priority=job.priority.name.lower()).observe(now - job.enqueued_at)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._dispatch(job, seq))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, job: _Job, seq: int) -> None:
+        try:
+            result = await job.call(**job.kwargs)
+        except tg_exc.TelegramRetryAfter as e:
+            SEND_RETRY_AFTER.inc()
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            resume_at = time.monotonic() + (getattr(e, "retry_after", 1) or 1)
+            self._paused_until[job.chat_id] = max(self._paused_until.get(job.chat_id, 0.0), resume_at)
+            heapq.heappush(self._delayed, (resume_at, seq, job))
+            SEND_QUEUE_DEPTH.set(self.depth())
+            self._wakeup.set()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+OUTBOX = SendQueue(global_rate_per_sec=CFG.telegram_global_rate_per_sec, group_rate_per_min=CFG.telegram_group_rate_per_min)
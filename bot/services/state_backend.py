@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any
+
+import aiosqlite
+import redis.asyncio as aioredis
+
+Snapshot = dict[str, dict[str, Any]]
+
+
+class MemoryStateBackend:
+    """Process-local backend: keeps the latest value per key, nothing survives a restart."""
+
+    shared = False
+
+    def __init__(self):
+        self._data: Snapshot = {}
+
+    async def open(self) -> None:
+        return None
+
+    async def load_all(self) -> Snapshot:
+        return {ns: dict(items) for ns, items in self._data.items()}
+
+    def set(self, namespace: str, key: Any, value: Any, ttl_sec: float | None = None) -> None:
+        self._data.setdefault(namespace, {})[str(key)] = value
+
+    def delete(self, namespace: str, key: Any) -> None:
+        self._data.get(namespace, {}).pop(str(key), None)
+
+    async def flush(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+
+class SQLiteStateBackend:
+    """Write-behind SQLite (WAL) backend.
+
+    ``set``/``delete`` only record the latest pending value per key; ``flush`` writes the
+    batch in one transaction on aiosqlite's worker thread. Startup reads everything
+    with a single ``SELECT``.
+    """
+
+    shared = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: aiosqlite.Connection | None = None
+        self._pending: dict[tuple[str, str], str | None] = {}
+        self._lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state (ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (ns, key))"
+        )
+        await self._db.commit()
+
+    async def load_all(self) -> Snapshot:
+        snapshot: Snapshot = {}
+        if self._db is None:
+            return snapshot
+        async with self._db.execute("SELECT ns, key, value FROM state") as cur:
+            for ns, key, value in await cur.fetchall():
+                try:
+                    snapshot.setdefault(ns, {})[key] = json.loads(value)
+                except ValueError:
+                    logging.warning("state_row_corrupt ns=%s key=%s", ns, key)
+        return snapshot
+
+    def set(self, namespace: str, key: Any, value: Any, ttl_sec: float | None = None) -> None:
+        self._pending[(namespace, str(key))] = json.dumps(value, ensure_ascii=False)
+
+    def delete(self, namespace: str, key: Any) -> None:
+        self._pending[(namespace, str(key))] = None
+
+    async def flush(self) -> None:
+        if self._db is None or not self._pending:
+            return
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            upserts = [(ns, key, value) for (ns, key), value in batch.items() if value is not None]
+            deletes = [(ns, key) for (ns, key), value in batch.items() if value is None]
+            try:
+                if upserts:
+                    await self._db.executemany("INSERT OR REPLACE INTO state (ns, key, value) VALUES (?, ?, ?)", upserts)
+                if deletes:
+                    await self._db.executemany("DELETE FROM state WHERE ns = ? AND key = ?", deletes)
+                await self._db.commit()
+            except Exception:
+                # put the batch back unless newer writes superseded it
+                for k, v in batch.items():
+                    self._pending.setdefault(k, v)
+                raise
+
+    async def close(self) -> None:
+        if self._db is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            await self._db.close()
+            self._db = None
+
+
+# claim(): set ``[now, value]`` unless a fresh entry already holds the same value
+_CLAIM_LUA = """
+local cur = redis.call('GET', KEYS[1])
+if cur then
+  local entry = cjson.decode(cur)
+  if tonumber(ARGV[2]) - entry[1] < tonumber(ARGV[3]) and entry[2] == cjson.decode(ARGV[4]) then
+    return 0
+  end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[5])
+return 1
+"""
+
+# take_tokens(): all-or-nothing token bucket take; returns seconds to wait (0 = taken)
+_TAKE_TOKENS_LUA = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[2 * i])
+  local rate = capacity / tonumber(ARGV[2 * i + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = capacity
+  if state[1] then
+    tokens = math.min(capacity, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+  end
+  levels[i] = tokens
+  if tokens < 1 then
+    wait = math.max(wait, (1 - tokens) / rate)
+  end
+end
+if wait > 0 then
+  return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', ARGV[1])
+  redis.call('PEXPIRE', key, math.ceil(tonumber(ARGV[2 * i + 1]) * 1000))
+end
+return '0'
+"""
+
+# acquire_lease(): take a free lease or extend our own
+_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+  return 1
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStateBackend:
+    """Backend on a Redis-protocol server, shared by every bot instance.
+
+    Each entry is its own key with the store's TTL, so expiry happens server-side.
+    ``set``/``delete`` are written behind in one pipeline per flush like SQLite, while
+    ``fetch``/``items`` read through to the server (with this instance's unflushed
+    writes on top). ``claim``, rate-limit buckets and leases are single Lua scripts and
+    therefore atomic across instances.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "lexa"):
+        self.url = url
+        self.prefix = prefix
+        self._redis: aioredis.Redis | None = None
+        self._pending: dict[tuple[str, str], tuple[str, float | None] | None] = {}
+        self._lock = asyncio.Lock()
+
+    def _key(self, namespace: str, key: Any = "") -> str:
+        return f"{self.prefix}:state:{namespace}:{key}"
+
+    async def open(self) -> None:
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+        self._claim = self._redis.register_script(_CLAIM_LUA)
+        self._take_tokens = self._redis.register_script(_TAKE_TOKENS_LUA)
+        self._lease = self._redis.register_script(_LEASE_LUA)
+        self._release = self._redis.register_script(_RELEASE_LUA)
+        # load up front so the first call of each script is a plain EVALSHA
+        for script in (self._claim, self._take_tokens, self._lease, self._release):
+            await self._redis.script_load(script.script)
+
+    async def _scan(self, pattern: str) -> dict[str, Any]:
+        keys = [k async for k in self._redis.scan_iter(match=pattern, count=500)]
+        found: dict[str, Any] = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            for key, value in zip(chunk, await self._redis.mget(chunk), strict=True):
+                if value is None:
+                    continue
+                try:
+                    found[key] = json.loads(value)
+                except ValueError:
+                    logging.warning("state_row_corrupt key=%s", key)
+        return found
+
+    async def load_all(self) -> Snapshot:
+        snapshot: Snapshot = {}
+        if self._redis is None:
+            return snapshot
+        head = len(f"{self.prefix}:state:")
+        for full_key, value in (await self._scan(self._key("*", "*"))).items():
+            namespace, _, key = full_key[head:].partition(":")
+            snapshot.setdefault(namespace, {})[key] = value
+        return snapshot
+
+    def set(self, namespace: str, key: Any, value: Any, ttl_sec: float | None = None) -> None:
+        self._pending[(namespace, str(key))] = (json.dumps(value, ensure_ascii=False), ttl_sec)
+
+    def delete(self, namespace: str, key: Any) -> None:
+        self._pending[(namespace, str(key))] = None
+
+    async def fetch(self, namespace: str, key: Any) -> Any:
+        """Latest value for ``key`` across all instances, or ``None``."""
+        pending = self._pending.get((namespace, str(key)), False)
+        if pending is not False:
+            return None if pending is None else json.loads(pending[0])
+        raw = await self._redis.get(self._key(namespace, key))
+        return None if raw is None else json.loads(raw)
+
+    async def items(self, namespace: str) -> dict[str, Any]:
+        head = len(self._key(namespace))
+        found = {k[head:]: v for k, v in (await self._scan(self._key(namespace, "*"))).items()}
+        for (ns, key), pending in list(self._pending.items()):
+            if ns != namespace:
+                continue
+            if pending is None:
+                found.pop(key, None)
+            else:
+                found[key] = json.loads(pending[0])
+        return found
+
+    async def claim(self, namespace: str, key: Any, value: Any, now: float, ttl_sec: float) -> bool:
+        """Atomically store ``[now, value]`` unless a live entry already holds ``value``."""
+        entry = json.dumps([now, value], ensure_ascii=False)
+        claimed = await self._claim(
+            keys=[self._key(namespace, key)],
+            args=[entry, now, ttl_sec, json.dumps(value, ensure_ascii=False), max(1, int(ttl_sec * 1000))],
+        )
+        if claimed:
+            self._pending.pop((namespace, str(key)), None)
+        return bool(claimed)
+
+    async def ring_add(self, namespace: str, key: Any, members: list[int], now: float, keep: int, ttl_sec: float) -> None:
+        """Add ``members`` to a per-key sorted set, keeping the newest ``keep``."""
+        ring = f"{self.prefix}:ring:{namespace}:{key}"
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(ring, {str(m): now for m in members})
+            pipe.zremrangebyrank(ring, 0, -keep - 1)
+            pipe.pexpire(ring, max(1, int(ttl_sec * 1000)))
+            await pipe.execute()
+
+    async def ring_score(self, namespace: str, key: Any, member: int) -> float | None:
+        return await self._redis.zscore(f"{self.prefix}:ring:{namespace}:{key}", str(member))
+
+    async def take_tokens(self, buckets: list[tuple[str, float, float]], now: float) -> float:
+        """Take one token from every ``(name, capacity, window_sec)`` bucket, or none.
+
+        Returns 0 when the tokens were taken, otherwise the seconds until they would be.
+        """
+        args: list[Any] = [now]
+        for _, capacity, window_sec in buckets:
+            args += [capacity, window_sec]
+        keys = [f"{self.prefix}:rate:{name}" for name, _, _ in buckets]
+        return float(await self._take_tokens(keys=keys, args=args))
+
+    async def acquire_lease(self, name: str, owner: str, ttl_sec: float) -> bool:
+        """Take the ``name`` lease for ``ttl_sec``, or extend it if ``owner`` already holds it."""
+        return bool(await self._lease(keys=[f"{self.prefix}:lease:{name}"], args=[owner, max(1, int(ttl_sec * 1000))]))
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        await self._release(keys=[f"{self.prefix}:lease:{name}"], args=[owner])
+
+    async def flush(self) -> None:
+        if self._redis is None or not self._pending:
+            return
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for (ns, key), pending in batch.items():
+                        if pending is None:
+                            pipe.delete(self._key(ns, key))
+                        else:
+                            value, ttl_sec = pending
+                            pipe.set(self._key(ns, key), value, px=max(1, int(ttl_sec * 1000)) if ttl_sec else None)
+                    await pipe.execute()
+            except Exception:
+                for k, v in batch.items():
+                    self._pending.setdefault(k, v)
+                raise
+
+    async def close(self) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            await self._redis.aclose()
+            self._redis = None
+
+
+def create_state_backend(kind: str, path: str, url: str | None = None):
+    if kind == "redis":
+        return RedisStateBackend(url or "redis://localhost:6379/0")
+    if kind == "sqlite":
+        return SQLiteStateBackend(path)
+    if kind == "memory":
+        return MemoryStateBackend()
+    raise RuntimeError(f"Unknown state backend: {kind}")
+
+
+async def state_flush_loop(backend, interval_sec: float) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            await backend.flush()
+        except Exception:
+            logging.exception("state_flush_failed")
@@ -0,0 +1,313 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator
+from itertools import islice
+from typing import Any
+
+from bot.metrics import STATE_ENTRIES
+
+_MISSING = object()
+
+# Stores created with ``persistent=True``, by name; see attach_backend().
+_PERSISTENT: dict[str, "ExpiringDict | BotMessageStore"] = {}
+
+
+def _restore_key(key: str) -> Any:
+    try:
+        return int(key)
+    except ValueError:
+        return key
+
+
+def attach_backend(backend, snapshot: dict[str, dict[str, Any]]) -> None:
+    """Restore every persistent store from ``snapshot`` and write through to ``backend`` from now on."""
+    for name, store in _PERSISTENT.items():
+        store.restore(snapshot.get(name, {}))
+        store.backend = backend
+
+
+def _is_shared(backend) -> bool:
+    return getattr(backend, "shared", False)
+
+
+class ExpiringDict:
+    """Size- and TTL-bounded mapping; entries are kept in write order and expire ``ttl_sec`` after their last write.
+
+    The ``a*`` methods are the ones to use where other bot instances may write the same
+    key: with a shared backend they read through to it, otherwise they are the local
+    operations. Local evictions are not propagated to a shared backend, which expires
+    entries on its own.
+    """
+
+    def __init__(self, name: str, ttl_sec: float, max_entries: int, persistent: bool = False):
+        self.name = name
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.backend = None
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._gauge = STATE_ENTRIES.labels(store=name)
+        if persistent:
+            _PERSISTENT[name] = self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def shared(self) -> bool:
+        return _is_shared(self.backend)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        self._put(key, now, value)
+        if self.backend is not None:
+            self.backend.set(self.name, key, [now, value], self.ttl_sec)
+
+    def _put(self, key: Hashable, now: float, value: Any) -> None:
+        self._data.pop(key, None)
+        self._data[key] = (now, value)
+        self._evict(now)
+        self._gauge.set(len(self._data))
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        now = time.time()
+        return [(k, v) for k, (stored_at, v) in self._data.items() if now - stored_at < self.ttl_sec]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        stored_at, value = entry
+        if time.time() - stored_at >= self.ttl_sec:
+            self._delete(key, evicted=True)
+            self._gauge.set(len(self._data))
+            return default
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            self._delete(key)
+        self._gauge.set(len(self._data))
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        for key in list(self._data):
+            self._delete(key)
+        self._gauge.set(0)
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        if self.shared:
+            try:
+                entry = await self.backend.fetch(self.name, key)
+            except Exception:
+                logging.warning("shared_state_read_failed store=%s", self.name)
+            else:
+                if entry is None or time.time() - entry[0] >= self.ttl_sec:
+                    return default
+                self._put(key, entry[0], entry[1])
+                return entry[1]
+        return self.get(key, default)
+
+    async def aset(self, key: Hashable, value: Any) -> None:
+        self[key] = value
+
+    async def aclaim(self, key: Hashable, value: Any) -> bool:
+        """Set ``key`` to ``value`` unless it already holds it; atomic across instances on a shared backend."""
+        if self.shared:
+            now = time.time()
+            try:
+                claimed = await self.backend.claim(self.name, key, value, now, self.ttl_sec)
+            except Exception:
+                logging.warning("shared_state_claim_failed store=%s", self.name)
+            else:
+                if claimed:
+                    self._put(key, now, value)
+                return claimed
+        if self.get(key, _MISSING) == value:
+            return False
+        self[key] = value
+        return True
+
+    async def apop(self, key: Hashable, default: Any = None) -> Any:
+        return self.pop(key, default)
+
+    async def aitems(self) -> list[tuple[Hashable, Any]]:
+        if self.shared:
+            try:
+                entries = await self.backend.items(self.name)
+            except Exception:
+                logging.warning("shared_state_read_failed store=%s", self.name)
+            else:
+                now = time.time()
+                return [(_restore_key(k), e[1]) for k, e in entries.items() if now - e[0] < self.ttl_sec]
+        return self.items()
+
+    def restore(self, items: dict[str, Any]) -> None:
+        now = time.time()
+        rows: list[tuple[float, Hashable, Any]] = []
+        for key, entry in items.items():
+            try:
+                stored_at, value = entry
+            except (TypeError, ValueError):
+                continue
+            if now - stored_at < self.ttl_sec:
+                rows.append((stored_at, _restore_key(key), value))
+        rows.sort(key=lambda r: r[0])
+        for stored_at, key, value in rows[-self.max_entries:]:
+            self._data[key] = (stored_at, value)
+        self._gauge.set(len(self._data))
+
+    def _delete(self, key: Hashable, evicted: bool = False) -> None:
+        del self._data[key]
+        if self.backend is not None and not (evicted and self.shared):
+            self.backend.delete(self.name, key)
+
+    def _evict(self, now: float, budget: int = 4) -> None:
+        while len(self._data) > self.max_entries:
+            self._delete(next(iter(self._data)), evicted=True)
+        for key in list(islice(self._data, budget)):
+            if now - self._data[key][0] < self.ttl_sec:
+                break
+            self._delete(key, evicted=True)
+
+
+class _MessageRing:
+    __slots__ = ("ids", "stamps", "pos")
+
+    def __init__(self, capacity: int):
+        self.ids = array("q", bytes(8 * capacity))
+        self.stamps = array("d", bytes(8 * capacity))
+        self.pos = 0
+
+    def add(self, message_id: int, now: float) -> None:
+        self.ids[self.pos] = message_id
+        self.stamps[self.pos] = now
+        self.pos = (self.pos + 1) % len(self.ids)
+
+    def stamp_of(self, message_id: int) -> float | None:
+        try:
+            return self.stamps[self.ids.index(message_id)]
+        except ValueError:
+            return None
+
+    def newest(self) -> float:
+        return self.stamps[self.pos - 1]
+
+    def snapshot(self) -> list[list[float]]:
+        order = list(range(self.pos, len(self.ids))) + list(range(self.pos))
+        return [[self.ids[i], self.stamps[i]] for i in order if self.ids[i]]
+
+
+class BotMessageStore:
+    """Recent bot message IDs per chat in fixed-size ``array`` rings.
+
+    Only the last ``per_chat`` IDs younger than ``ttl_sec`` are remembered; chats are
+    evicted LRU beyond ``max_chats`` and once their newest message has expired. With a
+    shared backend the ``a*`` methods also keep a per-chat ring on the server, so a
+    message sent by one instance is recognised by all of them.
+    """
+
+    def __init__(self, per_chat: int, ttl_sec: float, max_chats: int, name: str = "bot_messages", persistent: bool = False):
+        self.name = name
+        self.per_chat = per_chat
+        self.ttl_sec = ttl_sec
+        self.max_chats = max_chats
+        self.backend = None
+        self._rings: OrderedDict[int, _MessageRing] = OrderedDict()
+        self._gauge = STATE_ENTRIES.labels(store=f"{name}_chats")
+        if persistent:
+            _PERSISTENT[name] = self
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def add(self, chat_id: int, message_id: int | None) -> None:
+        if not message_id:
+            return
+        now = time.time()
+        ring = self._rings.pop(chat_id, None) or _MessageRing(self.per_chat)
+        ring.add(message_id, now)
+        self._rings[chat_id] = ring
+        if self.backend is not None and not _is_shared(self.backend):
+            self.backend.set(self.name, chat_id, ring.snapshot(), self.ttl_sec)
+        while len(self._rings) > self.max_chats:
+            self._drop(next(iter(self._rings)))
+        for cid in list(islice(self._rings, 2)):
+            if now - self._rings[cid].newest() < self.ttl_sec:
+                break
+            self._drop(cid)
+        self._gauge.set(len(self._rings))
+
+    def update(self, chat_id: int, message_ids) -> None:
+        for mid in message_ids:
+            self.add(chat_id, mid)
+
+    def contains(self, chat_id: int, message_id: int) -> bool:
+        ring = self._rings.get(chat_id)
+        if ring is None or not message_id:
+            return False
+        stamp = ring.stamp_of(message_id)
+        return stamp is not None and time.time() - stamp < self.ttl_sec
+
+    async def aadd(self, chat_id: int, message_id: int | None) -> None:
+        await self.aupdate(chat_id, [message_id])
+
+    async def aupdate(self, chat_id: int, message_ids) -> None:
+        message_ids = [mid for mid in message_ids if mid]
+        self.update(chat_id, message_ids)
+        if message_ids and _is_shared(self.backend):
+            try:
+                await self.backend.ring_add(self.name, chat_id, message_ids, time.time(), self.per_chat, self.ttl_sec)
+            except Exception:
+                logging.warning("shared_state_write_failed store=%s", self.name)
+
+    async def acontains(self, chat_id: int, message_id: int) -> bool:
+        if self.contains(chat_id, message_id):
+            return True
+        if not message_id or not _is_shared(self.backend):
+            return False
+        try:
+            stamp = await self.backend.ring_score(self.name, chat_id, message_id)
+        except Exception:
+            logging.warning("shared_state_read_failed store=%s", self.name)
+            return False
+        return stamp is not None and time.time() - stamp < self.ttl_sec
+
+    def clear(self) -> None:
+        for cid in list(self._rings):
+            self._drop(cid)
+        self._gauge.set(0)
+
+    def restore(self, items: dict[str, Any]) -> None:
+        cutoff = time.time() - self.ttl_sec
+        rings: list[tuple[float, int, _MessageRing]] = []
+        for key, rows in items.items():
+            ring = _MessageRing(self.per_chat)
+            for message_id, stamp in rows[-self.per_chat:]:
+                if stamp > cutoff:
+                    ring.add(int(message_id), stamp)
+            if ring.pos or ring.ids[-1]:
+                rings.append((ring.newest(), int(key), ring))
+        rings.sort(key=lambda r: r[0])
+        for _, chat_id, ring in rings[-self.max_chats:]:
+            self._rings[chat_id] = ring
+        self._gauge.set(len(self._rings))
+
+    def _drop(self, chat_id: int) -> None:
+        del self._rings[chat_id]
+        if self.backend is not None and not _is_shared(self.backend):
+            self.backend.delete(self.name, chat_id)
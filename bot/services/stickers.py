@@ -2,6 +2,8 @@ import logging
 
 from aiogram import Bot
 
+from bot.services.send_queue import OUTBOX, Priority
+
 
 class StickerService:
     def __init__(self, bot: Bot, set_names: list[str]):
@@ -32,7 +34,7 @@ class StickerService:
                 return
             import random
             file_id = random.choice(self._cached_file_ids)
-            await self.bot.send_sticker(chat_id=chat_id, sticker=file_id, reply_to_message_id=reply_to_message_id)
+            await OUTBOX.submit(self.bot.send_sticker, priority=Priority.STICKER, chat_id=chat_id, sticker=file_id, reply_to_message_id=reply_to_message_id)
         except Exception:
             logging.exception("sticker_send_failed")
 
@@ -43,7 +45,7 @@ class StickerService:
                 return
             import random
             file_id = random.choice(self._cached_file_ids)
-            await self.bot.send_sticker(chat_id=chat_id, sticker=file_id, reply_to_message_id=reply_to_message_id)
+            await OUTBOX.submit(self.bot.send_sticker, priority=Priority.STICKER, chat_id=chat_id, sticker=file_id, reply_to_message_id=reply_to_message_id)
         except Exception:
             logging.exception("sticker_send_failed")
 
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram import exceptions as tg_exc
+
+from bot.services.send_queue import OUTBOX
+
+
+def _split_point(text: str, limit: int) -> int:
+    # prefer breaking on a paragraph/line/word boundary in the last quarter of the chunk
+    floor = limit * 3 // 4
+    for sep in ("\n\n", "\n", " "):
+        idx = text.rfind(sep, floor, limit)
+        if idx != -1:
+            return idx + len(sep)
+    return limit
+
+
+class StreamRenderer:
+    """Progressively renders streamed text into Telegram messages.
+
+    The first delta is posted immediately; later deltas are applied with throttled
+    ``edit_message_text`` calls. Once the current message reaches ``chunk_size`` it is
+    finalized and the remainder continues in a new message.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, reply_to_message_id: int | None, chunk_size: int, edit_interval_sec: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.chunk_size = chunk_size
+        self.edit_interval_sec = edit_interval_sec
+        self.message_ids: list[int] = []
+        self._done: list[str] = []
+        self._current = ""
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._done) + self._current
+
+    async def feed(self, delta: str) -> None:
+        self._current += delta
+        while len(self._current) > self.chunk_size:
+            cut = _split_point(self._current, self.chunk_size)
+            head, self._current = self._current[:cut], self._current[cut:]
+            await self._render(head, force=True)
+            self._done.append(head)
+            self._shown = ""
+        if not self._current.strip():
+            return
+        await self._render(self._current, force=False)
+
+    async def finish(self) -> None:
+        if self._current.strip() and self._current != self._shown:
+            delay = self._next_edit_at - time.monotonic()
+            if delay > 0 and self._shown:
+                await asyncio.sleep(delay)
+            await self._render(self._current, force=True)
+
+    async def fail(self, note: str) -> None:
+        """Finalize after the stream broke: show everything received so far followed by ``note``."""
+        await self.feed(f"\n\n{note}" if self._current.strip() else note)
+        await self.finish()
+
+    async def _render(self, text: str, force: bool) -> None:
+        if not self._shown:
+            msg = await OUTBOX.submit(
+                self.bot.send_message,
+                chat_id=self.chat_id,
+                text=text,
+                reply_to_message_id=self.reply_to_message_id if not self.message_ids else None,
+            )
+            self.message_ids.append(msg.message_id)
+            self._shown = text
+            self._next_edit_at = time.monotonic() + self.edit_interval_sec
+            return
+        if text == self._shown or (not force and time.monotonic() < self._next_edit_at):
+            return
+        try:
+            # edits do not post messages, so they skip the per-group bucket; RetryAfter is handled by the queue
+            await OUTBOX.submit(
+                self.bot.edit_message_text, group_limited=False, text=text, chat_id=self.chat_id, message_id=self.message_ids[-1]
+            )
+            self._shown = text
+            self._next_edit_at = time.monotonic() + self.edit_interval_sec
+        except tg_exc.TelegramBadRequest:
+            logging.warning("stream_edit_failed chat_id=%s", self.chat_id)
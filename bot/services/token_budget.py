@@ -0,0 +1,44 @@
+import math
+import re
+from collections.abc import Callable
+from dataclasses import dataclass
+
+# Any ``str -> int`` callable will do, e.g. a tiktoken encoder's ``lambda s: len(enc.encode(s))``.
+TokenEstimator = Callable[[str], int]
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')»]*(?=\s|$)|\n")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: about four UTF-8 bytes per token, on the high side for Cyrillic."""
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def trim_to_tokens(text: str, max_tokens: int, estimator: TokenEstimator = estimate_tokens) -> str:
+    """Longest head of ``text`` within ``max_tokens``, cut after the last full sentence when there is one.
+
+    Falls back to a plain cut when the last sentence boundary would drop more than half
+    of what fits.
+    """
+    if estimator(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimator(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    head = text[:lo]
+    ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+    if ends and ends[-1] >= lo // 2:
+        head = head[:ends[-1]]
+    return head.rstrip()
+
+
+@dataclass(frozen=True)
+class TokenBudget:
+    """Caps for one kind of request: estimated input tokens of the user part, and ``max_output_tokens``."""
+
+    max_input_tokens: int
+    max_output_tokens: int
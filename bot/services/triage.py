@@ -0,0 +1,95 @@
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from aiogram import Bot
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+from bot.metrics import TRIAGE
+
+_ACCEPTED = TRIAGE.labels(result="accepted")
+_REJECTED = TRIAGE.labels(result="rejected")
+
+
+@dataclass(frozen=True)
+class BotIdentity:
+    id: int | None
+    username: str
+    mention: str  # "@username", lowercase
+    command_re: re.Pattern
+
+    @classmethod
+    def from_user(cls, me: Any) -> "BotIdentity":
+        username = (getattr(me, "username", None) or "").lower()
+        return cls(
+            id=getattr(me, "id", None),
+            username=username,
+            mention=f"@{username}",
+            command_re=re.compile(rf"/[a-z0-9_]+@{re.escape(username)}", re.IGNORECASE),
+        )
+
+
+_identity: BotIdentity | None = None
+
+
+async def load_bot_identity(bot: Bot) -> BotIdentity:
+    """Resolve the bot's own user once (one ``getMe``) and cache it for the process."""
+    global _identity
+    if _identity is None:
+        _identity = BotIdentity.from_user(await bot.get_me())
+    return _identity
+
+
+def _slice(text: str, offset: int, length: int) -> str:
+    # entity offsets are in UTF-16 code units
+    if text.isascii():
+        return text[offset : offset + length]
+    return text.encode("utf-16-le")[offset * 2 : (offset + length) * 2].decode("utf-16-le", errors="ignore")
+
+
+def match_bot_address(m: Any, identity: BotIdentity) -> str | None:
+    """Return the part of ``text``/``caption`` that addresses the bot, or ``None``."""
+    for text, entities in ((m.text, m.entities), (m.caption, getattr(m, "caption_entities", None))):
+        if not text or not entities:
+            continue
+        for e in entities:
+            kind = e.type
+            if kind == "mention":
+                if e.length == len(identity.mention):
+                    fragment = _slice(text, e.offset, e.length)
+                    if fragment.lower() == identity.mention:
+                        return fragment
+            elif kind == "text_mention":
+                user = getattr(e, "user", None)
+                if user is not None and identity.id is not None and user.id == identity.id:
+                    return _slice(text, e.offset, e.length)
+            elif kind == "bot_command":
+                fragment = _slice(text, e.offset, e.length)
+                if identity.command_re.fullmatch(fragment):
+                    return fragment
+    return None
+
+
+async def resolve_bot_address(m: Any, bot: Bot) -> str | None:
+    identity = _identity or await load_bot_identity(bot)
+    return match_bot_address(m, identity)
+
+
+class AddressedToBot(Filter):
+    """Router filter that lets through only messages addressed to this bot.
+
+    Messages without entities are rejected without touching the network; the matched
+    fragment is passed to the handler as ``bot_address``.
+    """
+
+    async def __call__(self, message: Message, bot: Bot) -> bool | dict[str, Any]:
+        if not message.entities and not message.caption_entities:
+            _REJECTED.inc()
+            return False
+        address = await resolve_bot_address(message, bot)
+        if address is None:
+            _REJECTED.inc()
+            return False
+        _ACCEPTED.inc()
+        return {"bot_address": address}
@@ -0,0 +1,116 @@
+import contextlib
+import logging
+import random
+import time
+import uuid
+from collections.abc import Awaitable, Callable, Iterator
+from contextvars import ContextVar
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.logging_utils import correlation_id, log_with_context
+from bot.metrics import STAGE_LATENCY
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "sampled", "started", "stages", "fields")
+
+    def __init__(self, name: str, sampled: bool, **fields: Any):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.fields = fields
+
+    def add(self, stage: str, seconds: float) -> None:
+        # repeated stages (e.g. several sends) add up
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Trace | None:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def traced(name: str, sample_rate: float = 1.0, **fields: Any) -> Iterator[Trace]:
+    """Run the block as one trace with a fresh correlation ID; nested calls join the outer trace.
+
+    Every trace sets the correlation ID that log records carry. Only a ``sample_rate``
+    share of traces time their stages; those end with one ``trace`` log record holding
+    the per-stage milliseconds, and feed ``bot_stage_seconds``.
+    """
+    outer = _current.get()
+    if outer is not None:
+        outer.fields.update(fields)
+        yield outer
+        return
+    trace = Trace(name, sampled=sample_rate >= 1.0 or random.random() < sample_rate, **fields)
+    token = _current.set(trace)
+    cid_token = correlation_id.set(trace.trace_id)
+    try:
+        yield trace
+    finally:
+        if trace.sampled:
+            total = time.perf_counter() - trace.started
+            STAGE_LATENCY.labels(stage="total").observe(total)
+            log_with_context(
+                logging.INFO,
+                "trace",
+                trace=trace.name,
+                total_ms=round(total * 1000, 1),
+                stages={k: round(v * 1000, 1) for k, v in trace.stages.items()},
+                **trace.fields,
+            )
+        correlation_id.reset(cid_token)
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the block as ``stage`` of the current sampled trace; a no-op otherwise."""
+    trace = _current.get()
+    if trace is None or not trace.sampled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - start)
+
+
+def add_stage(stage: str, seconds: float) -> None:
+    """Record a stage measured by the caller (for blocks that cannot be wrapped in :func:`span`)."""
+    trace = _current.get()
+    if trace is not None and trace.sampled:
+        trace.add(stage, seconds)
+
+
+def annotate(**fields: Any) -> None:
+    """Attach fields to the current trace's log record."""
+    trace = _current.get()
+    if trace is not None and trace.sampled:
+        trace.fields.update(fields)
+
+
+class TraceMiddleware(BaseMiddleware):
+    """Outer update middleware: every incoming update runs inside its own trace."""
+
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        with traced("update", self.sample_rate, update_id=getattr(event, "update_id", None), update_type=getattr(event, "event_type", None)):
+            return await handler(event, data)
@@ -0,0 +1,108 @@
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from bot.metrics import WEBHOOK_IN_FLIGHT, WEBHOOK_UPDATES
+from bot.ops import OpsServer
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookIngress:
+    """aiohttp handler that acknowledges Telegram updates and processes them in the background.
+
+    Each request is checked against the webhook secret token, parsed, and handed to the
+    dispatcher as a task; the 200 is returned as soon as a processing slot is free. When
+    ``max_in_flight`` updates are already being handled, the response is delayed until
+    one finishes, which makes Telegram slow down instead of piling up tasks.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: str, max_in_flight: int = 64):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            WEBHOOK_UPDATES.labels(result="unauthorized").inc()
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            WEBHOOK_UPDATES.labels(result="invalid").inc()
+            logging.warning("webhook_invalid_update")
+            return web.Response(status=400)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        WEBHOOK_UPDATES.labels(result="accepted").inc()
+        return web.Response()
+
+    async def _process(self, update: Update) -> None:
+        WEBHOOK_IN_FLIGHT.inc()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("webhook_update_failed update_id=%s", update.update_id)
+        finally:
+            WEBHOOK_IN_FLIGHT.dec()
+            self._slots.release()
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Wait for updates that were already acknowledged to finish processing."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def build_webhook_app(ingress: WebhookIngress, path: str, ops: OpsServer | None = None) -> web.Application:
+    app = web.Application()
+    app.router.add_post(path, ingress.handle)
+    if ops is not None:
+        ops.attach(app)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    *,
+    port: int,
+    path: str,
+    secret_token: str,
+    public_url: str | None,
+    max_in_flight: int,
+    ops: OpsServer | None = None,
+) -> None:
+    """Serve updates over HTTP on ``port`` until cancelled.
+
+    The ops endpoints (``/healthz``, ``/readyz``, ``/metrics``) are served from the same
+    app, so webhook mode keeps the polling port layout. The webhook is registered with Telegram only when ``public_url`` is set;
+    leave it empty when it is managed externally or a local fake server posts updates.
+    """
+    ingress = WebhookIngress(dp, bot, secret_token, max_in_flight)
+    runner = web.AppRunner(build_webhook_app(ingress, path, ops), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", port)
+    await site.start()
+    await dp.emit_startup(bot=bot)
+    if public_url:
+        await bot.set_webhook(
+            url=public_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logging.info("webhook_listening port=%s path=%s", port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await site.stop()
+        await ingress.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
@@ -1,4 +1,5 @@
 import os
+import re
 from dataclasses import dataclass
 
 
@@ -7,13 +8,21 @@ class AppConfig:
     bot_token: str
     openai_api_key: str
     openai_model: str
+    # tried in order after openai_model on retries; the next one also serves hedged requests
+    openai_fallback_models: tuple[str, ...] = ()
 
     # Tunables
     telegram_chunk_size: int = 4000
-    max_user_prompt_chars: int = 2000
+    stream_edit_interval_sec: float = 1.5
     idle_check_interval_sec: int = 300
     idle_threshold_hours: int = 14
+    reminder_variants: int = 5
+    reminder_fanout_concurrency: int = 8
+    telegram_global_rate_per_sec: float = 25.0
+    telegram_group_rate_per_min: int = 20
     roast_probability: float = 0.1
+    coalesce_window_sec: float = 1.0
+    coalesce_max_batch: int = 5
     greet_suppress_hours: int = 12
     roast_cooldown_hours: int = 6
     # Stickers
@@ -26,6 +35,82 @@ class AppConfig:
     short_reply_probability: float = 0.3
     # Telegram
     avatar_photos_limit: int = 1
+    # LLM admission control
+    llm_max_concurrency: int = 4
+    llm_max_queue: int = 32
+    llm_queue_deadline_sec: float = 10.0
+    # Fair-share weights per request class (deficit round-robin across chats)
+    llm_weight_private: float = 4.0
+    llm_weight_group: float = 2.0
+    llm_weight_reaction: float = 1.0
+    llm_weight_background: float = 0.5
+    # Circuit breaker over LLM attempts (sliding window; opens on failure or slow-call ratio)
+    breaker_window_sec: float = 30.0
+    breaker_min_calls: int = 10
+    breaker_failure_ratio: float = 0.5
+    breaker_slow_call_sec: float = 15.0
+    breaker_slow_ratio: float = 0.5
+    breaker_open_sec: float = 30.0
+    breaker_half_open_probes: int = 2
+    # Hedged requests for chat answers (second request after the model's p90 latency)
+    hedge_quantile: float = 0.9
+    hedge_min_delay_sec: float = 1.0
+    hedge_initial_delay_sec: float = 6.0
+    hedge_max_ratio: float = 0.1
+    # Token budgets (estimated locally) and output caps per kind of answer
+    question_max_tokens: int = 500
+    max_input_tokens: int = 2500
+    max_output_tokens_private: int = 1000
+    max_output_tokens_group: int = 350
+    max_output_tokens_poll: int = 400
+    max_output_tokens_reminder: int = 400
+    max_output_tokens_phrases: int = 600
+    # Conversation context for follow-ups (0 token budget disables it)
+    context_max_turns: int = 12
+    context_max_bytes: int = 8000
+    context_ttl_sec: int = 3600
+    context_token_budget: int = 800
+    # Logging: queue mode formats and writes on a background thread; repeated errors are rate-limited
+    log_queue: bool = True
+    log_queue_size: int = 10_000
+    log_error_burst: int = 5
+    log_error_window_sec: float = 60.0
+    log_error_sample_every: int = 50
+    # Share of updates whose handler stages are timed and logged (correlation IDs are always set)
+    trace_sample_rate: float = 0.05
+    # Fallback phrase pool
+    phrase_pool_path: str = "data/phrase_pool.json"
+    phrase_pool_max_per_category: int = 50
+    phrase_pool_batch_size: int = 10
+    phrase_pool_refill_interval_sec: int = 600
+    phrase_pool_quiet_sec: int = 60
+    # Response cache
+    response_cache_ttl_sec: int = 600
+    response_cache_max_entries: int = 1000
+    response_cache_max_bytes: int = 2_000_000
+    response_cache_variants: int = 1
+    # Bounded in-memory state
+    bot_messages_per_chat: int = 200
+    bot_messages_ttl_hours: int = 48
+    state_max_chats: int = 10_000
+    state_max_users: int = 50_000
+    # State persistence ("memory", "sqlite" or "redis" to share state between instances)
+    state_backend: str = "memory"
+    state_db_path: str = "data/state.db"
+    state_flush_interval_sec: float = 2.0
+    redis_url: str = "redis://localhost:6379/0"
+    leader_lease_sec: int = 30
+    # Update delivery ("polling" or "webhook")
+    update_mode: str = "polling"
+    webhook_url: str | None = None
+    webhook_path: str = "/telegram/webhook"
+    webhook_secret: str = ""
+    webhook_max_in_flight: int = 64
+    # Ops server (/healthz, /readyz, /metrics and, with ops_debug, /debug/state)
+    ops_debug: bool = False
+    health_max_loop_lag_sec: float = 2.0
+    ready_update_stale_sec: float = 60.0
+    ready_max_send_queue: int = 200
     # Rate limit
     per_user_window_sec: int = 5
     per_user_max_requests: int = 1
@@ -35,6 +120,9 @@ class AppConfig:
     enable_stickers: bool = True
     enable_roast: bool = True
     enable_idle_monitor: bool = True
+    enable_streaming: bool = False
+    enable_response_cache: bool = True
+    enable_hedging: bool = True
 
 
 def load_config() -> AppConfig:
@@ -55,6 +143,16 @@ def load_config() -> AppConfig:
     # optional external providers / flags
     object.__setattr__(cfg, "tenor_api_key", os.getenv("TENOR_API_KEY", "").strip() or None)
     object.__setattr__(cfg, "giphy_api_key", os.getenv("GIPHY_API_KEY", "").strip() or None)
+    object.__setattr__(cfg, "state_backend", os.getenv("STATE_BACKEND", cfg.state_backend).strip().lower() or cfg.state_backend)
+    object.__setattr__(cfg, "state_db_path", os.getenv("STATE_DB_PATH", cfg.state_db_path).strip() or cfg.state_db_path)
+    object.__setattr__(cfg, "redis_url", os.getenv("REDIS_URL", cfg.redis_url).strip() or cfg.redis_url)
+    object.__setattr__(cfg, "update_mode", os.getenv("UPDATE_MODE", cfg.update_mode).strip().lower() or cfg.update_mode)
+    fallback_models = (m.strip() for m in os.getenv("OPENAI_FALLBACK_MODELS", "").split(","))
+    object.__setattr__(cfg, "openai_fallback_models", tuple(m for m in fallback_models if m and m != openai_model))
+    object.__setattr__(cfg, "webhook_url", os.getenv("WEBHOOK_URL", "").strip() or None)
+    object.__setattr__(cfg, "webhook_path", os.getenv("WEBHOOK_PATH", cfg.webhook_path).strip() or cfg.webhook_path)
+    object.__setattr__(cfg, "webhook_secret", os.getenv("WEBHOOK_SECRET", "").strip())
+    object.__setattr__(cfg, "phrase_pool_path", os.getenv("PHRASE_POOL_PATH", cfg.phrase_pool_path).strip())
     # booleans from env ("1", "true", "yes")
     def _env_bool(name: str, default: bool) -> bool:
         v = os.getenv(name)
@@ -65,6 +163,11 @@ def load_config() -> AppConfig:
     object.__setattr__(cfg, "enable_stickers", _env_bool("ENABLE_STICKERS", cfg.enable_stickers))
     object.__setattr__(cfg, "enable_roast", _env_bool("ENABLE_ROAST", cfg.enable_roast))
     object.__setattr__(cfg, "enable_idle_monitor", _env_bool("ENABLE_IDLE_MONITOR", cfg.enable_idle_monitor))
+    object.__setattr__(cfg, "enable_streaming", _env_bool("ENABLE_STREAMING", cfg.enable_streaming))
+    object.__setattr__(cfg, "enable_response_cache", _env_bool("ENABLE_RESPONSE_CACHE", cfg.enable_response_cache))
+    object.__setattr__(cfg, "enable_hedging", _env_bool("ENABLE_HEDGING", cfg.enable_hedging))
+    object.__setattr__(cfg, "log_queue", _env_bool("LOG_QUEUE", cfg.log_queue))
+    object.__setattr__(cfg, "ops_debug", _env_bool("OPS_DEBUG", cfg.ops_debug))
     # probabilities overrides
     def _env_float(name: str, default: float) -> float:
         v = os.getenv(name)
@@ -79,6 +182,13 @@ def load_config() -> AppConfig:
     object.__setattr__(cfg, "corp_probability", _env_float("CORP_PROB", cfg.corp_probability))
     object.__setattr__(cfg, "short_reply_probability", _env_float("SHORT_PROB", cfg.short_reply_probability))
     object.__setattr__(cfg, "roast_probability", _env_float("ROAST_PROB", cfg.roast_probability))
+    object.__setattr__(cfg, "trace_sample_rate", _env_float("TRACE_SAMPLE_RATE", cfg.trace_sample_rate))
+    object.__setattr__(cfg, "llm_max_concurrency", int(_env_float("LLM_MAX_CONCURRENCY", cfg.llm_max_concurrency)))
+    object.__setattr__(cfg, "llm_max_queue", int(_env_float("LLM_MAX_QUEUE", cfg.llm_max_queue)))
+    object.__setattr__(cfg, "coalesce_window_sec", _env_float("COALESCE_WINDOW_SEC", cfg.coalesce_window_sec))
+    object.__setattr__(cfg, "max_output_tokens_private", int(_env_float("MAX_OUTPUT_TOKENS_PRIVATE", cfg.max_output_tokens_private)))
+    object.__setattr__(cfg, "max_output_tokens_group", int(_env_float("MAX_OUTPUT_TOKENS_GROUP", cfg.max_output_tokens_group)))
+    object.__setattr__(cfg, "context_token_budget", int(_env_float("CONTEXT_TOKEN_BUDGET", cfg.context_token_budget)))
 
     # Validate numeric ranges
     def _check_01(name: str, value: float):
@@ -89,10 +199,23 @@ def load_config() -> AppConfig:
     _check_01("CORP_PROB", cfg.corp_probability)
     _check_01("SHORT_PROB", cfg.short_reply_probability)
     _check_01("ROAST_PROB", cfg.roast_probability)
+    _check_01("TRACE_SAMPLE_RATE", cfg.trace_sample_rate)
     if cfg.sticker_every_nth_reply < 1:
         raise RuntimeError("sticker_every_nth_reply must be >= 1")
     if cfg.idle_check_interval_sec < 1:
         raise RuntimeError("idle_check_interval_sec must be >= 1")
+    if cfg.reminder_variants < 1 or cfg.reminder_fanout_concurrency < 1:
+        raise RuntimeError("reminder_variants and reminder_fanout_concurrency must be >= 1")
+    if cfg.telegram_global_rate_per_sec <= 0 or cfg.telegram_group_rate_per_min < 1:
+        raise RuntimeError("telegram_global_rate_per_sec must be > 0 and telegram_group_rate_per_min >= 1")
+    if not (0.0 <= cfg.coalesce_window_sec <= 10.0) or cfg.coalesce_max_batch < 1:
+        raise RuntimeError("COALESCE_WINDOW_SEC must be between 0 and 10 and coalesce_max_batch >= 1")
+    if cfg.llm_max_concurrency < 1 or cfg.llm_max_queue < 0 or cfg.llm_queue_deadline_sec <= 0:
+        raise RuntimeError("LLM_MAX_CONCURRENCY must be >= 1, LLM_MAX_QUEUE >= 0 and llm_queue_deadline_sec > 0")
+    if min(cfg.llm_weight_private, cfg.llm_weight_group, cfg.llm_weight_reaction, cfg.llm_weight_background) <= 0:
+        raise RuntimeError("llm_weight_* must be > 0")
+    if cfg.log_queue_size < 100 or cfg.log_error_burst < 1 or cfg.log_error_window_sec <= 0 or cfg.log_error_sample_every < 1:
+        raise RuntimeError("log_queue_size must be >= 100, log_error_burst and log_error_sample_every >= 1, log_error_window_sec > 0")
     if cfg.idle_threshold_hours < 1:
         raise RuntimeError("idle_threshold_hours must be >= 1")
     if cfg.greet_suppress_hours < 0:
@@ -101,8 +224,49 @@ def load_config() -> AppConfig:
         raise RuntimeError("roast_cooldown_hours must be >= 0")
     if cfg.telegram_chunk_size < 100:
         raise RuntimeError("telegram_chunk_size looks too small (<100)")
-    if cfg.max_user_prompt_chars < 100:
-        raise RuntimeError("max_user_prompt_chars looks too small (<100)")
+    if cfg.phrase_pool_batch_size < 1 or cfg.phrase_pool_max_per_category < cfg.phrase_pool_batch_size:
+        raise RuntimeError("phrase_pool_batch_size must be >= 1 and <= phrase_pool_max_per_category")
+    if cfg.bot_messages_per_chat < 1 or cfg.state_max_chats < 1 or cfg.state_max_users < 1:
+        raise RuntimeError("bot_messages_per_chat, state_max_chats and state_max_users must be >= 1")
+    if cfg.state_backend not in {"memory", "sqlite", "redis"}:
+        raise RuntimeError(f"STATE_BACKEND must be 'memory', 'sqlite' or 'redis'; got {cfg.state_backend}")
+    if cfg.leader_lease_sec < 3:
+        raise RuntimeError("leader_lease_sec must be >= 3")
+    if cfg.update_mode not in {"polling", "webhook"}:
+        raise RuntimeError(f"UPDATE_MODE must be 'polling' or 'webhook'; got {cfg.update_mode}")
+    if cfg.update_mode == "webhook":
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", cfg.webhook_secret):
+            raise RuntimeError("WEBHOOK_SECRET is required in webhook mode (1-256 chars: A-Z, a-z, 0-9, _ and -)")
+        if not cfg.webhook_path.startswith("/"):
+            raise RuntimeError("WEBHOOK_PATH must start with '/'")
+        if cfg.webhook_max_in_flight < 1:
+            raise RuntimeError("webhook_max_in_flight must be >= 1")
+    if cfg.health_max_loop_lag_sec <= 0 or cfg.ready_update_stale_sec < 15 or cfg.ready_max_send_queue < 1:
+        raise RuntimeError("health_max_loop_lag_sec must be > 0, ready_update_stale_sec >= 15 and ready_max_send_queue >= 1")
+    if cfg.breaker_window_sec <= 0 or cfg.breaker_min_calls < 1 or cfg.breaker_open_sec <= 0 or cfg.breaker_half_open_probes < 1:
+        raise RuntimeError("breaker_window_sec and breaker_open_sec must be > 0, breaker_min_calls and breaker_half_open_probes >= 1")
+    if not (0.0 < cfg.breaker_failure_ratio <= 1.0) or not (0.0 < cfg.breaker_slow_ratio <= 1.0) or cfg.breaker_slow_call_sec <= 0:
+        raise RuntimeError("breaker_failure_ratio and breaker_slow_ratio must be in (0, 1], breaker_slow_call_sec > 0")
+    if not (0.5 <= cfg.hedge_quantile < 1.0) or cfg.hedge_min_delay_sec <= 0 or cfg.hedge_initial_delay_sec < cfg.hedge_min_delay_sec:
+        raise RuntimeError("hedge_quantile must be in [0.5, 1), hedge_min_delay_sec > 0 and hedge_initial_delay_sec >= hedge_min_delay_sec")
+    if not (0.0 <= cfg.hedge_max_ratio <= 1.0):
+        raise RuntimeError("hedge_max_ratio must be between 0.0 and 1.0")
+    if cfg.response_cache_variants < 1:
+        raise RuntimeError("response_cache_variants must be >= 1")
+    if cfg.stream_edit_interval_sec < 1.0:
+        raise RuntimeError("stream_edit_interval_sec must be >= 1.0 (Telegram edit limits)")
+    if cfg.context_token_budget < 0 or cfg.context_max_turns < 0 or cfg.context_max_bytes < 100 or cfg.context_ttl_sec < 60:
+        raise RuntimeError("CONTEXT_TOKEN_BUDGET and context_max_turns must be >= 0, context_max_bytes >= 100, context_ttl_sec >= 60")
+    if cfg.question_max_tokens < 50 or cfg.max_input_tokens < cfg.question_max_tokens + cfg.context_token_budget:
+        raise RuntimeError("question_max_tokens must be >= 50 and max_input_tokens >= question_max_tokens + CONTEXT_TOKEN_BUDGET")
+    if min(
+        cfg.max_output_tokens_private,
+        cfg.max_output_tokens_group,
+        cfg.max_output_tokens_poll,
+        cfg.max_output_tokens_reminder,
+        cfg.max_output_tokens_phrases,
+    ) < 16:
+        raise RuntimeError("MAX_OUTPUT_TOKENS_* must be >= 16")
     return cfg
 
 
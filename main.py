@@ -4,32 +4,60 @@ import logging
 from aiogram import Bot
 from dotenv import load_dotenv
 
-from bot.app import build_app, start_background_tasks
-from bot.health import start_health_server
-from bot.logging_utils import configure_json_logging
-from bot.metrics import start_metrics_server
+from bot.app import build_app, build_ops_server, open_state_backend, start_background_tasks
+from bot.logging_utils import configure_json_logging, shutdown_logging
+from bot.openai_service import close_shared_client
+from bot.services.triage import load_bot_identity
+from bot.webhook import run_webhook
 from config import load_config
 
 load_dotenv()
-configure_json_logging(logging.INFO)
-
 CFG = load_config()
+configure_json_logging(
+    logging.INFO,
+    queued=CFG.log_queue,
+    queue_size=CFG.log_queue_size,
+    error_burst=CFG.log_error_burst,
+    error_window_sec=CFG.log_error_window_sec,
+    error_sample_every=CFG.log_error_sample_every,
+)
 BOT_TOKEN = CFG.bot_token
 
 
 async def main():
     bot = Bot(token=BOT_TOKEN)
+    state_backend = await open_state_backend()
+    # resolve the bot's own username/id once; group triage matches against it locally
+    await load_bot_identity(bot)
     dp = build_app(bot)
-    # start metrics server on 9000
-    start_metrics_server(9000)
-    # start simple health server on 8080
-    start_health_server(8080)
-    start_background_tasks(bot)
+    # /healthz, /readyz and /metrics on 8080, served from this event loop
+    ops = build_ops_server(bot)
+    ops_runner = None
+    start_background_tasks(bot, state_backend)
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if CFG.update_mode == "webhook":
+            # webhook endpoint and the ops routes share port 8080
+            await run_webhook(
+                dp,
+                bot,
+                port=8080,
+                path=CFG.webhook_path,
+                secret_token=CFG.webhook_secret,
+                public_url=CFG.webhook_url,
+                max_in_flight=CFG.webhook_max_in_flight,
+                ops=ops,
+            )
+        else:
+            ops_runner = await ops.start(8080)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        # graceful shutdown: close bot session
+        # graceful shutdown: stop the ops server, close bot session and the shared OpenAI pool
+        if ops_runner is not None:
+            await ops_runner.cleanup()
         await bot.session.close()
+        await close_shared_client()
+        await state_backend.close()
+        shutdown_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
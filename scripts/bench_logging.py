@@ -0,0 +1,67 @@
+"""Event-loop overhead per log call: direct StreamHandler vs the queue-based pipeline.
+
+    python scripts/bench_logging.py [calls]
+
+Each mode logs ``calls`` records (info lines, error lines with a traceback, and a
+burst of one repeated error) from a coroutine and reports the time the coroutine spent
+per call. Two sinks are used: /dev/null, and one that stalls 100 µs per write like a
+full pipe or a slow disk. In queue mode the listener thread still competes for the GIL,
+so the /dev/null numbers include that contention.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.logging_utils import configure_json_logging, log_with_context, shutdown_logging  # noqa: E402
+
+
+class _SlowSink:
+    def __init__(self, stall_sec: float):
+        self.stall_sec = stall_sec
+
+    def write(self, s: str) -> int:
+        time.sleep(self.stall_sec)
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+
+async def _log_calls(n: int) -> float:
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        exc_info = sys.exc_info()
+    start = time.perf_counter()
+    for i in range(n):
+        if i % 10 == 0:
+            logging.error("llm_unexpected_error", exc_info=exc_info)
+        elif i % 10 == 1:
+            logging.error("unique_error %d", i)
+        else:
+            log_with_context(logging.INFO, "bench", chat_id=i, stage="send", elapsed_ms=1.5)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    with open(os.devnull, "w") as devnull:
+        sinks = [("/dev/null", devnull, n), ("slow sink", _SlowSink(0.0001), n // 10)]
+        for sink_name, sink, calls in sinks:
+            for queued in (False, True):
+                configure_json_logging(logging.INFO, queued=queued, queue_size=calls, stream=sink)
+                elapsed = asyncio.run(_log_calls(calls))
+                shutdown_logging()
+                mode = "queue " if queued else "stream"
+                print(f"{sink_name:9} {mode}: {elapsed / calls * 1e6:8.2f} µs per call on the event loop ({calls} calls)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.openai_service import LLM_BREAKER
+
+
+@pytest.fixture(autouse=True)
+def _closed_llm_breaker():
+    # failures recorded by one test must not open the shared breaker for the next
+    LLM_BREAKER.reset()
+    yield
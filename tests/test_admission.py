@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.openai_service import OpenAIService
+from bot.services.admission import AdmissionGate, Overloaded
+
+
+def test_queue_is_fifo_and_bounded():
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=2, deadline_sec=5)
+        order: list[int] = []
+        release = asyncio.Event()
+
+        async def worker(i: int):
+            async with gate.slot():
+                order.append(i)
+                if i == 0:
+                    await release.wait()
+
+        tasks = [asyncio.create_task(worker(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert (gate.active, gate.queued) == (1, 2)
+        with pytest.raises(Overloaded) as exc:
+            await gate.acquire()
+        assert exc.value.reason == "queue_full"
+        release.set()
+        await asyncio.gather(*tasks)
+        return order, gate.active, gate.queued
+
+    assert asyncio.run(run()) == ([0, 1, 2], 0, 0)
+
+
+def test_queued_request_times_out_and_frees_its_place():
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=4, deadline_sec=0.05)
+        await gate.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await gate.acquire()
+        gate.release()
+        return exc.value.reason, gate.active, gate.queued
+
+    assert asyncio.run(run()) == ("timeout", 0, 0)
+
+
+def test_rejects_fast_when_expected_wait_exceeds_deadline():
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=4, deadline_sec=5)
+        async with gate.slot():
+            await asyncio.sleep(0.2)  # teaches the gate that a slot is held ~0.2s
+        await gate.acquire()
+        t0 = time.monotonic()
+        with pytest.raises(Overloaded) as exc:
+            await gate.acquire(deadline_sec=0.05)
+        gate.release()
+        return exc.value.reason, time.monotonic() - t0
+
+    reason, elapsed = asyncio.run(run())
+    assert reason == "deadline"
+    assert elapsed < 0.02
+
+
+def test_openai_service_does_not_retry_when_overloaded():
+    calls = 0
+
+    async def create(**kwargs):
+        nonlocal calls
+        calls += 1
+        return SimpleNamespace(output_text="ok")
+
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=0, deadline_sec=1)
+        svc = OpenAIService(client=SimpleNamespace(responses=SimpleNamespace(create=create)), gate=gate)
+        await gate.acquire()  # the only slot is busy and nobody may queue
+        with pytest.raises(Overloaded):
+            await svc.ask_async([{"role": "user", "content": "hi"}], "m", max_retries=3, backoff_base=0)
+        gate.release()
+        return await svc.ask_async([{"role": "user", "content": "hi"}], "m")
+
+    assert asyncio.run(run()) == "ok"
+    assert calls == 1
+
+
+def test_busy_group_does_not_starve_a_private_chat():
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=10, deadline_sec=5)
+        order: list[str] = []
+        await gate.acquire()  # hold the only slot while the queues build up
+
+        async def call(name: str, chat_id: int, request_class: str):
+            async with gate.slot(flow=chat_id, request_class=request_class):
+                order.append(name)
+
+        spam = [asyncio.create_task(call(f"group{i}", -100, "group")) for i in range(6)]
+        await asyncio.sleep(0)
+        dm = asyncio.create_task(call("dm", 5, "private"))
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(dm, *spam)
+        return order
+
+    order = asyncio.run(run())
+    assert order.index("dm") <= 2  # behind at most one round of the group's quantum
+
+
+def test_full_queue_drops_from_the_longest_flow():
+    async def run():
+        gate = AdmissionGate(limit=1, max_queue=3, deadline_sec=5)
+        await gate.acquire()
+        spam = [asyncio.create_task(gate.acquire(flow=-100, request_class="group")) for _ in range(3)]
+        await asyncio.sleep(0)
+        dm = asyncio.create_task(gate.acquire(flow=5, request_class="private"))
+        await asyncio.wait(spam, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+        dropped = [t for t in spam if t.done()]
+        outcome = [t.exception().reason for t in dropped], dropped == [spam[-1]], gate.queued
+        for _ in range(3):  # dm and the two surviving group requests
+            gate.release()
+        await asyncio.gather(dm, *spam[:2])
+        gate.release()
+        return outcome, gate.active, gate.queued
+
+    assert asyncio.run(run()) == ((["queue_full"], True, 3), 0, 0)
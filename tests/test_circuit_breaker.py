@@ -0,0 +1,81 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+import pytest
+from openai import APIConnectionError, BadRequestError
+from prometheus_client import REGISTRY
+
+from bot.openai_service import OpenAIService
+from bot.services.circuit_breaker import CircuitBreaker, CircuitOpen, counts_as_failure
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("bot.services.circuit_breaker.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_on_failures_or_slow_calls_and_closes_after_probes(clock):
+    breaker = CircuitBreaker(window_sec=30, min_calls=4, failure_ratio=0.5, slow_call_sec=10, slow_ratio=0.75, open_sec=30, half_open_probes=2)
+    for failed in (False, True, False):
+        breaker.acquire()
+        breaker.record(failed, 1.0)
+    clock[0] += 31  # the early calls leave the window
+    for _ in range(2):
+        breaker.record(False, 1.0)
+    breaker.record(True, 1.0)
+    assert breaker.state == "closed"
+    breaker.record(True, 1.0)
+    assert breaker.state == "open"
+    assert REGISTRY.get_sample_value("bot_llm_breaker_state") == 2
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    first, second = breaker.acquire(), breaker.acquire()
+    assert first and second
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()  # only two probes at a time
+    breaker.record(False, 1.0, probe=True)
+    breaker.abandon(second)  # a cancelled probe gives no verdict
+    assert breaker.state == "half_open"
+    breaker.record(False, 1.0, probe=breaker.acquire())
+    assert breaker.state == "closed"
+
+    for _ in range(4):
+        breaker.record(False, 12.0)  # all slow
+    assert breaker.state == "open"
+    clock[0] += 30
+    breaker.record(False, 12.0, probe=breaker.acquire())  # a slow probe re-opens it
+    assert breaker.state == "open"
+
+
+def test_open_breaker_fails_fast_without_calling_the_api():
+    calls = {"n": 0}
+
+    async def create(**kwargs):
+        calls["n"] += 1
+        raise APIConnectionError(request=SimpleNamespace(method="POST", url="https://api"))
+
+    async def main():
+        breaker = CircuitBreaker(min_calls=3, failure_ratio=0.5)
+        svc = OpenAIService(client=SimpleNamespace(responses=SimpleNamespace(create=create)), breaker=breaker)
+        with pytest.raises(APIConnectionError):
+            await svc.ask_async([{"role": "user", "content": "u"}], max_retries=3, backoff_base=0)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpen):
+            await svc.ask_async([{"role": "user", "content": "u"}], max_retries=3, backoff_base=0)
+        with pytest.raises(CircuitOpen):
+            async for _ in svc.stream_async([{"role": "user", "content": "u"}], max_retries=3, backoff_base=0):
+                pass
+
+    asyncio.run(main())
+    assert calls["n"] == 3
+    bad_request = BadRequestError("bad", response=SimpleNamespace(status_code=400, request=None, headers={}), body=None)
+    assert not counts_as_failure(bad_request)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.routers import shared as shared_mod
+from bot.services.coalescer import Coalescer
+
+
+def test_burst_is_flushed_once_after_quiet_window():
+    async def run():
+        flushed: list[list[int]] = []
+
+        async def flush(items):
+            flushed.append(items)
+
+        c = Coalescer(window_sec=0.05, max_batch=10)
+        first = asyncio.create_task(c.submit(1, 1, flush))
+        await asyncio.sleep(0.01)
+        await c.submit(1, 2, flush)  # joins the open batch and returns at once
+        await asyncio.sleep(0.03)
+        await c.submit(1, 3, flush)  # restarts the window
+        assert not first.done()
+        await first
+        return flushed
+
+    assert asyncio.run(run()) == [[1, 2, 3]]
+
+
+def test_full_batch_flushes_early_and_zero_window_passes_through():
+    async def run():
+        flushed: list[list[int]] = []
+
+        async def flush(items):
+            flushed.append(items)
+
+        c = Coalescer(window_sec=10, max_batch=2)
+        first = asyncio.create_task(c.submit("chat", "a", flush))
+        await asyncio.sleep(0)
+        await c.submit("chat", "b", flush)
+        await asyncio.wait_for(first, 1)
+
+        await Coalescer(window_sec=0, max_batch=5).submit("chat", "c", flush)
+        return flushed
+
+    assert asyncio.run(run()) == [["a", "b"], ["c"]]
+
+
+def test_merge_prompts_labels_authors_only_when_mixed():
+    alice = SimpleNamespace(from_user=SimpleNamespace(id=1, username="alice"))
+    bob = SimpleNamespace(from_user=SimpleNamespace(id=2, username=None, full_name="Bob B"))
+    assert shared_mod.merge_prompts([(alice, "раз", 1)]) == "раз"
+    assert shared_mod.merge_prompts([(alice, "раз", 1), (alice, "два", 2)]) == "раз\nдва"
+    assert shared_mod.merge_prompts([(alice, "раз", 1), (bob, "два", 2)]) == "@alice: раз\nBob B: два"
+
+
+def test_submit_llm_request_makes_one_call_for_a_burst(monkeypatch):
+    calls: list[tuple[str, int | None]] = []
+
+    async def fake_handle(m, user_text, reply_to_id=None, rate_checked=False, batch=None):
+        calls.append((user_text, reply_to_id))
+
+    monkeypatch.setattr(shared_mod, "handle_llm_request_shared", fake_handle)
+    monkeypatch.setattr(shared_mod, "COALESCER", Coalescer(window_sec=0.05, max_batch=5))
+
+    def msg(mid):
+        return SimpleNamespace(chat=SimpleNamespace(id=42), message_id=mid, from_user=SimpleNamespace(id=5, username="u"))
+
+    async def run():
+        await asyncio.gather(*(shared_mod.submit_llm_request(msg(i), f"вопрос {i}", reply_to_id=i) for i in (1, 2, 3)))
+
+    asyncio.run(run())
+    assert calls == [("вопрос 1\nвопрос 2\nвопрос 3", 3)]
+
+
+def test_mixed_burst_charges_every_author_and_drops_the_limited_ones(monkeypatch):
+    calls: list[tuple[str, int | None, bool]] = []
+    charged: list[int] = []
+    gated: list[tuple[int, float]] = []
+
+    async def fake_handle(m, user_text, reply_to_id=None, rate_checked=False, batch=None):
+        calls.append((user_text, reply_to_id, rate_checked))
+
+    async def fake_gate(m, reply_to_id, wait_sec):
+        gated.append((reply_to_id, wait_sec))
+
+    async def acquire(user_id, chat_id):
+        charged.append(user_id)
+        return (user_id != 2, 7.0 if user_id == 2 else 0.0)
+
+    monkeypatch.setattr(shared_mod, "handle_llm_request_shared", fake_handle)
+    monkeypatch.setattr(shared_mod, "_reply_rate_limited", fake_gate)
+    monkeypatch.setattr(shared_mod.RATE, "acquire", acquire)
+    monkeypatch.setattr(shared_mod, "COALESCER", Coalescer(window_sec=0.05, max_batch=5))
+
+    def msg(mid, uid):
+        return SimpleNamespace(chat=SimpleNamespace(id=42), message_id=mid, from_user=SimpleNamespace(id=uid, username=f"u{uid}"))
+
+    async def burst(*items):
+        await asyncio.gather(*(shared_mod.submit_llm_request(msg(mid, uid), text, reply_to_id=mid) for mid, uid, text in items))
+
+    asyncio.run(burst((1, 1, "раз"), (2, 2, "два"), (3, 1, "три"), (4, 3, "четыре")))
+    assert charged == [1, 2, 3]
+    assert calls == [("@u1: раз\n@u1: три\n@u3: четыре", 4, True)]
+    assert gated == []
+
+    calls.clear()
+    charged.clear()
+    asyncio.run(burst((5, 2, "снова"), (6, 2, "ещё")))
+    assert charged == [2] and calls == []
+    assert gated == [(6, 7.0)]
@@ -0,0 +1,146 @@
+import asyncio
+import dataclasses
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from aiogram.utils import chat_action as chat_action_mod
+
+from bot.routers import shared as shared_mod
+from bot.services import context_buffer as ctx_mod
+from bot.services.context_buffer import ContextBuffer, pack_context
+from bot.services.token_budget import estimate_tokens
+
+
+def test_buffer_is_bounded_by_turns_bytes_ttl_and_chats(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ctx_mod.time, "time", lambda: now[0])
+    buf = ContextBuffer(max_turns=3, max_bytes=20, ttl_sec=60, max_chats=2)
+    for i in range(5):
+        buf.add(1, "user", f"q{i}", (i,))
+    assert [t.text for t in buf.turns(1)] == ["q2", "q3", "q4"]
+    buf.add(1, "bot", "x" * 17, (9,))  # 2 + 2 + 2 + 17 bytes > 20: the oldest go
+    assert [t.text for t in buf.turns(1)] == ["q4", "x" * 17]
+    assert buf.find(1, 9).role == "bot"
+    buf.add(2, "user", "a")
+    buf.add(3, "user", "b")
+    assert len(buf) == 2 and buf.turns(1) == []
+    now[0] += 61
+    assert buf.turns(3) == []
+
+
+def test_turns_are_filtered_by_user():
+    buf = ContextBuffer(max_turns=10, max_bytes=1000, ttl_sec=60, max_chats=10)
+    buf.add(-100, "user", "про кафку", (1,), user_ids=(7,))
+    buf.add(-100, "bot", "кафка это лог", (2,), user_ids=(7,))
+    buf.add(-100, "user", "про котиков", (3,), user_ids=(8,))
+    assert [t.text for t in buf.turns(-100, user_ids=(7,))] == ["про кафку", "кафка это лог"]
+
+
+def test_pack_context_prefers_pinned_and_relevant_turns_within_budget():
+    buf = ContextBuffer(max_turns=10, max_bytes=10_000, ttl_sec=60, max_chats=10)
+    buf.add(1, "user", "как настроить репликацию postgres", (1,), author="@u")
+    buf.add(1, "bot", "через streaming replication и слоты", (2,))
+    buf.add(1, "user", "а что с погодой", (3,), author="@u")
+    buf.add(1, "bot", "погода не айти", (4,))
+    turns = buf.turns(1)
+    pinned = buf.find(1, 2)
+    budget = estimate_tokens(pinned.render()) + estimate_tokens(turns[0].render())
+    packed = pack_context(turns, "а слоты репликации в postgres как чистить?", budget, pinned=pinned)
+    assert [t.message_ids for t in packed] == [(1,), (2,)]
+    assert pack_context(turns, "что угодно", 0, pinned=pinned) == []
+
+    clipped = pack_context(turns, "x", 5, pinned=pinned)
+    assert len(clipped) == 1 and estimate_tokens(clipped[0].render()) <= 5
+
+
+def test_reply_to_bot_answer_puts_it_into_the_prompt(monkeypatch):
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    class _FakeBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id: int, text: str, reply_to_message_id: int | None = None):
+            self.sent.append(text)
+            return SimpleNamespace(message_id=500 + len(self.sent))
+
+    class _Stickers:
+        async def maybe_send(self, **kwargs):
+            return None
+
+    prompts: list[str] = []
+
+    class _O:
+        async def ask_async(self, messages, *a, **kw):
+            prompts.append(messages[-1]["content"])
+            return f"ответ {len(prompts)}"
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+    monkeypatch.setattr(shared_mod, "CONTEXT", ContextBuffer(max_turns=10, max_bytes=10_000, ttl_sec=600, max_chats=10))
+    monkeypatch.setattr(shared_mod, "CFG", dataclasses.replace(shared_mod.CFG, enable_response_cache=False))
+    shared_mod._bot = _FakeBot()
+    shared_mod.STICKERS = _Stickers()
+    shared_mod.OAI = _O()
+    user = SimpleNamespace(id=31, username="dev", is_bot=False)
+
+    first = SimpleNamespace(chat=SimpleNamespace(id=77), message_id=1, from_user=user, reply_to_message=None)
+    asyncio.run(shared_mod.handle_llm_request_shared(first, "что такое идемпотентность"))
+    bot_msg = SimpleNamespace(message_id=501, text="ответ 1", caption=None, from_user=SimpleNamespace(id=1, is_bot=True))
+    follow_up = SimpleNamespace(chat=SimpleNamespace(id=77), message_id=2, from_user=user, reply_to_message=bot_msg)
+    asyncio.run(shared_mod.handle_llm_request_shared(follow_up, "а пример?"))
+
+    assert "Контекст переписки" not in prompts[0]
+    assert "@dev: что такое идемпотентность\nТы: ответ 1" in prompts[1]
+    assert prompts[1].endswith("Текст пользователя: а пример?")
+
+
+def test_coalesced_burst_keeps_each_authors_turns(monkeypatch):
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    class _FakeBot:
+        async def send_message(self, chat_id: int, text: str, reply_to_message_id: int | None = None):
+            return SimpleNamespace(message_id=900)
+
+    class _Stickers:
+        async def maybe_send(self, **kwargs):
+            return None
+
+    class _O:
+        async def ask_async(self, messages, *a, **kw):
+            return "общий ответ"
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+    monkeypatch.setattr(shared_mod, "CONTEXT", ContextBuffer(max_turns=10, max_bytes=10_000, ttl_sec=600, max_chats=10))
+    monkeypatch.setattr(shared_mod, "CFG", dataclasses.replace(shared_mod.CFG, enable_response_cache=False))
+    shared_mod._bot = _FakeBot()
+    shared_mod.STICKERS = _Stickers()
+    shared_mod.OAI = _O()
+
+    def msg(mid, uid, name):
+        return SimpleNamespace(chat=SimpleNamespace(id=-5), message_id=mid, from_user=SimpleNamespace(id=uid, username=name), reply_to_message=None)
+
+    a1, b, a2 = msg(1, 41, "ann"), msg(2, 42, "bob"), msg(3, 41, "ann")
+    batch = [(a1, "про кафку"), (b, "про котиков"), (a2, "и про ретраи")]
+    asyncio.run(shared_mod.handle_llm_request_shared(a2, shared_mod.merge_prompts([(bm, t, None) for bm, t in batch]), batch=batch))
+
+    ann = shared_mod.CONTEXT.turns(-5, user_ids=(41,))
+    assert [(t.role, t.text, t.message_ids) for t in ann] == [("user", "про кафку\nи про ретраи", (1, 3)), ("bot", "общий ответ", (900,))]
+    bob = shared_mod.CONTEXT.turns(-5, user_ids=(42,))
+    assert [(t.role, t.author, t.text) for t in bob] == [("user", "@bob", "про котиков"), ("bot", "", "общий ответ")]
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services import idle_monitor
+from bot.services.fanout import fan_out
+from bot.services.phrase_pool import PhrasePool
+
+
+def test_fan_out_bounds_concurrency_and_counts_failures():
+    active = {"now": 0, "max": 0}
+
+    async def send(chat_id: int) -> None:
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        if chat_id % 10 == 0:
+            raise RuntimeError("blocked by user")
+
+    sent, failed = asyncio.run(fan_out(range(1, 41), send, kind="test", concurrency=4, rate_per_sec=10_000))
+    assert (sent, failed) == (36, 4)
+    assert active["max"] == 4
+
+
+def test_fan_out_respects_global_rate():
+    async def send(chat_id: int) -> None:
+        return None
+
+    started = time.monotonic()
+    asyncio.run(fan_out(range(11), send, kind="test", concurrency=11, rate_per_sec=50))
+    assert time.monotonic() - started >= 0.19  # 10 intervals of 20ms
+
+
+def test_weekly_reminders_use_one_llm_call_for_all_chats():
+    calls = {"n": 0}
+
+    class _O:
+        async def ask_async(self, *a, **kw):
+            calls["n"] += 1
+            return "раз\nдва\nтри"
+
+    class _Bot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id: int, text: str):
+            self.sent.append((chat_id, text))
+            return SimpleNamespace(message_id=1)
+
+    async def run(bot):
+        variants = await idle_monitor.weekly_variants(PhrasePool(), _O())
+        return await idle_monitor.send_weekly_reminders(bot, list(range(100, 130)), variants, "2099-01-02")
+
+    bot = _Bot()
+    assert asyncio.run(run(bot)) == (30, 0)
+    assert calls["n"] == 1
+    assert {t for _, t in bot.sent} == {"раз", "два", "три"}
+    assert idle_monitor._last_weekly_alert_on_date.get(115) == "2099-01-02"
+
+
+def test_weekly_window_retries_chats_whose_send_failed(monkeypatch):
+    import dataclasses
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+
+    from bot.services.idle_scheduler import IdleScheduler
+    from bot.services.state_store import ExpiringDict
+
+    friday = datetime(2099, 1, 2, 9, 3, tzinfo=ZoneInfo("Asia/Almaty"))  # inside the 09:00-09:10 window
+    monkeypatch.setattr(idle_monitor, "datetime", SimpleNamespace(now=lambda tz: friday))
+    monkeypatch.setattr(idle_monitor, "CFG", dataclasses.replace(idle_monitor.CFG, enable_idle_monitor=True, idle_check_interval_sec=0.05))
+    monkeypatch.setattr(idle_monitor, "_last_weekly_alert_on_date", ExpiringDict("weekly_retry_test", ttl_sec=3600, max_entries=10))
+
+    async def variants(phrases, oai):
+        return ["пятница"]
+
+    monkeypatch.setattr(idle_monitor, "weekly_variants", variants)
+
+    class _Bot:
+        def __init__(self):
+            self.attempts: list[int] = []
+
+        async def send_message(self, chat_id: int, text: str):
+            self.attempts.append(chat_id)
+            if chat_id == 2 and self.attempts.count(2) == 1:
+                raise ConnectionError("network blip")
+            return SimpleNamespace(message_id=1)
+
+    async def main(bot):
+        activity = ExpiringDict("weekly_retry_activity", ttl_sec=3600, max_entries=10)
+        for cid in (1, 2):
+            activity[cid] = time.time()
+        loop = asyncio.create_task(idle_monitor.idle_monitor_loop(bot, activity, PhrasePool(), IdleScheduler(3600), None))
+        await asyncio.sleep(0.3)
+        loop.cancel()
+
+    bot = _Bot()
+    asyncio.run(main(bot))
+    # chat 2 failed once and was sent on the next check; chat 1 is not sent twice, and nothing repeats once done
+    assert sorted(bot.attempts) == [1, 2, 2]
@@ -61,16 +61,21 @@ def test_group_trigger_creates_poll(monkeypatch):
     fake_bot = _FakeBot()
 
     # make LLM deterministic
-    seq = iter(["intro", "вопрос?", "да", "нет"])
-    async def fake_to_thread(fn, *a, **kw):
-        return next(seq)
-    monkeypatch.setattr(asyncio, "to_thread", fake_to_thread)
+    calls = {"n": 0}
+    class _O:
+        async def ask_fields_async(self, system_prompt, fields, *a, **kw):
+            calls["n"] += 1
+            assert set(fields) == {"intro", "question", "tail_yes", "tail_no"}
+            return {"intro": "intro", "question": "вопрос?", "tail_yes": "да", "tail_no": "нет"}
+    monkeypatch.setattr(groups, "_OAI", _O())
 
     m = _make_msg("идём в шмель?")
     asyncio.run(groups.group_trigger(m, fake_bot))
     assert fake_bot.polls, "poll should be created"
     assert any("иду" in opt.lower() for opt in fake_bot.polls[0][2])
     assert any("не иду" in opt.lower() for opt in fake_bot.polls[0][2])
+    assert fake_bot.polls[0][1] == "вопрос?"
+    assert calls["n"] == 1, "poll texts should come from a single LLM request"
 
 
 def test_group_trigger_skips_if_already_polled_today(monkeypatch):
@@ -0,0 +1,75 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from openai import OpenAIError
+from prometheus_client import REGISTRY
+
+from bot.openai_service import OpenAIService
+from bot.services.admission import AdmissionGate
+from bot.services.hedging import HedgePolicy
+
+
+class _ModelClient:
+    """Answers per model after a scripted delay (or raises the scripted exception)."""
+
+    def __init__(self, behaviour: dict[str, list]):
+        self.behaviour = behaviour
+        self.calls: list[str] = []
+        self.cancelled: list[str] = []
+        self.responses = SimpleNamespace(create=self._create)
+
+    async def _create(self, model: str, instructions: str, input: str, timeout: float):
+        self.calls.append(model)
+        step = self.behaviour[model].pop(0)
+        if isinstance(step, Exception):
+            raise step
+        try:
+            await asyncio.sleep(step)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        return SimpleNamespace(output_text=model)
+
+
+def _sample(name: str, site: str) -> float:
+    return REGISTRY.get_sample_value(name, {"call_site": site}) or 0.0
+
+
+def test_slow_primary_is_hedged_to_the_next_model_within_budget():
+    policy = HedgePolicy(min_delay_sec=0.05, initial_delay_sec=0.05, max_ratio=0.5, burst=1.0)
+    client = _ModelClient({"primary": [1.0, 1.0, 0.3], "fast": [0.01]})
+    svc = OpenAIService(client=client, gate=AdmissionGate(4, 8, 5.0), models=["primary", "fast"], hedge=policy)
+    msgs = [{"role": "user", "content": "u"}]
+    hedges, wins = _sample("bot_llm_hedges_total", "hedge_test"), _sample("bot_llm_hedge_wins_total", "hedge_test")
+
+    async def main():
+        first = await svc.ask_async(msgs, request_class="private", call_site="hedge_test")
+        # the budget (one token, half a token earned per request) is spent: no second hedge yet
+        second = await svc.ask_async(msgs, request_class="private", call_site="hedge_test", timeout_sec=0.5)
+        # background work is never hedged
+        third = await svc.ask_async(msgs, request_class="background", call_site="hedge_test")
+        return first, second, third
+
+    assert asyncio.run(main()) == ("fast", "primary", "primary")
+    assert client.calls == ["primary", "fast", "primary", "primary"]
+    assert client.cancelled == ["primary"]
+    assert _sample("bot_llm_hedges_total", "hedge_test") == hedges + 1
+    assert _sample("bot_llm_hedge_wins_total", "hedge_test") == wins + 1
+
+
+def test_retries_fall_back_along_the_model_chain_and_delay_tracks_the_tail():
+    client = _ModelClient({"primary": [OpenAIError("down")], "backup": [0]})
+    svc = OpenAIService(client=client, models=["primary", "backup"], hedge=HedgePolicy())
+    out = asyncio.run(svc.ask_async([{"role": "user", "content": "u"}], max_retries=2, backoff_base=0, request_class="private"))
+    assert out == "backup" and client.calls == ["primary", "backup"]
+
+    policy = HedgePolicy(quantile=0.9, min_delay_sec=0.5, initial_delay_sec=6.0, min_samples=20)
+    assert policy.delay("m") == 6.0
+    for i in range(100):
+        policy.observe("m", i / 10)  # 0.0 .. 9.9 s
+    assert policy.delay("m") == 9.0
+    assert REGISTRY.get_sample_value("bot_llm_hedge_delay_seconds", {"model": "m"}) == 9.0
@@ -0,0 +1,54 @@
+import asyncio
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services.idle_monitor import next_weekly_window
+from bot.services.idle_scheduler import IdleScheduler
+
+
+def test_scheduler_orders_deadlines_and_reschedules():
+    s = IdleScheduler(threshold_sec=100)
+    s.touch(1, 0.0)
+    s.touch(2, 10.0)
+    s.touch(1, 50.0)  # activity in chat 1 pushes its deadline back
+    assert s.next_deadline() == 110.0
+    assert s.pop_due(120.0) == [2]
+    assert s.pop_due(149.0) == []
+    assert s.pop_due(150.0) == [1]
+    assert len(s) == 0 and s.next_deadline() is None
+
+
+def test_scheduler_compacts_stale_entries():
+    s = IdleScheduler(threshold_sec=100)
+    for i in range(1000):
+        s.touch(7, float(i))
+    assert len(s._heap) < 100
+    assert s.pop_due(2000.0) == [7]
+
+
+def test_scheduler_wait_is_woken_by_earlier_deadline():
+    async def run():
+        s = IdleScheduler(threshold_sec=100)
+        s.touch(1)
+        s._wakeup.clear()
+        waiter = asyncio.create_task(s.wait(30))
+        await asyncio.sleep(0)
+        s.touch(2, 0.0)  # earlier than chat 1's deadline
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+
+
+def test_next_weekly_window():
+    tz = ZoneInfo("Asia/Almaty")
+    wed = datetime(2026, 10, 14, 12, 0, tzinfo=tz)
+    assert next_weekly_window(wed) == datetime(2026, 10, 16, 9, 0, tzinfo=tz)
+    fri_in_window = datetime(2026, 10, 16, 9, 5, tzinfo=tz)
+    assert next_weekly_window(fri_in_window) <= fri_in_window
+    assert next_weekly_window(fri_in_window, done_key="2026-10-16") == datetime(2026, 10, 23, 9, 0, tzinfo=tz)
+    fri_late = datetime(2026, 10, 16, 9, 30, tzinfo=tz)
+    assert next_weekly_window(fri_late) == datetime(2026, 10, 23, 9, 0, tzinfo=tz)
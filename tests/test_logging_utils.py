@@ -0,0 +1,71 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+from prometheus_client import REGISTRY
+
+from bot.logging_utils import (
+    DroppingQueueHandler,
+    RepeatedErrorFilter,
+    configure_json_logging,
+    log_with_context,
+    shutdown_logging,
+)
+
+
+def _record(msg: object, level: int = logging.ERROR) -> logging.LogRecord:
+    return logging.LogRecord("bot", level, __file__, 1, msg, None, None)
+
+
+@pytest.fixture
+def root_handlers():
+    root = logging.getLogger()
+    saved, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    root.handlers[:] = saved
+    root.setLevel(level)
+
+
+def test_queue_handler_drops_instead_of_blocking_when_full():
+    before = REGISTRY.get_sample_value("bot_log_records_dropped_total", {"reason": "queue_full"}) or 0
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DroppingQueueHandler(q, maxsize=2)
+    for i in range(5):
+        handler.handle(_record(f"line {i}", logging.INFO))
+    assert q.qsize() == 2 and handler.dropped == 3
+    assert REGISTRY.get_sample_value("bot_log_records_dropped_total", {"reason": "queue_full"}) == before + 3
+
+
+def test_repeated_errors_are_sampled_and_counted_in_the_next_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("bot.logging_utils.time.monotonic", lambda: now[0])
+    f = RepeatedErrorFilter(burst=2, window_sec=60, sample_every=3)
+
+    passed = [f.filter(_record("llm_error")) for _ in range(10)]
+    # 2 in the burst, then every 3rd repeat
+    assert passed == [True, True, False, False, True, False, False, True, False, False]
+    assert f.filter(_record("other_error")) and f.filter(_record("llm_error", logging.INFO))
+
+    now[0] += 61
+    record = _record("llm_error")
+    assert f.filter(record) and record.suppressed == 6
+    # non-string messages, even unhashable ones, are keyed by their text
+    assert all(f.filter(_record(["a"])) for _ in range(2)) and not f.filter(_record(["a"]))
+
+
+def test_queued_logging_writes_json_lines_after_shutdown(root_handlers):
+    out = io.StringIO()
+    configure_json_logging(logging.INFO, queued=True, stream=out)
+    log_with_context(logging.INFO, "hello %s", chat_id=1)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.exception("failed")
+    shutdown_logging()
+
+    first, second = (json.loads(line) for line in out.getvalue().splitlines())
+    assert first["msg"] == "hello %s" and first["chat_id"] == 1 and first["ts"].endswith("+00:00")
+    assert second["level"] == "ERROR" and "ValueError: boom" in second["exc"]
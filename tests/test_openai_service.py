@@ -1,3 +1,4 @@
+import asyncio
 import os
 from types import SimpleNamespace
 
@@ -5,9 +6,11 @@ from types import SimpleNamespace
 os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
 os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
 
-from openai import OpenAIError, RateLimitError
+import pytest
+from openai import BadRequestError, OpenAIError, RateLimitError
 
-from bot.openai_service import OpenAIService
+from bot import openai_service as mod
+from bot.openai_service import FieldSpec, OpenAIService
 
 
 class _DummyClient:
@@ -83,3 +86,177 @@ def test_openai_service_raises_generic_error():
     assert raised
 
 
+
+
+class _AsyncFlakyClient:
+    def __init__(self):
+        self._calls = 0
+        self.responses = SimpleNamespace(create=self._create)
+
+    async def _create(self, model: str, instructions: str, input: str, timeout: float):
+        self._calls += 1
+        if self._calls == 1:
+            raise OpenAIError("boom")
+        return SimpleNamespace(output_text=f"{instructions}|{input}")
+
+
+def test_openai_service_ask_async_retries_without_blocking(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(s):
+        sleeps.append(s)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    svc = OpenAIService(client=_AsyncFlakyClient())
+    out = asyncio.run(svc.ask_async([
+        {"role": "system", "content": "s"},
+        {"role": "user", "content": "u"},
+    ], max_retries=2, timeout_sec=0.1, backoff_base=0.5))
+    assert out == "s|u"
+    assert sleeps == [0.5]
+
+
+def test_openai_service_uses_shared_client_by_default():
+    assert OpenAIService().client is OpenAIService().client
+
+
+class _AsyncStreamClient:
+    def __init__(self, deltas: list[str]):
+        self._deltas = deltas
+        self.responses = SimpleNamespace(create=self._create)
+
+    async def _create(self, **kwargs):
+        assert kwargs["stream"] is True
+
+        async def events():
+            yield SimpleNamespace(type="response.created")
+            for d in self._deltas:
+                yield SimpleNamespace(type="response.output_text.delta", delta=d)
+            yield SimpleNamespace(type="response.completed")
+
+        return events()
+
+
+def test_openai_service_stream_async_yields_text_deltas():
+    svc = OpenAIService(client=_AsyncStreamClient(["a", "b", "c"]))
+
+    async def collect():
+        return [d async for d in svc.stream_async([{"role": "user", "content": "u"}], max_retries=1)]
+
+    assert asyncio.run(collect()) == ["a", "b", "c"]
+
+
+class _StructuredClient:
+    def __init__(self, structured: str):
+        self._structured = structured
+        self.calls = []
+        self.responses = SimpleNamespace(create=self._create)
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        if "text" in kwargs:
+            return SimpleNamespace(output_text=self._structured)
+        return SimpleNamespace(output_text=f"  {kwargs['input']}  ")
+
+
+_FIELDS = {"a": FieldSpec("про а", 5), "b": FieldSpec("про б", 50)}
+
+
+def test_ask_fields_async_single_structured_call():
+    client = _StructuredClient('{"a": "значение а", "b": "бэ"}')
+    out = asyncio.run(OpenAIService(client=client).ask_fields_async("sys", _FIELDS, max_retries=1))
+    assert out == {"a": "значе", "b": "бэ"}  # over-long field is cut to max_len
+    assert len(client.calls) == 1
+    fmt = client.calls[0]["text"]["format"]
+    assert fmt["type"] == "json_schema" and fmt["schema"]["required"] == ["a", "b"]
+
+
+def test_ask_fields_async_falls_back_to_per_field_calls():
+    client = _StructuredClient('{"a": ""}')
+    out = asyncio.run(OpenAIService(client=client).ask_fields_async("sys", _FIELDS, max_retries=1))
+    assert out == {"a": "про а", "b": "про б (до 50 символов)"}
+    assert len(client.calls) == 3
+
+
+def test_ask_fields_async_falls_back_when_the_schema_is_rejected():
+    class _NoSchemaClient(_StructuredClient):
+        async def _create(self, **kwargs):
+            if "text" in kwargs:
+                self.calls.append(kwargs)
+                raise BadRequestError("text.format unsupported", response=SimpleNamespace(status_code=400, request=None, headers={}), body=None)
+            return await super()._create(**kwargs)
+
+    client = _NoSchemaClient("")
+    out = asyncio.run(OpenAIService(client=client).ask_fields_async("sys", _FIELDS, max_retries=1))
+    assert out == {"a": "про а", "b": "про б (до 50 символов)"}
+    assert len(client.calls) == 3
+
+    class _DownClient(_StructuredClient):
+        async def _create(self, **kwargs):
+            self.calls.append(kwargs)
+            raise OpenAIError("down")
+
+    client = _DownClient("")
+    with pytest.raises(OpenAIError):
+        asyncio.run(OpenAIService(client=client).ask_fields_async("sys", _FIELDS, max_retries=1))
+    assert len(client.calls) == 1  # no per-field calls while the API is failing
+
+
+def test_openai_service_records_per_call_site_metrics(monkeypatch):
+    from prometheus_client import REGISTRY
+
+    async def fake_sleep(s):
+        return None
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    class _UsageClient(_AsyncFlakyClient):
+        async def _create(self, **kwargs):
+            self._calls += 1
+            if self._calls == 1:
+                raise OpenAIError("boom")
+            return SimpleNamespace(output_text="ok", usage=SimpleNamespace(input_tokens=7, output_tokens=2))
+
+    before = {
+        "attempts": sample("bot_llm_attempt_seconds_count", call_site="test_site"),
+        "calls": sample("bot_llm_latency_seconds_count", call_site="test_site"),
+        "ok": sample("bot_llm_calls_total", call_site="test_site", outcome="ok"),
+        "retries": sample("bot_llm_retries_total", call_site="test_site"),
+        "errors": sample("bot_llm_errors_total", call_site="test_site", error="OpenAIError"),
+        "input": sample("bot_llm_tokens_total", call_site="test_site", kind="input"),
+    }
+    out = asyncio.run(OpenAIService(client=_UsageClient()).ask_async([{"role": "user", "content": "u"}], max_retries=3, call_site="test_site"))
+    assert out == "ok"
+    assert sample("bot_llm_attempt_seconds_count", call_site="test_site") == before["attempts"] + 2
+    assert sample("bot_llm_latency_seconds_count", call_site="test_site") == before["calls"] + 1
+    assert sample("bot_llm_calls_total", call_site="test_site", outcome="ok") == before["ok"] + 1
+    assert sample("bot_llm_retries_total", call_site="test_site") == before["retries"] + 1
+    assert sample("bot_llm_errors_total", call_site="test_site", error="OpenAIError") == before["errors"] + 1
+    assert sample("bot_llm_tokens_total", call_site="test_site", kind="input") == before["input"] + 7
+
+
+def test_sync_ask_without_a_client_closes_its_own_inside_the_loop(monkeypatch):
+    opened: list = []
+
+    class _OwnClient:
+        def __init__(self, api_key: str):
+            self.closed_in_loop = False
+            self.responses = SimpleNamespace(create=self._create)
+            opened.append(self)
+
+        async def _create(self, model: str, instructions: str, input: str, timeout: float):
+            return SimpleNamespace(output_text="own")
+
+        async def close(self):
+            self.closed_in_loop = asyncio.get_running_loop().is_running()
+
+    monkeypatch.setattr(mod, "AsyncOpenAI", _OwnClient)
+    monkeypatch.setattr(mod, "_shared_client", None)
+    svc = OpenAIService(models=["m"], hedge=None)
+    assert svc.ask([{"role": "user", "content": "u"}], max_retries=1) == "own"
+    assert svc.ask([{"role": "user", "content": "u"}], max_retries=1) == "own"
+    assert len(opened) == 2 and all(c.closed_in_loop for c in opened)
+    assert mod._shared_client is None and svc._client is None
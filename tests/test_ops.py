@@ -0,0 +1,74 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from aiogram.methods import GetMe, GetUpdates
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.ops import LoopLagMonitor, OpsServer, PollingWatch
+
+
+async def _client(ops: OpsServer) -> TestClient:
+    client = TestClient(TestServer(ops.attach(web.Application())))
+    await client.start_server()
+    return client
+
+
+def test_readyz_reports_each_check_and_healthz_sees_a_blocked_loop():
+    async def main():
+        queue_depth = [0]
+        ops = OpsServer(
+            LoopLagMonitor(interval_sec=0.05),
+            {"send_queue": lambda: queue_depth[0] < 10},
+            max_loop_lag_sec=0.2,
+            debug_state=lambda: {"send_queue": queue_depth[0]},
+        )
+        client = await _client(ops)
+        try:
+            resp = await client.get("/readyz")
+            assert resp.status == 200 and await resp.json() == {"ok": True, "checks": {"send_queue": True}}
+            queue_depth[0] = 50
+            resp = await client.get("/readyz")
+            assert resp.status == 503 and (await resp.json())["checks"] == {"send_queue": False}
+            assert await (await client.get("/debug/state")).json() == {"send_queue": 50}
+
+            assert (await client.get("/healthz")).status == 200
+            time.sleep(0.4)  # a blocking call on the event loop
+            await asyncio.sleep(0.06)
+            resp = await client.get("/healthz")
+            assert resp.status == 503 and (await resp.json())["loop_lag_ms"] >= 200
+
+            resp = await client.get("/metrics")
+            assert resp.status == 200 and "bot_event_loop_lag_seconds" in await resp.text()
+        finally:
+            await client.close()
+        assert not ops.lag.running
+
+    asyncio.run(main())
+
+
+def test_polling_watch_only_counts_successful_get_updates():
+    async def main():
+        watch = PollingWatch()
+
+        async def make_request(bot, method):
+            return "response"
+
+        async def failing_request(bot, method):
+            raise ConnectionError
+
+        assert not watch.alive(60)
+        await watch(make_request, None, GetMe())
+        with pytest.raises(ConnectionError):
+            await watch(failing_request, None, GetUpdates(timeout=10))
+        assert not watch.alive(60)
+        assert await watch(make_request, None, GetUpdates(timeout=10)) == "response"
+        assert watch.alive(60)
+
+    asyncio.run(main())
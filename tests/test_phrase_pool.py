@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services.phrase_pool import DEFAULT_PHRASES, PHRASE_PROMPTS, PhrasePool, parse_phrases
+
+
+class _O:
+    def __init__(self):
+        self.calls = 0
+
+    async def ask_async(self, messages, model=None, **kw):
+        self.calls += 1
+        return "1. Жди\n- Ещё жди\n\n\"Сказано ждать\""
+
+
+def test_phrase_pool_falls_back_to_defaults():
+    pool = PhrasePool()
+    assert pool.get("gate") in DEFAULT_PHRASES["gate"]
+
+
+def test_parse_phrases_strips_bullets_and_quotes():
+    assert parse_phrases("1. Жди\n- Ещё жди\n\n\"Сказано ждать\"") == ["Жди", "Ещё жди", "Сказано ждать"]
+
+
+def test_phrase_pool_refill_batches_and_caps(tmp_path):
+    pool = PhrasePool(path=str(tmp_path / "pool.json"), max_per_category=4, quiet_sec=0)
+    oai = _O()
+    added = asyncio.run(pool.refill(oai, "m", batch_size=3))
+    assert oai.calls == len(PHRASE_PROMPTS)
+    assert added == 3 * len(PHRASE_PROMPTS)
+    assert pool.get("idle") in {"Жди", "Ещё жди", "Сказано ждать"}
+    # second refill tops up to the cap and drops the oldest
+    asyncio.run(pool.refill(oai, "m", batch_size=3))
+    assert pool.size("idle") == 4
+
+    pool.save()
+    warm = PhrasePool(path=str(tmp_path / "pool.json"), max_per_category=4)
+    warm.load()
+    assert warm.size("idle") == 4
+
+
+def test_phrase_pool_refill_skipped_while_busy():
+    pool = PhrasePool(quiet_sec=60)
+    pool.mark_busy()
+    oai = _O()
+    assert asyncio.run(pool.refill(oai, "m", batch_size=3)) == 0
+    assert oai.calls == 0
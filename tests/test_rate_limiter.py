@@ -21,3 +21,31 @@ def test_rate_limiter_per_user_and_chat_windows():
     assert rl.allow(uid, chat) is True
 
 
+
+
+def test_rate_limiter_retry_after_reports_wait():
+    rl = RateLimiter(per_user_window_sec=10, per_user_max=1, per_chat_window_sec=10, per_chat_max=5)
+    assert rl.retry_after(1, 100) == 0.0
+    assert rl.allow(1, 100) is True
+    wait = rl.retry_after(1, 100)
+    assert 9.0 < wait <= 10.0
+
+
+def test_rate_limiter_evicts_idle_keys(monkeypatch):
+    from bot.services import rate_limit as rl_mod
+
+    now = [0.0]
+    monkeypatch.setattr(rl_mod.time, "monotonic", lambda: now[0])
+    rl = RateLimiter(per_user_window_sec=5, per_user_max=1, per_chat_window_sec=5, per_chat_max=5)
+    for uid in range(100):
+        assert rl.allow(uid, uid) is True
+    assert rl.tracked_keys() == 200
+    now[0] += 6
+    # every new call evicts a couple of fully refilled keys from the front
+    for uid in range(1000, 1100):
+        rl.allow(uid, uid)
+    assert rl.tracked_keys() == 200
+    now[0] += 6
+    for uid in range(2000, 2200):
+        rl.allow(uid, uid)
+    assert rl.tracked_keys() < 450
@@ -0,0 +1,45 @@
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services import response_cache as rc_mod
+from bot.services.response_cache import ResponseCache, make_cache_key
+
+
+def test_cache_key_normalizes_prompt_and_includes_model():
+    assert make_cache_key("m", "Привет   МИР\n") == make_cache_key("m", "привет мир")
+    assert make_cache_key("m", "привет") != make_cache_key("other", "привет")
+    assert make_cache_key("m", "привет", "toxic", "group") != make_cache_key("m", "привет", "toxic", "private")
+
+
+def test_cache_hit_and_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rc_mod.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl_sec=10, max_entries=10, max_bytes=10_000)
+    cache.put("k", "ответ")
+    assert cache.get("k") == "ответ"
+    now[0] += 11
+    assert cache.get("k") is None
+    assert len(cache) == 0 and cache.size_bytes == 0
+
+
+def test_cache_lru_eviction_by_count_and_bytes():
+    cache = ResponseCache(ttl_sec=60, max_entries=2, max_bytes=10)
+    cache.put("a", "aaa")
+    cache.put("b", "bbb")
+    assert cache.get("a") == "aaa"  # a becomes most recent
+    cache.put("c", "ccc")
+    assert cache.get("b") is None
+    cache.put("d", "dddddd")  # 3 + 3 + 6 bytes > 10 -> oldest goes
+    assert cache.get("a") is None
+    assert cache.size_bytes <= 10
+
+
+def test_cache_variants_mode_serves_random_of_last_n():
+    cache = ResponseCache(ttl_sec=60, max_entries=10, max_bytes=10_000, variants=2)
+    cache.put("k", "один")
+    assert cache.get("k") is None  # still collecting variants
+    cache.put("k", "два")
+    cache.put("k", "три")
+    assert {cache.get("k") for _ in range(50)} <= {"два", "три"}
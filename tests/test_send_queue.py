@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from aiogram import exceptions as tg_exc
+from aiogram.methods import SendMessage
+
+from bot.services.send_queue import Priority, SendQueue
+
+
+def test_send_queue_passes_through_until_started():
+    q = SendQueue(global_rate_per_sec=30, group_rate_per_min=20)
+
+    async def call(chat_id: int, text: str):
+        return (chat_id, text)
+
+    assert asyncio.run(q.submit(call, chat_id=1, text="x")) == (1, "x")
+
+
+def test_send_queue_orders_by_priority():
+    order = []
+
+    async def run():
+        q = SendQueue(global_rate_per_sec=30, group_rate_per_min=20)
+        worker = q.start()
+
+        async def call(chat_id: int, text: str):
+            order.append(text)
+
+        # all three enqueue before the worker wakes up
+        jobs = [
+            asyncio.create_task(q.submit(call, priority=Priority.REMINDER, chat_id=1, text="reminder")),
+            asyncio.create_task(q.submit(call, priority=Priority.STICKER, chat_id=2, text="sticker")),
+            asyncio.create_task(q.submit(call, priority=Priority.REPLY, chat_id=3, text="reply")),
+        ]
+        await asyncio.wait_for(asyncio.gather(*jobs), 1)
+        worker.cancel()
+
+    asyncio.run(run())
+    assert order == ["reply", "sticker", "reminder"]
+
+
+def test_send_queue_enforces_per_group_limit():
+    async def run():
+        q = SendQueue(global_rate_per_sec=30, group_rate_per_min=2)
+        worker = q.start()
+
+        async def call(chat_id: int):
+            return chat_id
+
+        jobs = [asyncio.create_task(q.submit(call, chat_id=-100)) for _ in range(3)]
+        jobs.append(asyncio.create_task(q.submit(call, chat_id=5)))  # private chats are not held back
+        # edits of a streamed answer do not spend the group's budget
+        jobs += [asyncio.create_task(q.submit(call, group_limited=False, chat_id=-100)) for _ in range(3)]
+        done, pending = await asyncio.wait(jobs, timeout=0.3)
+        depth = q.depth()
+        worker.cancel()
+        return len(done), len(pending), depth
+
+    assert asyncio.run(run()) == (6, 1, 1)
+
+
+def test_send_queue_honours_retry_after_centrally():
+    calls = {"n": 0}
+
+    async def run():
+        q = SendQueue(global_rate_per_sec=30, group_rate_per_min=20)
+        worker = q.start()
+
+        async def call(chat_id: int):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise tg_exc.TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text="x"), message="flood", retry_after=1)
+            return "ok"
+
+        result = await asyncio.wait_for(q.submit(call, chat_id=-1), 3)
+        worker.cancel()
+        return result
+
+    assert asyncio.run(run()) == "ok"
+    assert calls["n"] == 2
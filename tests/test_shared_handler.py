@@ -52,7 +52,7 @@ def test_handle_llm_rate_limited_path(monkeypatch):
 
     # force generated gate text
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             return "Очередь занята"
 
     shared_mod.OAI = _O()
@@ -82,7 +82,7 @@ def test_handle_llm_happy_path_single_message(monkeypatch):
     monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
 
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             return "Ответ"
 
     shared_mod.OAI = _O()
@@ -115,7 +115,7 @@ def test_handle_llm_main_ratelimit_branch(monkeypatch):
 
     calls = {"n": 0}
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             calls["n"] += 1
             if calls["n"] == 1:
                 from openai import RateLimitError
@@ -145,7 +145,7 @@ def test_handle_llm_main_openai_error_branch(monkeypatch):
 
     calls = {"n": 0}
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             calls["n"] += 1
             if calls["n"] == 1:
                 from openai import OpenAIError
@@ -155,6 +155,7 @@ def test_handle_llm_main_openai_error_branch(monkeypatch):
     shared_mod.OAI = _O()
     asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(), "тест", reply_to_id=None))
     assert fake_bot.sent, "should produce a message on openai error"
+    assert calls["n"] == 1, "error path should not call the LLM again"
 
 
 def test_handle_llm_main_unexpected_error_branch(monkeypatch):
@@ -174,7 +175,7 @@ def test_handle_llm_main_unexpected_error_branch(monkeypatch):
 
     calls = {"n": 0}
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             calls["n"] += 1
             if calls["n"] == 1:
                 raise RuntimeError("x")
@@ -202,7 +203,7 @@ def test_handle_llm_empty_answer_generates_error(monkeypatch):
 
     calls = {"n": 0}
     class _O:
-        def ask(self, *a, **kw):
+        async def ask_async(self, *a, **kw):
             calls["n"] += 1
             if calls["n"] == 1:
                 return "  "  # empty
@@ -213,3 +214,161 @@ def test_handle_llm_empty_answer_generates_error(monkeypatch):
     assert fake_bot.sent, "should produce a generated error message on empty answer"
 
 
+
+
+def test_handle_llm_streaming_path_sends_progressively(monkeypatch):
+    import dataclasses
+
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    monkeypatch.setattr(shared_mod, "CFG", dataclasses.replace(shared_mod.CFG, enable_streaming=True))
+
+    class _StreamBot(_FakeBot):
+        def __init__(self):
+            super().__init__()
+            self.edits = []
+
+        async def edit_message_text(self, text: str, chat_id: int, message_id: int):
+            self.edits.append((message_id, text))
+            return True
+
+    fake_bot = _StreamBot()
+    shared_mod._bot = fake_bot
+    shared_mod.STICKERS = _DummyStickers()
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+
+    class _O:
+        async def stream_async(self, *a, **kw):
+            for d in ["От", "вет"]:
+                yield d
+
+    shared_mod.OAI = _O()
+    asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(), "привет", reply_to_id=None))
+    assert fake_bot.sent == [(1, "От", 10)]
+    assert fake_bot.edits[-1] == (1, "Ответ")
+
+
+def test_handle_llm_repeated_prompt_served_from_cache(monkeypatch):
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    fake_bot = _FakeBot()
+    shared_mod._bot = fake_bot
+    shared_mod.STICKERS = _DummyStickers()
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+
+    calls = {"n": 0}
+    class _O:
+        async def ask_async(self, *a, **kw):
+            calls["n"] += 1
+            return "Кэшируемый ответ"
+
+    shared_mod.OAI = _O()
+    # two different users asking the same thing produce the same prompt
+    for uid in (77, 78):
+        asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(user_id=uid), "одинаковый вопрос", reply_to_id=None))
+    assert calls["n"] == 1
+    assert [t for _, t, _ in fake_bot.sent] == ["Кэшируемый ответ"] * 2
+    # a private chat has a larger output budget, so the group answer is not reused
+    asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(user_id=79), "одинаковый вопрос", request_class="private"))
+    assert calls["n"] == 2
+    # with earlier turns packed into the prompt the answer is not shared
+    asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(user_id=77), "одинаковый вопрос"))
+    assert calls["n"] == 3
+
+
+def test_handle_llm_stream_error_finishes_the_posted_message(monkeypatch):
+    import dataclasses
+
+    from openai import OpenAIError
+
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    monkeypatch.setattr(shared_mod, "CFG", dataclasses.replace(
+        shared_mod.CFG, enable_streaming=True, stream_edit_interval_sec=0, enable_response_cache=False
+    ))
+    monkeypatch.setattr(shared_mod.PHRASES, "get", lambda category: "Модель легла")
+
+    class _StreamBot(_FakeBot):
+        def __init__(self):
+            super().__init__()
+            self.edits = []
+
+        async def edit_message_text(self, text: str, chat_id: int, message_id: int):
+            self.edits.append((message_id, text))
+            return True
+
+    fake_bot = _StreamBot()
+    shared_mod._bot = fake_bot
+    shared_mod.STICKERS = _DummyStickers()
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+
+    class _O:
+        async def stream_async(self, *a, **kw):
+            for d in ["Нач", "ало"]:
+                yield d
+            raise OpenAIError("stream broke")
+
+    shared_mod.OAI = _O()
+    asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(chat_id=2), "привет", reply_to_id=None))
+    # no separate error reply: the posted message is completed with the text so far and the error phrase
+    assert fake_bot.sent == [(2, "Нач", 10)]
+    assert fake_bot.edits[-1] == (1, "Начало\n\nМодель легла")
+
+
+def test_handle_llm_failed_final_edit_keeps_the_streamed_answer(monkeypatch):
+    import dataclasses
+
+    from aiogram.exceptions import TelegramBadRequest
+    from aiogram.methods import EditMessageText
+    from prometheus_client import REGISTRY
+
+    class _DummyTyping:
+        def __init__(self, *a, **kw):
+            pass
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    async def finish(self):
+        raise TelegramBadRequest(EditMessageText(text="Ответ"), "message to edit not found")
+
+    monkeypatch.setattr(chat_action_mod.ChatActionSender, "typing", _DummyTyping)
+    monkeypatch.setattr(shared_mod, "CFG", dataclasses.replace(shared_mod.CFG, enable_streaming=True, enable_response_cache=False))
+    monkeypatch.setattr(shared_mod.StreamRenderer, "finish", finish)
+    fake_bot = _FakeBot()
+    shared_mod._bot = fake_bot
+    shared_mod.STICKERS = _DummyStickers()
+    monkeypatch.setattr(shared_mod.RATE, "allow", lambda uid, cid: True)
+
+    class _O:
+        async def stream_async(self, *a, **kw):
+            yield "Ответ"
+
+    shared_mod.OAI = _O()
+    unexpected = REGISTRY.get_sample_value("bot_errors_total", {"kind": "unexpected"}) or 0.0
+    asyncio.run(shared_mod.handle_llm_request_shared(_FakeMsg(chat_id=3), "что нового", reply_to_id=None))
+    # no "unexpected" phrase on top of an answer the user already sees
+    assert fake_bot.sent == [(3, "Ответ", 10)]
+    assert (REGISTRY.get_sample_value("bot_errors_total", {"kind": "unexpected"}) or 0.0) == unexpected
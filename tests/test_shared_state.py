@@ -0,0 +1,150 @@
+import asyncio
+import os
+import socket
+import threading
+
+import fakeredis
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services.leader import run_as_leader
+from bot.services.rate_limit import RateLimiter
+from bot.services.state_backend import MemoryStateBackend, RedisStateBackend
+from bot.services.state_store import BotMessageStore, ExpiringDict
+
+
+@pytest.fixture
+def redis_url():
+    # a local Redis-protocol stand-in server on a free port (Lua scripts run via the [lua] extra)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{port}/0?protocol=2"
+    server.shutdown()
+    server.server_close()
+
+
+async def _instances(url: str, n: int = 2) -> list[RedisStateBackend]:
+    backends = [RedisStateBackend(url) for _ in range(n)]
+    for b in backends:
+        await b.open()
+    return backends
+
+
+def test_rate_limit_is_shared_and_atomic(redis_url):
+    async def run():
+        backends = await _instances(redis_url)
+        limiters = []
+        for b in backends:
+            limiter = RateLimiter(per_user_window_sec=60, per_user_max=2, per_chat_window_sec=60, per_chat_max=100)
+            limiter.backend = b
+            limiters.append(limiter)
+        results = await asyncio.gather(*(limiters[i % 2].acquire(7, -100) for i in range(6)))
+        for b in backends:
+            await b.close()
+        return results
+
+    results = asyncio.run(run())
+    assert sum(allowed for allowed, _ in results) == 2
+    assert all(wait > 0 for allowed, wait in results if not allowed)
+
+
+def test_claim_and_read_through_across_instances(redis_url):
+    async def run():
+        a, b = await _instances(redis_url)
+        polls_a = ExpiringDict("polls_shared_test", ttl_sec=3600, max_entries=10)
+        polls_b = ExpiringDict("polls_shared_test", ttl_sec=3600, max_entries=10)
+        polls_a.backend, polls_b.backend = a, b
+        claims = await asyncio.gather(polls_a.aclaim(1, "2099-01-01"), polls_b.aclaim(1, "2099-01-01"))
+        next_day = await polls_b.aclaim(1, "2099-01-02")
+
+        greet_a = ExpiringDict("greet_shared_test", ttl_sec=3600, max_entries=10)
+        greet_b = ExpiringDict("greet_shared_test", ttl_sec=3600, max_entries=10)
+        greet_a.backend, greet_b.backend = a, b
+        await greet_a.aset(5, 123.0)
+        own_write = await greet_a.aget(5)  # visible locally before the write-behind flush
+        before_flush = await greet_b.aget(5)
+        await a.flush()
+        after_flush = await greet_b.aget(5)
+        items = await greet_b.aitems()
+        for backend in (a, b):
+            await backend.close()
+        return claims, next_day, own_write, before_flush, after_flush, items
+
+    claims, next_day, own_write, before_flush, after_flush, items = asyncio.run(run())
+    assert sorted(claims) == [False, True]
+    assert next_day is True
+    assert own_write == 123.0
+    assert before_flush is None
+    assert after_flush == 123.0
+    assert items == [(5, 123.0)]
+
+
+def test_bot_messages_are_recognised_by_every_instance(redis_url):
+    async def run():
+        a, b = await _instances(redis_url)
+        msgs_a = BotMessageStore(per_chat=2, ttl_sec=3600, max_chats=10, name="msgs_shared_test")
+        msgs_b = BotMessageStore(per_chat=2, ttl_sec=3600, max_chats=10, name="msgs_shared_test")
+        msgs_a.backend, msgs_b.backend = a, b
+        await msgs_a.aupdate(-100, [1, 2])
+        await msgs_b.aadd(-100, 3)  # the shared ring keeps the newest two
+        seen = [await msgs_b.acontains(-100, mid) for mid in (1, 2, 3)]
+        seen_a = await msgs_a.acontains(-100, 3)
+        for backend in (a, b):
+            await backend.close()
+        return seen, seen_a
+
+    seen, seen_a = asyncio.run(run())
+    assert seen == [False, True, True]
+    assert seen_a is True
+
+
+def test_only_one_instance_runs_the_leader_job(redis_url):
+    async def run():
+        a, b = await _instances(redis_url)
+        running: list[str] = []
+
+        def job(name):
+            async def _job():
+                running.append(name)
+                await asyncio.Event().wait()
+            return _job
+
+        t_a = asyncio.create_task(run_as_leader(a, "idle_monitor", job("a"), lease_sec=0.3))
+        await asyncio.sleep(0.05)
+        t_b = asyncio.create_task(run_as_leader(b, "idle_monitor", job("b"), lease_sec=0.3))
+        await asyncio.sleep(0.5)
+        first = list(running)
+        t_a.cancel()  # leader goes away and releases the lease
+        await asyncio.gather(t_a, return_exceptions=True)
+        await asyncio.sleep(0.3)
+        second = list(running)
+        t_b.cancel()
+        await asyncio.gather(t_b, return_exceptions=True)
+        for backend in (a, b):
+            await backend.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == ["a"]
+    assert second == ["a", "b"]
+
+
+def test_local_backend_claim_and_leader():
+    polls = ExpiringDict("polls_local_test", ttl_sec=3600, max_entries=10)
+    polls.backend = MemoryStateBackend()
+    assert asyncio.run(polls.aclaim(1, "2099-01-01")) is True
+    assert asyncio.run(polls.aclaim(1, "2099-01-01")) is False
+
+    ran = []
+
+    async def job():
+        ran.append(True)
+
+    asyncio.run(run_as_leader(MemoryStateBackend(), "idle_monitor", job, lease_sec=30))
+    assert ran == [True]
@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services.state_backend import MemoryStateBackend, SQLiteStateBackend, create_state_backend
+from bot.services.state_store import BotMessageStore, ExpiringDict
+
+
+def test_sqlite_backend_write_behind_roundtrip(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def run():
+        backend = SQLiteStateBackend(path)
+        await backend.open()
+        backend.set("greet", 1, [1.0, "a"])
+        backend.set("greet", 1, [2.0, "b"])  # coalesced with the first write
+        backend.set("greet", 2, [3.0, "c"])
+        backend.delete("greet", 2)
+        assert await backend.load_all() == {}  # nothing written before flush
+        await backend.close()
+
+        reopened = SQLiteStateBackend(path)
+        await reopened.open()
+        snapshot = await reopened.load_all()
+        await reopened.close()
+        return snapshot
+
+    assert asyncio.run(run()) == {"greet": {"1": [2.0, "b"]}}
+
+
+def test_stores_write_through_and_restore():
+    backend = MemoryStateBackend()
+    greet = ExpiringDict("greet_test", ttl_sec=3600, max_entries=10)
+    msgs = BotMessageStore(per_chat=3, ttl_sec=3600, max_chats=10, name="msgs_test")
+    greet.backend = backend
+    msgs.backend = backend
+    greet[5] = 123.0
+    msgs.update(-100, [1, 2, 3, 4])
+
+    snapshot = asyncio.run(backend.load_all())
+    greet2 = ExpiringDict("greet_test", ttl_sec=3600, max_entries=10)
+    msgs2 = BotMessageStore(per_chat=3, ttl_sec=3600, max_chats=10, name="msgs_test")
+    greet2.restore(snapshot["greet_test"])
+    msgs2.restore(snapshot["msgs_test"])
+    assert greet2.get(5) == 123.0
+    assert not msgs2.contains(-100, 1)
+    assert all(msgs2.contains(-100, mid) for mid in (2, 3, 4))
+
+
+def test_create_state_backend_rejects_unknown_kind():
+    assert isinstance(create_state_backend("memory", ""), MemoryStateBackend)
+    try:
+        create_state_backend("etcd", "")
+    except RuntimeError:
+        return
+    raise AssertionError("expected RuntimeError")
@@ -0,0 +1,49 @@
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services import state_store as ss_mod
+from bot.services.state_store import BotMessageStore, ExpiringDict
+
+
+def _clock(monkeypatch, start: float = 1000.0):
+    now = [start]
+    monkeypatch.setattr(ss_mod.time, "time", lambda: now[0])
+    return now
+
+
+def test_expiring_dict_ttl_and_size(monkeypatch):
+    now = _clock(monkeypatch)
+    d = ExpiringDict("test", ttl_sec=10, max_entries=2)
+    d[1] = "a"
+    d[2] = "b"
+    d[3] = "c"
+    assert 1 not in d and d[3] == "c"
+    assert d.get(2, 0) == "b"
+    now[0] += 11
+    assert d.get(3) is None
+    d[4] = "x"  # writes sweep expired entries from the front
+    assert len(d) == 1
+
+
+def test_bot_message_store_ring_is_bounded(monkeypatch):
+    _clock(monkeypatch)
+    store = BotMessageStore(per_chat=3, ttl_sec=60, max_chats=10)
+    store.update(1, [10, 11, 12, 13])
+    assert not store.contains(1, 10)  # overwritten by the ring
+    assert all(store.contains(1, mid) for mid in (11, 12, 13))
+    assert not store.contains(2, 11)
+
+
+def test_bot_message_store_ttl_and_chat_eviction(monkeypatch):
+    now = _clock(monkeypatch)
+    store = BotMessageStore(per_chat=3, ttl_sec=60, max_chats=2)
+    store.add(1, 10)
+    now[0] += 61
+    assert not store.contains(1, 10)
+    store.add(2, 20)  # expired chat 1 is swept on write
+    assert len(store) == 1
+    store.add(3, 30)
+    store.add(4, 40)
+    assert len(store) == 2 and not store.contains(2, 20)
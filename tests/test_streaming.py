@@ -0,0 +1,64 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services.streaming import StreamRenderer
+
+
+class _FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, chat_id: int, text: str, reply_to_message_id: int | None = None):
+        self.sent.append((chat_id, text, reply_to_message_id))
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int):
+        self.edits.append((message_id, text))
+        return True
+
+
+def test_stream_renderer_posts_first_chunk_and_throttles_edits():
+    bot = _FakeBot()
+
+    async def run():
+        r = StreamRenderer(bot, chat_id=1, reply_to_message_id=7, chunk_size=100, edit_interval_sec=60)
+        await r.feed("Привет")
+        await r.feed(", ")
+        await r.feed("мир")
+        # still inside the throttle window: no edits yet
+        assert bot.edits == []
+        r._next_edit_at = 0
+        await r.finish()
+        return r
+
+    r = asyncio.run(run())
+    assert bot.sent == [(1, "Привет", 7)]
+    assert bot.edits == [(1, "Привет, мир")]
+    assert r.text == "Привет, мир"
+
+
+def test_stream_renderer_rolls_over_at_chunk_size():
+    bot = _FakeBot()
+
+    async def run():
+        r = StreamRenderer(bot, chat_id=1, reply_to_message_id=7, chunk_size=100, edit_interval_sec=0)
+        for _ in range(30):
+            await r.feed("слово ")
+        await r.finish()
+        return r
+
+    r = asyncio.run(run())
+    assert len(r.message_ids) == 2
+    assert bot.sent[1][2] is None  # continuation is not a reply
+    final_texts = {}
+    for _, text, _ in bot.sent:
+        final_texts.setdefault(len(final_texts) + 1, text)
+    for mid, text in bot.edits:
+        final_texts[mid] = text
+    assert all(len(t) <= 100 for t in final_texts.values())
+    assert "".join(final_texts[i] for i in sorted(final_texts)) == r.text
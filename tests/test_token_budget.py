@@ -0,0 +1,50 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from prometheus_client import REGISTRY
+
+from bot.openai_service import OpenAIService
+from bot.services.admission import AdmissionGate
+from bot.services.token_budget import TokenBudget, estimate_tokens, trim_to_tokens
+
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+
+def test_trim_keeps_whole_sentences_when_possible():
+    text = "Первое предложение тут. Второе тоже короткое! Третье уже не влезет никак."
+    assert trim_to_tokens(text, 100) == text
+    assert trim_to_tokens(text, 6, _words) == "Первое предложение тут. Второе тоже короткое!"
+    # no boundary in the first half of what fits: plain cut
+    assert trim_to_tokens("одно очень длинное предложение без точек вообще", 3, _words) == "одно очень длинное"
+    assert estimate_tokens(trim_to_tokens("слово " * 200, 50)) <= 50
+
+
+def test_budget_caps_output_trims_input_and_records_tokens():
+    calls: list[dict] = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(output_text="ok", usage=SimpleNamespace(input_tokens=12, output_tokens=3))
+
+    svc = OpenAIService(
+        client=SimpleNamespace(responses=SimpleNamespace(create=create)),
+        gate=AdmissionGate(limit=1, max_queue=1, deadline_sec=1),
+        estimator=_words,
+        budgets={"tiny": TokenBudget(max_input_tokens=4, max_output_tokens=64)},
+    )
+    before = REGISTRY.get_sample_value("bot_llm_request_tokens_sum", {"budget": "tiny", "kind": "output"}) or 0.0
+    messages = [{"role": "system", "content": "sys"}, {"role": "user", "content": "раз два три. четыре пять шесть"}]
+    asyncio.run(svc.ask_async(messages, "m", budget="tiny"))
+    asyncio.run(svc.ask_async(messages, "m"))
+
+    assert calls[0]["max_output_tokens"] == 64
+    assert calls[0]["input"] == "раз два три."
+    assert "max_output_tokens" not in calls[1] and calls[1]["input"] == "раз два три. четыре пять шесть"
+    assert REGISTRY.get_sample_value("bot_llm_request_tokens_sum", {"budget": "tiny", "kind": "output"}) == before + 3
+    assert REGISTRY.get_sample_value("bot_llm_input_tokens_estimated_count", {"budget": "tiny"}) >= 1
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import logging
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.logging_utils import CorrelationFilter, JsonFormatter, correlation_id
+from bot.tracing import TraceMiddleware, add_stage, annotate, current_trace, span, traced
+
+
+def _trace_records(caplog):
+    return [r for r in caplog.records if r.getMessage() == "trace"]
+
+
+def test_sampled_trace_logs_one_record_with_stage_durations(caplog):
+    caplog.handler.addFilter(CorrelationFilter())
+
+    async def handler():
+        with span("rate_limit"):
+            await asyncio.sleep(0)
+        for _ in range(2):
+            with span("send"):
+                await asyncio.sleep(0.01)
+        add_stage("typing", 0.5)
+        annotate(chat_id=42)
+        logging.warning("inside")
+        return current_trace().trace_id
+
+    async def run():
+        with traced("update", 1.0, update_id=7):
+            return await handler()
+
+    with caplog.at_level(logging.INFO):
+        trace_id = asyncio.run(run())
+
+    [record] = _trace_records(caplog)
+    assert record.trace_id == trace_id
+    assert record.extra["update_id"] == 7 and record.extra["chat_id"] == 42
+    assert set(record.extra["stages"]) == {"rate_limit", "send", "typing"}
+    assert record.extra["stages"]["send"] >= 20
+    assert record.extra["stages"]["typing"] == 500.0
+    inside = next(r for r in caplog.records if r.getMessage() == "inside")
+    assert json.loads(JsonFormatter().format(inside))["trace_id"] == trace_id
+    assert correlation_id.get() is None
+
+
+def test_unsampled_trace_keeps_correlation_id_but_records_nothing(caplog):
+    seen = []
+
+    async def handler(event, data):
+        with span("llm"):
+            seen.append(correlation_id.get())
+        with traced("nested", 1.0):  # joins the outer trace instead of starting one
+            seen.append(current_trace().trace_id)
+        return "done"
+
+    async def run():
+        mw = TraceMiddleware(sample_rate=0.0)
+        return await mw(handler, SimpleNamespace(update_id=1, event_type="message"), {})
+
+    with caplog.at_level(logging.INFO):
+        assert asyncio.run(run()) == "done"
+    assert seen[0] and seen[0] == seen[1]
+    assert _trace_records(caplog) == []
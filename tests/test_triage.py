@@ -0,0 +1,116 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from bot.services import triage
+from bot.services.triage import AddressedToBot, BotIdentity, match_bot_address
+
+ME = BotIdentity.from_user(SimpleNamespace(id=777, username="Lexa_Bot"))
+
+
+def _entity(kind: str, offset: int, length: int, user=None):
+    return SimpleNamespace(type=kind, offset=offset, length=length, user=user)
+
+
+def _msg(text=None, entities=None, caption=None, caption_entities=None):
+    return SimpleNamespace(text=text, entities=entities, caption=caption, caption_entities=caption_entities)
+
+
+def test_mention_is_case_insensitive():
+    m = _msg("эй @LEXA_bot ответь", [_entity("mention", 3, 9)])
+    assert match_bot_address(m, ME) == "@LEXA_bot"
+
+
+def test_other_mentions_are_rejected():
+    m = _msg("@someone_else привет", [_entity("mention", 0, 13)])
+    assert match_bot_address(m, ME) is None
+
+
+def test_text_mention_matches_by_user_id():
+    m = _msg("Лёха, скажи", [_entity("text_mention", 0, 4, user=SimpleNamespace(id=777))])
+    assert match_bot_address(m, ME) == "Лёха"
+    m = _msg("Вася, скажи", [_entity("text_mention", 0, 4, user=SimpleNamespace(id=1))])
+    assert match_bot_address(m, ME) is None
+
+
+def test_bot_command_must_target_this_bot():
+    assert match_bot_address(_msg("/ask@lexa_bot чё", [_entity("bot_command", 0, 13)]), ME) == "/ask@lexa_bot"
+    assert match_bot_address(_msg("/ask@other_bot чё", [_entity("bot_command", 0, 14)]), ME) is None
+
+
+def test_caption_entities_and_utf16_offsets():
+    # the emoji takes two UTF-16 code units, so the mention starts at offset 3
+    m = _msg(caption="😀 @lexa_bot", caption_entities=[_entity("mention", 3, 9)])
+    assert match_bot_address(m, ME) == "@lexa_bot"
+
+
+def test_filter_rejects_without_network(monkeypatch):
+    class _Bot:
+        calls = 0
+
+        async def get_me(self):
+            self.calls += 1
+            return SimpleNamespace(id=777, username="lexa_bot")
+
+    monkeypatch.setattr(triage, "_identity", None)
+    bot = _Bot()
+    plain = SimpleNamespace(text="просто болтаем", entities=None, caption=None, caption_entities=None)
+    assert asyncio.run(AddressedToBot()(plain, bot)) is False
+    assert bot.calls == 0
+
+    addressed = SimpleNamespace(text="@lexa_bot привет", entities=[_entity("mention", 0, 9)], caption=None, caption_entities=None)
+    assert asyncio.run(AddressedToBot()(addressed, bot)) == {"bot_address": "@lexa_bot"}
+    assert asyncio.run(AddressedToBot()(addressed, bot)) == {"bot_address": "@lexa_bot"}
+    assert bot.calls == 1  # identity is resolved once and cached
+
+
+def test_unaddressed_group_text_reaches_no_handler(monkeypatch):
+    from aiogram import Bot
+    from aiogram.types import Update
+
+    from bot.app import build_app
+    from bot.routers import groups, private, reactions
+
+    submitted = []
+
+    async def fake_submit(m, text, reply_to_id=None):
+        submitted.append((m.chat.type, text))
+
+    monkeypatch.setattr(triage, "_identity", ME)
+    monkeypatch.setattr(groups, "submit_llm_request", fake_submit)
+    monkeypatch.setattr(private, "submit_llm_request", fake_submit)
+
+    def _update(update_id, chat_type, text, entities=None):
+        message = {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": -100 if chat_type == "supergroup" else 5, "type": chat_type},
+            "from": {"id": 5, "is_bot": False, "first_name": "u"},
+            "text": text,
+        }
+        if entities:
+            message["entities"] = entities
+        return {"update_id": update_id, "message": message}
+
+    async def main():
+        bot = Bot(token="42:TEST")
+        dp = build_app(bot)
+        try:
+            for raw in (
+                _update(1, "supergroup", "просто болтаем"),
+                _update(2, "supergroup", "@someone глянь", [{"type": "mention", "offset": 0, "length": 8}]),
+                _update(3, "supergroup", "@lexa_bot ответь", [{"type": "mention", "offset": 0, "length": 9}]),
+                _update(4, "private", "привет"),
+            ):
+                await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+        finally:
+            # module-level routers can only be attached to one dispatcher at a time
+            for r in (groups.router, private.router, reactions.router):
+                r._parent_router = None
+            await bot.session.close()
+
+    asyncio.run(main())
+    assert submitted == [("supergroup", "ответь"), ("private", "привет")]
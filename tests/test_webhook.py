@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "TEST_OPENAI_KEY")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.ops import LoopLagMonitor, OpsServer
+from bot.webhook import SECRET_HEADER, WebhookIngress, build_webhook_app
+
+SECRET = "s3cret"
+
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "привет"},
+    }
+
+
+class _FakeDispatcher:
+    def __init__(self, hold: asyncio.Event | None = None):
+        self.hold = hold
+        self.fed: list[int] = []
+
+    async def feed_update(self, bot, update):
+        if self.hold is not None:
+            await self.hold.wait()
+        self.fed.append(update.update_id)
+
+
+async def _with_client(ingress: WebhookIngress, scenario):
+    async with TestClient(TestServer(build_webhook_app(ingress, "/hook", OpsServer(LoopLagMonitor(), {})))) as client:
+        await scenario(client)
+
+
+def test_rejects_wrong_secret_and_bad_payload():
+    dp = _FakeDispatcher()
+    ingress = WebhookIngress(dp, bot=object(), secret_token=SECRET)
+
+    async def scenario(client):
+        resp = await client.post("/hook", json=_update(1), headers={SECRET_HEADER: "nope"})
+        assert resp.status == 401
+        resp = await client.post("/hook", json={"nonsense": True}, headers={SECRET_HEADER: SECRET})
+        assert resp.status == 400
+        resp = await client.get("/healthz")
+        assert resp.status == 200
+
+    asyncio.run(_with_client(ingress, scenario))
+    assert dp.fed == []
+
+
+def test_acknowledges_before_processing_and_bounds_in_flight():
+    async def main():
+        hold = asyncio.Event()
+        dp = _FakeDispatcher(hold)
+        ingress = WebhookIngress(dp, bot=object(), secret_token=SECRET, max_in_flight=1)
+
+        async def scenario(client):
+            # first update is acknowledged while its handler is still blocked
+            resp = await client.post("/hook", json=_update(1), headers={SECRET_HEADER: SECRET})
+            assert resp.status == 200
+            assert dp.fed == []
+            # the second one waits for a free slot before it is acknowledged
+            second = asyncio.create_task(client.post("/hook", json=_update(2), headers={SECRET_HEADER: SECRET}))
+            await asyncio.sleep(0.05)
+            assert not second.done()
+            hold.set()
+            assert (await second).status == 200
+            await ingress.drain()
+            assert dp.fed == [1, 2]
+
+        await _with_client(ingress, scenario)
+
+    asyncio.run(main())